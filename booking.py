@@ -0,0 +1,108 @@
+"""
+Шаги записи на замер
+
+Сценарий записи описан таблицей шагов: у каждого шага есть состояние FSM,
+поле для сохранения, проверка, нормализация и текст-приглашение. Бот
+обрабатывает все шаги одним хендлером, выбирая шаг по состоянию за O(1).
+Чтобы добавить новое поле записи, достаточно добавить строку в таблицу
+(и состояние в `AppointmentStates`).
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
+from aiogram.fsm.state import State, StatesGroup
+from normalization import clean_address, clean_phone, is_valid_phone
+
+
+class AppointmentStates(StatesGroup):
+    """Состояния для записи на встречу"""
+    waiting_for_date = State()
+    waiting_for_time = State()
+    waiting_for_address = State()
+    waiting_for_phone = State()
+    waiting_for_notes = State()
+
+
+# Ответы, которыми пользователь пропускает необязательный шаг
+SKIP_WORDS = frozenset({'нет', '-', 'пропустить', 'skip'})
+
+# Ответы, которыми пользователь оставляет занятое время после подсказки свободных слотов
+CONFIRM_WORDS = frozenset({'да', 'оставить', 'ок', 'yes'})
+
+
+def _matches_format(fmt: str) -> Callable[[str], bool]:
+    def validator(text: str) -> bool:
+        try:
+            datetime.strptime(text, fmt)
+            return True
+        except ValueError:
+            return False
+    return validator
+
+
+@dataclass(frozen=True)
+class BookingStep:
+    """Шаг записи на замер"""
+    name: str
+    state: State
+    field: str
+    prompt: str
+    validator: Optional[Callable[[str], bool]] = None
+    normalizer: Callable[[str], str] = str
+    error: str = ""
+    skip_words: FrozenSet[str] = frozenset()
+
+
+BOOKING_STEPS: Tuple[BookingStep, ...] = (
+    BookingStep(
+        name="date",
+        state=AppointmentStates.waiting_for_date,
+        field="date",
+        prompt=(
+            "📅 Для записи на замер мне нужна некоторая информация.\n\n"
+            "Введите желаемую дату в формате ДД.ММ.ГГГГ (например, 25.12.2024):"
+        ),
+        validator=_matches_format("%d.%m.%Y"),
+        error="❌ Неверный формат даты. Пожалуйста, введите дату в формате ДД.ММ.ГГГГ (например, 25.12.2024):",
+    ),
+    BookingStep(
+        name="time",
+        state=AppointmentStates.waiting_for_time,
+        field="time",
+        prompt="⏰ Отлично! Теперь укажите удобное время (например, 14:00):",
+        validator=_matches_format("%H:%M"),
+        error="❌ Неверный формат времени. Пожалуйста, введите время в формате ЧЧ:ММ (например, 14:00):",
+    ),
+    BookingStep(
+        name="address",
+        state=AppointmentStates.waiting_for_address,
+        field="address",
+        prompt="🏠 Укажите адрес, куда должен приехать замерщик:",
+        normalizer=clean_address,
+    ),
+    BookingStep(
+        name="phone",
+        state=AppointmentStates.waiting_for_phone,
+        field="phone",
+        prompt="📞 Укажите ваш контактный телефон:",
+        validator=is_valid_phone,
+        normalizer=clean_phone,
+        error="❌ Не похоже на номер телефона. Пожалуйста, введите номер, например +7 999 123-45-67:",
+    ),
+    BookingStep(
+        name="notes",
+        state=AppointmentStates.waiting_for_notes,
+        field="notes",
+        prompt=(
+            "💬 Если у вас есть дополнительные пожелания или комментарии, напишите их. "
+            "Или отправьте 'нет' или '-' чтобы пропустить:"
+        ),
+        skip_words=SKIP_WORDS,
+    ),
+)
+
+# Шаг по строковому состоянию FSM и следующий за ним шаг
+STEP_BY_STATE: Dict[str, BookingStep] = {step.state.state: step for step in BOOKING_STEPS}
+NEXT_STEP: Dict[str, Optional[BookingStep]] = {
+    step.name: next_step for step, next_step in zip(BOOKING_STEPS, BOOKING_STEPS[1:] + (None,))
+}
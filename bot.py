@@ -1,34 +1,104 @@
 """
 Логика бота для записи на замер окон
 """
+import asyncio
+import logging
 import re
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.types import Message
+from config import Config, ConfigError
 from database import Database
+from knowledge import KnowledgeBaseStore
+from context_store import ContextStore
+from booking import AppointmentStates, BOOKING_STEPS, CONFIRM_WORDS, NEXT_STEP, STEP_BY_STATE
+from throttling import ThrottlingMiddleware
+from templates import brand_registry
+from bot_logging import CorrelationMiddleware
+from concurrency import AsyncDatabase, EventBuffer, MissLogBuffer, SharedResources, UserSerialMiddleware
 from models import Client, Appointment
-from datetime import datetime
+
+if TYPE_CHECKING:
+    from profiling import SamplingProfiler
 
 
-class AppointmentStates(StatesGroup):
-    """Состояния для записи на встречу"""
-    waiting_for_date = State()
-    waiting_for_time = State()
-    waiting_for_address = State()
-    waiting_for_phone = State()
-    waiting_for_notes = State()
+logger = logging.getLogger(__name__)
 
 
 class WindowBot:
     """Основной класс бота"""
     
-    def __init__(self, token: str):
-        self.bot = Bot(token=token)
+    def __init__(self, token: str, db: Optional[Database] = None, config: Optional[Config] = None,
+                 defer_warm_up: bool = False, shared: Optional[SharedResources] = None):
+        """
+        Args:
+            token: Токен Telegram бота
+            db: База данных (по умолчанию - по пути из настроек)
+            config: Настройки (по умолчанию - значения по умолчанию)
+            defer_warm_up: Загрузить базу знаний в фоне после начала polling
+            shared: Общие с другими ботами процесса ресурсы (многобрендовый режим)
+        """
+        self.config = config = config or Config()
+        self.shared = shared
+        # Тексты бренда собираются один раз; без своего оформления - общий реестр
+        try:
+            self.templates = brand_registry(config.branding.company, config.branding.templates_file)
+        except (OSError, ValueError) as e:
+            raise ConfigError(f"branding.templates_file: {e}")
+        self.bot = Bot(token=token, session=shared.session if shared else None)
         self.dp = Dispatcher(storage=MemoryStorage())
-        self.db = Database()
+        self.db = db or Database(config.database.path, busy_timeout=config.database.busy_timeout)
+        # Блокирующие запросы к SQLite выполняются в пуле потоков
+        self.adb = AsyncDatabase(self.db, max_workers=config.database.workers,
+                                 executor=shared.executor if shared else None)
+        # Повторы апдейтов отбрасываются до очередей и обработчиков; сохраненное
+        # окно читается из БД при запуске polling или на первом апдейте
+        from dedup import UpdateDedupMiddleware
+        self.dedup = UpdateDedupMiddleware(self.adb, window=config.dedup.window,
+                                           flush_interval=config.dedup.flush_interval)
+        self.dp.update.outer_middleware(self.dedup)
+        # Сначала очередь по пользователю, затем контекст логов: в нем уже актуальное состояние FSM
+        self.dp.update.outer_middleware(UserSerialMiddleware(
+            config.concurrency.max_updates, shared_limit=shared.update_limit if shared else None,
+        ))
+        self.dp.update.outer_middleware(CorrelationMiddleware(tenant=config.bot.name or None))
+        # Выборочное профилирование включается только явно (sample_every > 0)
+        self.profiler: Optional["SamplingProfiler"] = None
+        if config.profiling.sample_every > 0:
+            from profiling import SamplingProfiler, call_profiled
+            self.profiler = SamplingProfiler(config.profiling.sample_every,
+                                             trace_memory=config.profiling.trace_memory,
+                                             output_dir=config.profiling.output_dir)
+            self.dp.update.outer_middleware(self.profiler)
+            self.adb.call_wrapper = call_profiled
+        throttling = config.throttling
+        self.throttling = ThrottlingMiddleware(
+            rate_limit=throttling.rate_limit, window=throttling.window,
+            duplicate_window=throttling.duplicate_window, penalty=throttling.penalty,
+            max_penalty=throttling.max_penalty, max_users=throttling.max_users, templates=self.templates,
+        )
+        self.dp.message.outer_middleware(self.throttling)
+        self.events = EventBuffer(self.adb, batch_size=config.buffers.events_batch_size,
+                                  flush_interval=config.buffers.events_flush_interval)
+        self.kb = KnowledgeBaseStore(self.db, source_path=config.knowledge.file,
+                                     watch_interval=config.knowledge.watch_interval)
+        # Загрузку базы знаний можно отложить до начала polling (см. start)
+        self.defer_warm_up = defer_warm_up
+        self._kb_ready = asyncio.Event()
+        self._warm_up_task: Optional[asyncio.Task] = None
+        if not defer_warm_up:
+            self._load_knowledge_base()
+        self.admin_ids = frozenset(config.bot.admin_ids)
+        self.kb_misses = MissLogBuffer(self.adb, batch_size=config.buffers.kb_misses_batch_size,
+                                       flush_interval=config.buffers.kb_misses_flush_interval,
+                                       max_backlog=config.buffers.kb_misses_max_backlog)
+        self.contexts = ContextStore(max_bytes=config.context.max_bytes, adb=self.adb,
+                                     max_messages=config.context.max_messages,
+                                     max_topics=config.context.max_topics)
         self.setup_handlers()
     
     async def send_welcome_message(self, message: Message, is_new_user: bool = True, is_returning: bool = False) -> bool:
@@ -49,51 +119,27 @@ class WindowBot:
             
             # Формируем приветствие в зависимости от типа пользователя
             if is_returning:
-                greeting = f"С возвращением, {user_name}! 👋"
+                greeting_name = "greeting_returning"
             elif is_new_user:
-                greeting = f"Привет, {user_name}! 👋\nРады видеть вас впервые!"
+                greeting_name = "greeting_new"
             else:
-                greeting = f"Добро пожаловать, {user_name}! 👋"
+                greeting_name = "greeting_default"
+            greeting = self.templates.render(greeting_name, user.language_code, name=user_name)
             
-            # Основной текст приветствия
-            welcome_text = (
-                f"{greeting}\n\n"
-                "Я ваш умный помощник от компании Народные Окна!\n\n"
-                "Я помогу вам:\n"
-                "🪟 Подобрать пластиковые окна и профили\n"
-                "📅 Записаться на бесплатный замер\n"
-                "💬 Ответить на вопросы по монтажу и ценам\n"
-                "📍 Выбрать оптимальное решение для вашего помещения\n\n"
-                "Вы можете спросить меня:\n"
-                "• Какие окна лучше для квартиры?\n"
-                "• Сколько стоит установка?\n"
-                "• Как записаться на замер?\n\n"
-                "Напишите ваш вопрос или выберите команду:\n"
-                "/help - справка по командам\n"
-                "/book - запись на замер\n"
-                "/my_appointments - мои записи\n\n"
-                "Готовы подобрать идеальные окна? ☀️"
-            )
-            
-            # Создаем клавиатуру
-            keyboard = ReplyKeyboardMarkup(
-                keyboard=[
-                    [KeyboardButton(text="Записаться на замер")],
-                    [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                ],
-                resize_keyboard=True
-            )
+            # Основной текст приветствия собран заранее
+            welcome_text = f"{greeting}\n\n{self.templates.text('welcome_body', user.language_code)}"
+            keyboard = self.templates.markup("main", user.language_code)
             
             # Отправляем сообщение
             await message.answer(welcome_text, reply_markup=keyboard)
             
             # Логируем отправку
-            self.db.mark_welcome_sent(user.id, is_new_user)
-            print(f"Приветственное сообщение отправлено пользователю {user.id} ({user_name})")
+            await self.adb.mark_welcome_sent(user.id, is_new_user)
+            logger.info("Приветственное сообщение отправлено", extra={"user_name": user_name, "is_new_user": is_new_user})
             
             return True
-        except Exception as e:
-            print(f"Ошибка при отправке приветственного сообщения: {e}")
+        except Exception:
+            logger.exception("Ошибка при отправке приветственного сообщения")
             return False
     
     def setup_handlers(self):
@@ -104,24 +150,21 @@ class WindowBot:
         async def cmd_start(message: Message):
             user = message.from_user
             
-            # Регистрируем или обновляем клиента
+            # Регистрируем или обновляем клиента и проверяем, новый ли он или возвращается
+            # (все запросы - за один переход в пул потоков БД)
             client = Client(
                 user_id=user.id,
                 username=user.username,
                 first_name=user.first_name
             )
-            self.db.add_client(client)
-            
-            # Проверяем, новый ли пользователь или возвращается
-            is_new = self.db.is_new_user(user.id)
-            should_welcome_again = self.db.should_send_welcome_again(user.id)
+            is_new, should_welcome_again = await self.adb.run(self._register_client, client)
             is_returning = not is_new and should_welcome_again
             
             # Отправляем приветственное сообщение
             await self.send_welcome_message(message, is_new_user=is_new, is_returning=is_returning)
             
             # Обновляем активность
-            self.db.update_user_activity(user.id)
+            await self.adb.update_user_activity(user.id)
         
         # Обработчик команды /help
         @self.dp.message(Command("help"))
@@ -129,293 +172,39 @@ class WindowBot:
             user = message.from_user
             
             # Проверяем, новый ли пользователь
-            is_new = self.db.is_new_user(user.id)
+            is_new = await self.adb.is_new_user(user.id)
             
             # Если новый пользователь, отправляем полное приветствие
             if is_new:
                 await self.send_welcome_message(message, is_new_user=True)
             else:
                 # Для существующих пользователей - краткая справка
-                help_text = (
-                    "📋 Доступные команды:\n\n"
-                    "/start - Начать работу с ботом\n"
-                    "/book - Записаться на замер\n"
-                    "/my_appointments - Показать мои записи\n"
-                    "/faq - Часто задаваемые вопросы\n"
-                    "/ask - Задать вопрос\n"
-                    "/cancel - Отменить текущую операцию\n\n"
-                    "Также вы можете просто написать вопрос, и я постараюсь на него ответить!"
-                )
+                help_text = self.templates.text("help", user.language_code)
                 await message.answer(help_text)
             
             # Обновляем активность
-            self.db.update_user_activity(user.id)
+            await self.adb.update_user_activity(user.id)
         
         # Обработчик команды /book (запись на замер)
         @self.dp.message(Command("book"))
         @self.dp.message(F.text == "Записаться на замер")
         async def cmd_book(message: Message, state: FSMContext):
-            await state.set_state(AppointmentStates.waiting_for_date)
-            await message.answer(
-                "📅 Для записи на замер мне нужна некоторая информация.\n\n"
-                "Введите желаемую дату в формате ДД.ММ.ГГГГ (например, 25.12.2024):",
-                reply_markup=ReplyKeyboardRemove()
-            )
-        
-        # Обработчик даты
-        @self.dp.message(AppointmentStates.waiting_for_date)
-        async def process_date(message: Message, state: FSMContext):
-            date_text = message.text.strip()
-            
-            # ВАЖНО: Проверяем вопрос ПЕРЕД валидацией даты
-            # Это должно быть первым делом, чтобы не парсить вопросы как даты
-            if self._is_question(date_text):
-                await state.clear()  # Очищаем состояние
-                keyboard = ReplyKeyboardMarkup(
-                    keyboard=[
-                        [KeyboardButton(text="Записаться на замер")],
-                        [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                    ],
-                    resize_keyboard=True
-                )
-                await message.answer(
-                    "ℹ️ Запись отменена. Отвечаю на ваш вопрос:",
-                    reply_markup=keyboard
-                )
-                # Обрабатываем как вопрос
-                await self._process_question(message, date_text)
-                return  # ВАЖНО: возвращаемся, чтобы не продолжать обработку
-            
-            # Простая валидация даты (только если это не вопрос)
-            try:
-                datetime.strptime(date_text, "%d.%m.%Y")
-                await state.update_data(date=date_text)
-                await state.set_state(AppointmentStates.waiting_for_time)
-                await message.answer(
-                    "⏰ Отлично! Теперь укажите удобное время (например, 14:00):"
-                )
-            except ValueError:
-                # Если не удалось распарсить как дату, проверяем еще раз, не вопрос ли это
-                if self._is_question(date_text):
-                    await state.clear()
-                    keyboard = ReplyKeyboardMarkup(
-                        keyboard=[
-                            [KeyboardButton(text="Записаться на замер")],
-                            [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                        ],
-                        resize_keyboard=True
-                    )
-                    await message.answer(
-                        "ℹ️ Запись отменена. Отвечаю на ваш вопрос:",
-                        reply_markup=keyboard
-                    )
-                    await self._process_question(message, date_text)
-                else:
-                    await message.answer(
-                        "❌ Неверный формат даты. Пожалуйста, введите дату в формате ДД.ММ.ГГГГ (например, 25.12.2024):"
-                    )
-        
-        # Обработчик времени
-        @self.dp.message(AppointmentStates.waiting_for_time)
-        async def process_time(message: Message, state: FSMContext):
-            time_text = message.text.strip()
-            
-            # ВАЖНО: Проверяем вопрос ПЕРЕД валидацией времени
-            if self._is_question(time_text):
-                await state.clear()
-                keyboard = ReplyKeyboardMarkup(
-                    keyboard=[
-                        [KeyboardButton(text="Записаться на замер")],
-                        [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                    ],
-                    resize_keyboard=True
-                )
-                await message.answer(
-                    "ℹ️ Запись отменена. Отвечаю на ваш вопрос:",
-                    reply_markup=keyboard
-                )
-                await self._process_question(message, time_text)
-                return
-            
-            # Простая валидация времени (только если это не вопрос)
-            try:
-                datetime.strptime(time_text, "%H:%M")
-                await state.update_data(time=time_text)
-                await state.set_state(AppointmentStates.waiting_for_address)
-                await message.answer(
-                    "🏠 Укажите адрес, куда должен приехать замерщик:"
-                )
-            except ValueError:
-                # Если не удалось распарсить как время, проверяем еще раз, не вопрос ли это
-                if self._is_question(time_text):
-                    await state.clear()
-                    keyboard = ReplyKeyboardMarkup(
-                        keyboard=[
-                            [KeyboardButton(text="Записаться на замер")],
-                            [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                        ],
-                        resize_keyboard=True
-                    )
-                    await message.answer(
-                        "ℹ️ Запись отменена. Отвечаю на ваш вопрос:",
-                        reply_markup=keyboard
-                    )
-                    await self._process_question(message, time_text)
-                else:
-                    await message.answer(
-                        "❌ Неверный формат времени. Пожалуйста, введите время в формате ЧЧ:ММ (например, 14:00):"
-                    )
-        
-        # Обработчик адреса
-        @self.dp.message(AppointmentStates.waiting_for_address)
-        async def process_address(message: Message, state: FSMContext):
-            address = message.text.strip()
-            
-            # Проверяем, не является ли это вопросом
-            if self._is_question(address):
-                await state.clear()
-                keyboard = ReplyKeyboardMarkup(
-                    keyboard=[
-                        [KeyboardButton(text="Записаться на замер")],
-                        [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                    ],
-                    resize_keyboard=True
-                )
-                await message.answer(
-                    "ℹ️ Запись отменена. Отвечаю на ваш вопрос:",
-                    reply_markup=keyboard
-                )
-                # Обрабатываем как вопрос
-                await self._process_question(message, address)
-                return
-            
-            await state.update_data(address=address)
-            await state.set_state(AppointmentStates.waiting_for_phone)
+            first_step = BOOKING_STEPS[0]
+            await state.set_state(first_step.state)
+            self.events.add("booking_started", message.from_user.id, first_step.name)
             await message.answer(
-                "📞 Укажите ваш контактный телефон:"
+                first_step.prompt,
+                reply_markup=self.templates.markup("remove", message.from_user.language_code)
             )
         
-        # Обработчик телефона
-        @self.dp.message(AppointmentStates.waiting_for_phone)
-        async def process_phone(message: Message, state: FSMContext):
-            phone = message.text.strip()
-            
-            # Проверяем, не является ли это вопросом
-            if self._is_question(phone):
-                await state.clear()
-                keyboard = ReplyKeyboardMarkup(
-                    keyboard=[
-                        [KeyboardButton(text="Записаться на замер")],
-                        [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                    ],
-                    resize_keyboard=True
-                )
-                await message.answer(
-                    "ℹ️ Запись отменена. Отвечаю на ваш вопрос:",
-                    reply_markup=keyboard
-                )
-                # Обрабатываем как вопрос
-                await self._process_question(message, phone)
-                return
-            
-            await state.update_data(phone=phone)
-            await state.set_state(AppointmentStates.waiting_for_notes)
-            await message.answer(
-                "💬 Если у вас есть дополнительные пожелания или комментарии, напишите их. "
-                "Или отправьте 'нет' или '-' чтобы пропустить:"
-            )
-        
-        # Обработчик комментариев и финальное сохранение
-        @self.dp.message(AppointmentStates.waiting_for_notes)
-        async def process_notes(message: Message, state: FSMContext):
-            notes = message.text.strip()
-            
-            # Проверяем, не является ли это вопросом (но пропускаем стандартные ответы для пропуска)
-            if notes.lower() not in ['нет', '-', 'пропустить', 'skip'] and self._is_question(notes):
-                await state.clear()
-                keyboard = ReplyKeyboardMarkup(
-                    keyboard=[
-                        [KeyboardButton(text="Записаться на замер")],
-                        [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                    ],
-                    resize_keyboard=True
-                )
-                await message.answer(
-                    "ℹ️ Запись отменена. Отвечаю на ваш вопрос:",
-                    reply_markup=keyboard
-                )
-                # Обрабатываем как вопрос
-                await self._process_question(message, notes)
-                return
-            
-            if notes.lower() in ['нет', '-', 'пропустить', 'skip']:
-                notes = None
-            
-            data = await state.get_data()
-            
-            # Создаем запись
-            appointment = Appointment(
-                id=None,
-                user_id=message.from_user.id,
-                date=data['date'],
-                time=data['time'],
-                address=data['address'],
-                phone=data['phone'],
-                notes=notes
-            )
-            
-            # Сохраняем в БД
-            if self.db.add_appointment(appointment):
-                # Обновляем данные клиента
-                client = self.db.get_client(message.from_user.id)
-                if client:
-                    client.phone = data['phone']
-                    client.address = data['address']
-                    self.db.add_client(client)
-                
-                success_text = (
-                    "✅ Запись успешно создана!\n\n"
-                    f"📅 Дата: {data['date']}\n"
-                    f"⏰ Время: {data['time']}\n"
-                    f"🏠 Адрес: {data['address']}\n"
-                    f"📞 Телефон: {data['phone']}\n"
-                )
-                if notes:
-                    success_text += f"💬 Комментарий: {notes}\n"
-                
-                success_text += "\nМы свяжемся с вами для подтверждения записи."
-                
-                keyboard = ReplyKeyboardMarkup(
-                    keyboard=[
-                        [KeyboardButton(text="Записаться на замер")],
-                        [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                    ],
-                    resize_keyboard=True
-                )
-                
-                await message.answer(success_text, reply_markup=keyboard)
-            else:
-                await message.answer(
-                    "❌ Произошла ошибка при сохранении записи. Попробуйте еще раз.",
-                    reply_markup=ReplyKeyboardMarkup(
-                        keyboard=[
-                            [KeyboardButton(text="Записаться на замер")],
-                            [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                        ],
-                        resize_keyboard=True
-                    )
-                )
-            
-            await state.clear()
-        
         # Обработчик команды /my_appointments
         @self.dp.message(Command("my_appointments"))
         @self.dp.message(F.text == "Мои записи")
         async def cmd_my_appointments(message: Message):
-            appointments = self.db.get_user_appointments(message.from_user.id)
+            appointments = await self.adb.get_user_appointments(message.from_user.id)
             
             if not appointments:
-                await message.answer("📋 У вас пока нет записей. Используйте /book для создания новой записи.")
+                await message.answer(self.templates.text("no_appointments", message.from_user.language_code))
                 return
             
             text = "📋 Ваши записи:\n\n"
@@ -433,57 +222,105 @@ class WindowBot:
         @self.dp.message(Command("ask"))
         @self.dp.message(F.text == "Консультация")
         async def cmd_ask(message: Message):
-            await message.answer(
-                "💬 Задайте ваш вопрос о пластиковых окнах, и я постараюсь помочь!"
-            )
+            await message.answer(self.templates.text("ask", message.from_user.language_code))
         
         # Обработчик команды /faq
         @self.dp.message(Command("faq"))
         async def cmd_faq(message: Message):
-            faq_text = (
-                "📋 Часто задаваемые вопросы:\n\n"
-                "💰 **О стоимости:**\n"
-                "• Цена зависит от размера, профиля и стеклопакета\n"
-                "• Минимальная цена от 5000 рублей\n"
-                "• Точную стоимость рассчитает замерщик бесплатно\n\n"
-                "📅 **О замере:**\n"
-                "• Замер производится бесплатно\n"
-                "• Используйте /book для записи\n"
-                "• Специалист приедет в удобное время\n\n"
-                "⏱️ **О сроках:**\n"
-                "• Изготовление: 5-7 рабочих дней\n"
-                "• Установка: 1-2 дня после изготовления\n\n"
-                "🛡️ **О гарантии:**\n"
-                "• Гарантия на окна до 5 лет\n"
-                "• Гарантия на установку\n\n"
-                "🪟 **О выборе окон:**\n"
-                "• Работаем с профилями Rehau, KBE, Veka\n"
-                "• Подберем оптимальный вариант при замере\n\n"
-                "💬 Для сложных вопросов (сравнение, отличия) рекомендую записаться на бесплатный замер - наш специалист даст детальную консультацию!"
-            )
+            faq_text = self.templates.text("faq", message.from_user.language_code)
             await message.answer(faq_text)
         
         # Обработчик команды /cancel
         @self.dp.message(Command("cancel"))
         async def cmd_cancel(message: Message, state: FSMContext):
+            user = message.from_user
             current_state = await state.get_state()
             if current_state is None:
-                await message.answer("Нет активных операций для отмены.")
+                await message.answer(self.templates.text("nothing_to_cancel", user.language_code))
                 return
             
             await state.clear()
-            keyboard = ReplyKeyboardMarkup(
-                keyboard=[
-                    [KeyboardButton(text="Записаться на замер")],
-                    [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
-                ],
-                resize_keyboard=True
-            )
+            step = STEP_BY_STATE.get(current_state)
+            if step is not None:
+                self.events.add("booking_abandoned", message.from_user.id, step.name)
+            keyboard = self.templates.markup("main", user.language_code)
             await message.answer(
-                "❌ Операция отменена.",
+                self.templates.text("cancelled", user.language_code),
                 reply_markup=keyboard
             )
         
+        # Обработчик команды /reload_kb (только для администраторов)
+        @self.dp.message(Command("reload_kb"), F.from_user.id.in_(self.admin_ids))
+        async def cmd_reload_kb(message: Message):
+            locale = message.from_user.language_code
+            try:
+                snapshot = await asyncio.to_thread(self.kb.reload)
+            except Exception as e:
+                logger.exception("Ошибка перезагрузки базы знаний")
+                await message.answer(self.templates.render("kb_reload_failed", locale, error=e))
+                return
+            await message.answer(self.templates.render("kb_reloaded", locale, count=len(snapshot), version=snapshot.version))
+        
+        # Обработчик команды /profile (только для администраторов): сохранить профиль, "/profile reset" - сбросить
+        @self.dp.message(Command("profile"), F.from_user.id.in_(self.admin_ids))
+        async def cmd_profile(message: Message, command: CommandObject):
+            locale = message.from_user.language_code
+            if self.profiler is None:
+                await message.answer(self.templates.text("profile_disabled", locale))
+                return
+            if command.args == "reset":
+                self.profiler.reset()
+                await message.answer(self.templates.text("profile_reset", locale))
+                return
+            path = await asyncio.to_thread(self.profiler.dump)
+            if path is None:
+                await message.answer(self.templates.text("profile_empty", locale))
+                return
+            # Полный отчет - в файле, в сообщение помещается только начало
+            summary = self.profiler.report(limit=10)[:3000]
+            await message.answer(self.templates.render("profile_saved", locale, path=path, summary=summary))
+        
+        # Обработчик шагов записи на замер (дата, время, адрес, телефон, комментарий)
+        # Регистрируется после команд, чтобы /cancel и другие команды работали во время записи
+        @self.dp.message(StateFilter(AppointmentStates), F.text)
+        async def process_booking_step(message: Message, state: FSMContext, raw_state: str):
+            step = STEP_BY_STATE[raw_state]
+            text = message.text.strip()
+            skipped = text.lower() in step.skip_words
+            
+            # ВАЖНО: Проверяем вопрос ПЕРЕД валидацией, чтобы не парсить вопросы как данные
+            if not skipped and self._is_question(text):
+                await self._cancel_booking_for_question(message, state, text, step.name)
+                return
+            
+            logger.debug("Шаг записи", extra={"step": step.name, "skipped": skipped})
+            # Если выбранный час уже заполнен, один раз предлагаем соседние свободные слоты
+            if step.name == "time":
+                data = await state.get_data()
+                if data.get("slot_warned") and text.lower() in CONFIRM_WORDS:
+                    text = data["slot_warned"]
+                elif step.validator(text) and data.get("slot_warned") != text:
+                    hint = await self._crowded_slot_hint(data["date"], text, message.from_user.language_code)
+                    if hint is not None:
+                        await state.update_data(slot_warned=text)
+                        await message.answer(hint)
+                        return
+            
+            if not skipped and step.validator is not None and not step.validator(text):
+                await message.answer(step.error)
+                return
+            
+            await state.update_data({step.field: None if skipped else step.normalizer(text)})
+            
+            next_step = NEXT_STEP[step.name]
+            if next_step is None:
+                await self._finish_booking(message, state)
+                return
+            
+            await state.set_state(next_step.state)
+            self.events.add("step_completed", message.from_user.id, step.name)
+            await message.answer(next_step.prompt)
+        
         # Обработчик текстовых сообщений (консультация)
         # ВАЖНО: Этот обработчик имеет НИЗКИЙ приоритет, так как обработчики состояний FSM срабатывают первыми
         # Поэтому здесь обрабатываются только сообщения БЕЗ активного состояния
@@ -501,7 +338,7 @@ class WindowBot:
                 return
             
             # Проверяем, новый ли пользователь (первое сообщение)
-            is_new = self.db.is_new_user(user.id)
+            is_new = await self.adb.is_new_user(user.id)
             if is_new:
                 # Регистрируем клиента
                 client = Client(
@@ -509,49 +346,151 @@ class WindowBot:
                     username=user.username,
                     first_name=user.first_name
                 )
-                self.db.add_client(client)
+                await self.adb.add_client(client)
                 
                 # Отправляем приветственное сообщение
                 await self.send_welcome_message(message, is_new_user=True)
                 # Обновляем активность
-                self.db.update_user_activity(user.id)
+                await self.adb.update_user_activity(user.id)
                 return
             
-            # Обновляем активность пользователя
-            self.db.update_user_activity(user.id)
-            
-            # Проверяем, является ли вопрос сложным (сравнение, отличие, цена/количество и т.д.)
-            if self.db.is_complex_question(query):
-                complex_response = (
-                    "Этот вопрос сложный, я не могу ответить.\n\n"
-                    "Это можно узнать:\n"
-                    "• 📋 В разделе /faq с часто задаваемыми вопросами\n"
-                    "• 📅 Записавшись на бесплатный замер (/book) - наш специалист даст детальную консультацию и ответит на все вопросы\n"
-                    "• 💬 Задав более простой вопрос, на который я смогу ответить"
+            # Отвечаем на вопрос (общая логика с отменой записи)
+            await self._process_question(message, query)
+    
+    async def start(self, handle_signals: bool = True):
+        """
+        Запуск бота
+        
+        Args:
+            handle_signals: Останавливать polling по SIGINT/SIGTERM (при нескольких
+                ботах в процессе сигналы обрабатывает общий цикл запуска)
+        """
+        # Окно защиты от повторов читается до первого запроса обновлений
+        self.dp.startup.register(self.dedup.load)
+        if self.defer_warm_up:
+            self.dp.startup.register(self._start_warm_up)
+        else:
+            self.kb.start()
+        # Общую HTTP-сессию закрывает ее владелец, а не первый остановившийся бот
+        await self.dp.start_polling(self.bot, handle_signals=handle_signals,
+                                    close_bot_session=self.shared is None)
+    
+    def _load_knowledge_base(self):
+        """Заполнить пустую базу знаний начальными вопросами и загрузить снимок"""
+        self.db.init_knowledge_base(self.config.branding.company)
+        self.kb.reload()
+        self._kb_ready.set()
+    
+    async def _start_warm_up(self):
+        """Загрузить базу знаний в фоне, не задерживая первый запрос обновлений"""
+        async def warm_up():
+            try:
+                await asyncio.to_thread(self.db.init_knowledge_base, self.config.branding.company)
+                await asyncio.to_thread(self.kb.reload)
+            except Exception:
+                logger.exception("Ошибка загрузки базы знаний")
+            finally:
+                # Даже без базы знаний вопросы не должны ждать вечно
+                self._kb_ready.set()
+            self.kb.start()
+        
+        self._warm_up_task = asyncio.create_task(warm_up())
+    
+    async def _crowded_slot_hint(self, day_text: str, time_text: str, locale: Optional[str]) -> Optional[str]:
+        """Подсказка со свободными соседними слотами, если на выбранный час записей не меньше, чем замерщиков"""
+        from routes import suggest_slots
+        routes = self.config.routes
+        day = datetime.strptime(day_text, "%d.%m.%Y").date()
+        hour = datetime.strptime(time_text, "%H:%M").hour
+        loads = await self.adb.get_slot_loads(day.isoformat(), day.isoformat())
+        slots = suggest_slots(loads, day, hour, routes.surveyors, routes.day_start, routes.day_end)
+        if not slots:
+            return None
+        labels = [f"{slot_hour:02d}:00" for _, slot_hour in slots]
+        return self.templates.render("slot_crowded", locale, date=day_text, time=time_text, slots=", ".join(labels))
+    
+    @staticmethod
+    def _register_client(db: Database, client: Client):
+        """
+        Регистрирует клиента и возвращает (новый ли он, пора ли приветствовать снова)
+        """
+        db.add_client(client)
+        return db.is_new_user(client.user_id), db.should_send_welcome_again(client.user_id)
+    
+    async def _cancel_booking_for_question(self, message: Message, state: FSMContext, text: str, step_name: str):
+        """
+        Отменяет запись, если пользователь вместо данных задал вопрос, и отвечает на него
+        """
+        user = message.from_user
+        await state.clear()
+        self.events.add("booking_abandoned", user.id, step_name)
+        keyboard = self.templates.markup("main", user.language_code)
+        await message.answer(
+            self.templates.text("booking_cancelled_for_question", user.language_code),
+            reply_markup=keyboard
+        )
+        await self._process_question(message, text)
+    
+    async def _finish_booking(self, message: Message, state: FSMContext):
+        """
+        Сохраняет запись по данным, собранным на всех шагах
+        """
+        user = message.from_user
+        data = await state.get_data()
+        notes = data.get('notes')
+        
+        # Создаем запись
+        appointment = Appointment(
+            id=None,
+            user_id=user.id,
+            date=data['date'],
+            time=data['time'],
+            address=data['address'],
+            phone=data['phone'],
+            notes=notes
+        )
+        
+        # Сохраняем в БД; повторная запись на тот же адрес переносит существующую
+        saved, merged = await self.adb.add_or_merge_appointment(appointment)
+        if saved:
+            self.events.add("booking_completed", user.id, BOOKING_STEPS[-1].name)
+            if merged is not None:
+                self.events.add("booking_merged", user.id)
+            # Обновляем данные клиента
+            client = await self.adb.get_client(user.id)
+            if client:
+                client.phone = data['phone']
+                client.address = data['address']
+                await self.adb.add_client(client)
+            
+            if merged is None:
+                success_text = "✅ Запись успешно создана!\n\n"
+            else:
+                success_text = (
+                    f"✅ У вас уже была запись по этому адресу на {merged.date} в {merged.time} - "
+                    "мы перенесли ее на новое время.\n\n"
                 )
-                await message.answer(complex_response)
-                return
+            success_text += (
+                f"📅 Дата: {data['date']}\n"
+                f"⏰ Время: {data['time']}\n"
+                f"🏠 Адрес: {data['address']}\n"
+                f"📞 Телефон: {data['phone']}\n"
+            )
+            if notes:
+                success_text += f"💬 Комментарий: {notes}\n"
             
-            # Ищем ответ в базе знаний
-            answer = self.db.search_knowledge_base(query)
+            success_text += "\nМы свяжемся с вами для подтверждения записи."
             
-            if answer:
-                await message.answer(answer)
-            else:
-                # Если не нашли ответ, предлагаем варианты
-                no_answer_response = (
-                    "Извините, я не нашел точный ответ на ваш вопрос в базе знаний.\n\n"
-                    "Попробуйте:\n"
-                    "• Переформулировать вопрос более просто\n"
-                    "• Посмотреть /faq с часто задаваемыми вопросами\n"
-                    "• Записаться на бесплатный замер (/book) - наш специалист ответит на все вопросы\n"
-                    "• Задать другой вопрос"
-                )
-                await message.answer(no_answer_response)
-    
-    async def start(self):
-        """Запуск бота"""
-        await self.dp.start_polling(self.bot)
+            keyboard = self.templates.markup("main", user.language_code)
+            
+            await message.answer(success_text, reply_markup=keyboard)
+        else:
+            await message.answer(
+                self.templates.text("booking_failed", user.language_code),
+                reply_markup=self.templates.markup("main", user.language_code)
+            )
+        
+        await state.clear()
     
     def _is_question(self, text: str) -> bool:
         """
@@ -630,6 +569,16 @@ class WindowBot:
         
         return False
     
+    def _is_follow_up(self, text: str) -> bool:
+        """
+        Проверяет, похож ли текст на уточнение к предыдущему вопросу ("а для балкона?")
+        """
+        text_lower = text.lower().strip()
+        if text_lower.startswith(("а ", "и ", "а если", "а что")):
+            return True
+        # Короткая реплика, начинающаяся с предлога, своей темы не содержит
+        return len(text_lower.split()) <= 3 and text_lower.startswith(("для ", "на ", "в ", "с ", "про "))
+    
     async def _process_question(self, message: Message, query: str):
         """
         Обрабатывает вопрос пользователя
@@ -637,39 +586,62 @@ class WindowBot:
         user = message.from_user
         
         # Обновляем активность пользователя
-        self.db.update_user_activity(user.id)
+        await self.adb.update_user_activity(user.id)
+        
+        # Запоминаем сообщение в контексте диалога, сохранив предыдущие тему и сообщение
+        context = await self.contexts.get(user.id)
+        last_topic, last_message = context.last_topic, context.last_message
+        await self.contexts.add_message(user.id, query)
+        
+        # Сразу после запуска база знаний может еще загружаться
+        if not self._kb_ready.is_set():
+            await self._kb_ready.wait()
         
         # Проверяем, является ли вопрос сложным (сравнение, отличие, цена/количество и т.д.)
         if self.db.is_complex_question(query):
-            complex_response = (
-                "Этот вопрос сложный, я не могу ответить.\n\n"
-                "Это можно узнать:\n"
-                "• 📋 В разделе /faq с часто задаваемыми вопросами\n"
-                "• 📅 Записавшись на бесплатный замер (/book) - наш специалист даст детальную консультацию и ответит на все вопросы\n"
-                "• 💬 Задав более простой вопрос, на который я смогу ответить"
-            )
+            complex_response = self.templates.text("complex_question", user.language_code)
             await message.answer(complex_response)
             return
         
+        # Уточняющий вопрос ("а для балкона?") сначала ищем вместе с предыдущей темой, затем
+        # с предыдущим сообщением: сам по себе он может случайно совпасть с чужим вопросом
+        answer = None
+        topic = query
+        if self._is_follow_up(query):
+            for previous in dict.fromkeys(filter(None, (last_topic, last_message))):
+                answer = self.kb.search(f"{previous} {query}")
+                if answer is not None:
+                    # Уточнение не меняет тему диалога
+                    topic = previous
+                    break
+        
         # Ищем ответ в базе знаний
-        answer = self.db.search_knowledge_base(query)
+        if answer is None:
+            topic = query
+            answer = self.kb.search(query)
+        
+        self.events.add("kb_hit" if answer else "kb_miss", user.id)
+        logger.debug("Поиск в базе знаний", extra={"hit": answer is not None, "follow_up": topic != query})
         
         if answer:
+            if topic != last_topic:
+                await self.contexts.add_topic(user.id, topic)
             await message.answer(answer)
         else:
             # Если не нашли ответ, предлагаем варианты
-            no_answer_response = (
-                "Извините, я не нашел точный ответ на ваш вопрос в базе знаний.\n\n"
-                "Попробуйте:\n"
-                "• Переформулировать вопрос более просто\n"
-                "• Посмотреть /faq с часто задаваемыми вопросами\n"
-                "• Записаться на бесплатный замер (/book) - наш специалист ответит на все вопросы\n"
-                "• Задать другой вопрос"
-            )
+            self.kb_misses.add(user.id, query)
+            no_answer_response = self.templates.text("no_answer", user.language_code)
             await message.answer(no_answer_response)
     
     async def stop(self):
         """Остановка бота"""
-        await self.bot.session.close()
+        self.kb.stop()
+        await self.dedup.flush()
+        await self.events.stop()
+        await self.kb_misses.stop()
+        await self.contexts.flush()
+        self.adb.close()
+        if self.shared is None:
+            await self.bot.session.close()
 
 
@@ -0,0 +1,152 @@
+"""
+Структурное логирование бота
+
+Записи лога выводятся в JSON по одной на строку. Обработчики бота только
+кладут запись в очередь (`StructuredQueueHandler`), а форматирование и вывод
+делает отдельный поток (`QueueListener`), поэтому медленный stdout не блокирует
+цикл событий. К каждой записи автоматически добавляются update_id, user_id
+и состояние FSM текущего апдейта. DEBUG-записи можно прореживать.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+
+# Контекст текущего апдейта: update_id, user_id, fsm_state
+update_context: ContextVar[Dict[str, Any]] = ContextVar("update_context", default={})
+
+# Стандартные атрибуты LogRecord, которые не нужно дублировать в JSON
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_TRACEBACK_FORMATTER = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирование записи лога в одну строку JSON"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        payload: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        payload.update(getattr(record, "context", None) or {})
+        # Поля, переданные через extra=
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "context":
+                payload[key] = value
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        elif record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            payload["stack"] = record.stack_info
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """
+    `QueueHandler`, который кладет в очередь запись, а не готовую строку
+    
+    Стандартный `prepare` форматирует запись и склеивает трассировку с
+    текстом сообщения. Здесь в потоке обработчика только подставляются
+    аргументы сообщения и трассировка переводится в текст (`exc_text`), а
+    JSON собирает `JsonFormatter` в потоке вывода.
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _TRACEBACK_FORMATTER.formatException(record.exc_info)
+            # Объект исключения держит кадры стека: в очередь идет только текст
+            record.exc_info = None
+        return record
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись контекст апдейта, пока запись еще в потоке обработчика"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.context = update_context.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю `rate` DEBUG-записей, остальные уровни не трогает"""
+    
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class CorrelationMiddleware(BaseMiddleware):
+    """Запоминает update_id, user_id и состояние FSM для всех логов апдейта"""
+    
+    def __init__(self, tenant: Optional[str] = None):
+        # Бренд в многобрендовом режиме: логи всех ботов процесса идут в один поток
+        self.tenant = tenant
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        context = {
+            "update_id": event.update_id if isinstance(event, Update) else None,
+            "user_id": user.id if user else None,
+            "fsm_state": data.get("raw_state"),
+        }
+        if self.tenant is not None:
+            context["tenant"] = self.tenant
+        token = update_context.set(context)
+        try:
+            return await handler(event, data)
+        finally:
+            update_context.reset(token)
+
+
+def setup_logging(level: int = logging.INFO, debug_sample_rate: float = 1.0,
+                  stream=None) -> logging.handlers.QueueListener:
+    """
+    Настроить неблокирующее JSON-логирование для всего процесса
+    
+    Returns:
+        QueueListener: его нужно остановить при завершении (`listener.stop()`),
+        чтобы дописать оставшиеся в очереди записи
+    """
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(debug_sample_rate))
+    queue_handler.addFilter(ContextFilter())
+    
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter())
+    
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    
+    listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
+
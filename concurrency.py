@@ -0,0 +1,269 @@
+"""
+Параллельная обработка апдейтов
+
+aiogram при polling запускает каждый апдейт отдельной задачей, но обращения
+к SQLite синхронные и блокируют цикл событий, а апдейты одного пользователя
+могут обгонять друг друга. Здесь собраны средства, которые это исправляют:
+
+- `UserSerialMiddleware` ограничивает число одновременно обрабатываемых
+  апдейтов и выстраивает апдейты одного пользователя в очередь;
+- `AsyncDatabase` выполняет методы `Database` в пуле потоков, не блокируя
+  цикл событий;
+- `BatchBuffer` копит строки в памяти и пишет их пачками из фоновой
+  задачи (`EventBuffer` - события аналитики, `MissLogBuffer` - вопросы
+  без ответа);
+- `process_batch` обрабатывает пачку апдейтов с теми же гарантиями;
+- `SharedResources` - пул потоков БД, лимит апдейтов и HTTP-сессия, общие
+  для нескольких ботов одного процесса (многобрендовый режим, tenants.py).
+"""
+import abc
+import asyncio
+import contextvars
+import functools
+import logging
+from contextlib import suppress
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.types import TelegramObject, Update
+from database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Не больше `max_concurrency` апдейтов одновременно, апдейты одного
+    пользователя - строго по очереди в порядке поступления
+    """
+    
+    def __init__(self, max_concurrency: int = 32, shared_limit: Optional[asyncio.Semaphore] = None):
+        """
+        Args:
+            max_concurrency: Лимит одновременных апдейтов этого бота
+            shared_limit: Общий лимит для всех ботов процесса (см. `SharedResources`)
+        """
+        self.max_concurrency = max_concurrency
+        self.shared_limit = shared_limit
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # user_id -> [блокировка, число ожидающих апдейтов]
+        self._user_locks: Dict[int, list] = {}
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self._semaphore is None:
+            # Семафор создается внутри работающего цикла событий
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        user = data.get("event_from_user")
+        if user is None:
+            return await self._limited(handler, event, data)
+        
+        entry = self._user_locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # Пока ждали, предыдущий апдейт пользователя мог сменить состояние FSM
+                state = data.get("state")
+                if state is not None:
+                    data["raw_state"] = await state.get_state()
+                return await self._limited(handler, event, data)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[user.id]
+    
+    async def _limited(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        async with self._semaphore:
+            if self.shared_limit is None:
+                return await handler(event, data)
+            async with self.shared_limit:
+                return await handler(event, data)
+
+
+class AsyncDatabase:
+    """Асинхронная обертка над `Database`: каждый вызов идет в пул потоков"""
+    
+    def __init__(self, db: Database, max_workers: int = 8, executor: Optional[Executor] = None):
+        """
+        Args:
+            max_workers: Размер собственного пула, а при общем пуле - сколько
+                его потоков эта БД может занять одновременно
+            executor: Общий пул потоков (см. `SharedResources`); его закрывает владелец
+        """
+        self.db = db
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        # В общем пуле одна БД не должна занять все потоки
+        self._quota = None if executor is None else asyncio.Semaphore(max_workers)
+        # Обертка каждого вызова в потоке БД: `wrapper(call)`; профилировщик
+        # ставит сюда `profiling.call_profiled`
+        self.call_wrapper: Optional[Callable[[Callable[[], Any]], Any]] = None
+    
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Выполнить `func(db, *args, **kwargs)` в пуле потоков
+        
+        Позволяет сгруппировать несколько запросов к БД в один переход
+        в поток вместо отдельного перехода на каждый запрос.
+        """
+        return await self._submit(functools.partial(func, self.db, *args, **kwargs))
+    
+    async def _submit(self, call: Callable[[], Any]) -> Any:
+        # Контекст апдейта (update_id для логов, выборка профилировщика) переходит в поток
+        context = contextvars.copy_context()
+        if self.call_wrapper is not None:
+            call = functools.partial(self.call_wrapper, call)
+        loop = asyncio.get_running_loop()
+        if self._quota is None:
+            return await loop.run_in_executor(self._executor, context.run, call)
+        async with self._quota:
+            return await loop.run_in_executor(self._executor, context.run, call)
+    
+    def __getattr__(self, name: str) -> Callable[..., Awaitable[Any]]:
+        method = getattr(self.db, name)
+        
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await self._submit(functools.partial(method, *args, **kwargs))
+        
+        return call
+    
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+
+
+class BatchBuffer(abc.ABC):
+    """
+    Буфер строк с пакетной записью в БД
+    
+    `add` только складывает строку в память и не обращается к БД. Пачку пишет
+    фоновая задача через пул потоков `AsyncDatabase`: как только набралось
+    `batch_size` строк и не реже раза в `flush_interval` секунд. Задача
+    запускается при первом `add` внутри работающего цикла событий.
+    
+    Строки неудачной пачки остаются в буфере до следующей попытки, но не
+    больше `max_backlog`: если БД недоступна долго, самые старые строки
+    отбрасываются, чтобы буфер не рос без предела.
+    """
+    
+    def __init__(self, adb: AsyncDatabase, batch_size: int = 100, flush_interval: float = 5.0,
+                 max_backlog: int = 10000):
+        self.adb = adb
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self._buffer: List[tuple] = []
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+    
+    def _append(self, row: tuple):
+        self._buffer.append(row)
+        if self._task is None and not self._stopping:
+            self._task = asyncio.create_task(self._run())
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+    
+    async def _run(self):
+        while not self._stopping:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Ошибка пакетной записи в БД")
+    
+    async def flush(self):
+        """Записать накопленные строки в БД; при ошибке они остаются в буфере"""
+        batch, self._buffer = self._buffer, []
+        if batch and not await self._write(batch):
+            self._buffer[:0] = batch
+            overflow = len(self._buffer) - self.max_backlog
+            if overflow > 0:
+                del self._buffer[:overflow]
+                logger.warning("Буфер %s переполнен, отброшено старых строк: %d",
+                               type(self).__name__, overflow)
+    
+    @abc.abstractmethod
+    async def _write(self, batch: List[tuple]) -> bool:
+        """Записать пачку; False - запись не удалась"""
+    
+    async def stop(self):
+        """Остановить фоновую запись и сбросить остаток (при остановке бота)"""
+        self._stopping = True
+        if self._task is not None:
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+class EventBuffer(BatchBuffer):
+    """Буфер событий аналитики (одна транзакция на пачку)"""
+    
+    def add(self, event: str, user_id: Optional[int] = None, step: Optional[str] = None):
+        """Добавить событие"""
+        self._append((datetime.now().isoformat(timespec="seconds"), user_id, event, step or ''))
+    
+    async def _write(self, batch: List[tuple]) -> bool:
+        # Ошибки записи событий Database только логирует: повтор не нужен
+        await self.adb.record_events(batch)
+        return True
+
+
+class MissLogBuffer(BatchBuffer):
+    """Буфер вопросов без ответа базы знаний (разбирает их kb_mining.py)"""
+    
+    def __init__(self, adb: AsyncDatabase, batch_size: int = 50, flush_interval: float = 30.0,
+                 max_backlog: int = 10000):
+        super().__init__(adb, batch_size, flush_interval, max_backlog)
+    
+    def add(self, user_id: Optional[int], question: str):
+        """Добавить вопрос в буфер"""
+        self._append((datetime.now().isoformat(timespec="seconds"), user_id, question))
+    
+    async def _write(self, batch: List[tuple]) -> bool:
+        # При ошибке вопросы не теряются: они вернутся в буфер до следующей попытки
+        return await self.adb.add_kb_misses(batch)
+
+
+async def process_batch(dp: Dispatcher, bot: Bot, updates: Iterable[Update]) -> List[Any]:
+    """
+    Обработать пачку апдейтов параллельно
+    
+    Ограничение параллелизма и порядок апдейтов одного пользователя
+    обеспечивает `UserSerialMiddleware`, зарегистрированный в диспетчере.
+    """
+    return await asyncio.gather(
+        *(dp.feed_update(bot, update) for update in updates),
+        return_exceptions=True,
+    )
+
+
+class SharedResources:
+    """
+    Ресурсы, общие для нескольких ботов одного процесса
+    
+    Каждый бот берет из общего пула не больше своей квоты: `database.workers`
+    потоков БД и `concurrency.max_updates` одновременных апдейтов, а сумма по
+    всем ботам ограничена размерами общего пула и общим лимитом апдейтов.
+    """
+    
+    def __init__(self, session: BaseSession, db_workers: int = 16, max_updates: int = 128):
+        self.session = session
+        self.executor = ThreadPoolExecutor(max_workers=db_workers, thread_name_prefix="db")
+        self.update_limit = asyncio.Semaphore(max_updates)
+    
+    async def close(self):
+        self.executor.shutdown(wait=True)
+        await self.session.close()
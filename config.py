@@ -0,0 +1,387 @@
+"""
+Настройки бота
+
+Все настройки собраны в типизированные секции (`Config`). Значения берутся
+по возрастанию приоритета:
+1. значения по умолчанию из этого модуля;
+2. JSON-файл (`config.json` или путь из `--config` / `WINDOWBOT_CONFIG`);
+3. переменные окружения вида `WINDOWBOT_<СЕКЦИЯ>_<ПАРАМЕТР>`,
+   например `WINDOWBOT_THROTTLING_RATE_LIMIT=10`, `WINDOWBOT_BOT_ADMIN_IDS=1,2`;
+4. флаги командной строки `main.py`.
+
+Настройки проверяются один раз при запуске: неизвестные ключи, неверные
+типы и недопустимые значения собираются в одну ошибку `ConfigError`.
+
+Пример config.json:
+    {
+        "database": {"path": "/var/lib/windowbot/appointments.db", "workers": 16},
+        "throttling": {"rate_limit": 10},
+        "concurrency": {"max_updates": 64}
+    }
+"""
+import argparse
+import json
+import os
+from dataclasses import dataclass, field, fields, replace
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple, get_type_hints
+
+
+ENV_PREFIX = "WINDOWBOT_"
+DEFAULT_CONFIG_PATH = "config.json"
+
+
+class ConfigError(ValueError):
+    """Ошибка в настройках (со списком всех найденных проблем)"""
+    
+    def __init__(self, message: str, errors: Sequence[str] = ()):
+        super().__init__(message)
+        self.errors = list(errors) or [message]
+
+
+def _positive(default: Any) -> Any:
+    return field(default=default, metadata={"min": 0, "exclusive": True})
+
+
+def _non_negative(default: Any) -> Any:
+    return field(default=default, metadata={"min": 0})
+
+
+@dataclass(frozen=True)
+class BotConfig:
+    """Telegram: токен и администраторы"""
+    name: str = ""
+    token: str = ""
+    token_file: str = "token.txt"
+    admin_ids: Tuple[int, ...] = ()
+
+
+@dataclass(frozen=True)
+class DatabaseConfig:
+    """SQLite: путь, ожидание блокировки и пул потоков для запросов"""
+    path: str = "appointments.db"
+    busy_timeout: float = _positive(5.0)
+    workers: int = _positive(8)
+
+
+@dataclass(frozen=True)
+class ConcurrencyConfig:
+    """Сколько апдейтов обрабатывается одновременно"""
+    max_updates: int = _positive(32)
+
+
+@dataclass(frozen=True)
+class DedupConfig:
+    """Защита от повторной обработки апдейтов: размер окна и период сохранения состояния"""
+    window: int = _positive(4096)
+    flush_interval: float = _non_negative(5.0)
+
+
+@dataclass(frozen=True)
+class BuffersConfig:
+    """Пакетная запись событий аналитики и вопросов без ответа"""
+    events_batch_size: int = _positive(100)
+    events_flush_interval: float = _positive(5.0)
+    kb_misses_batch_size: int = _positive(50)
+    kb_misses_flush_interval: float = _positive(30.0)
+    # Сколько вопросов держать в памяти, пока БД недоступна
+    kb_misses_max_backlog: int = _positive(10000)
+
+
+@dataclass(frozen=True)
+class ContextConfig:
+    """Контекст диалогов в памяти"""
+    max_bytes: int = _positive(64 * 1024 * 1024)
+    max_messages: int = _positive(10)
+    max_topics: int = _positive(5)
+
+
+@dataclass(frozen=True)
+class ThrottlingConfig:
+    """Защита от флуда"""
+    rate_limit: int = _positive(5)
+    window: float = _positive(10.0)
+    duplicate_window: float = _non_negative(5.0)
+    penalty: float = _non_negative(30.0)
+    max_penalty: float = _non_negative(600.0)
+    max_users: int = _positive(100_000)
+
+
+@dataclass(frozen=True)
+class KnowledgeConfig:
+    """База знаний: файл-источник и период проверки его изменений"""
+    file: Optional[str] = None
+    watch_interval: float = _positive(5.0)
+
+
+@dataclass(frozen=True)
+class BrandingConfig:
+    """Бренд: название компании в текстах бота и файл с собственными текстами (см. templates.py)"""
+    company: str = "Народные Окна"
+    templates_file: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class MaintenanceConfig:
+    """Резервные копии, архивирование и сжатие БД"""
+    enabled: bool = True
+    backup_dir: str = "backups"
+    keep_backups: int = _positive(7)
+    backup_interval: float = _positive(3600.0)
+    maintenance_interval: float = _positive(86400.0)
+    appointment_retention_days: int = _positive(180)
+    welcome_retention_days: int = _positive(365)
+    vacuum_pages: int = _positive(1000)
+
+
+@dataclass(frozen=True)
+class RoutesConfig:
+    """Замерщики: сколько выездов в час возможно и рабочие часы (для подсказки свободного времени)"""
+    surveyors: int = _positive(3)
+    day_start: int = field(default=9, metadata={"min": 0, "max": 23})
+    day_end: int = field(default=20, metadata={"min": 1, "max": 24})
+
+
+@dataclass(frozen=True)
+class ProfilingConfig:
+    """Выборочное профилирование апдейтов (0 - выключено)"""
+    sample_every: int = _non_negative(0)
+    trace_memory: bool = True
+    output_dir: str = "profiles"
+
+
+@dataclass(frozen=True)
+class LoggingConfig:
+    """Логирование"""
+    level: str = "INFO"
+    debug_sample_rate: float = field(default=0.01, metadata={"min": 0, "max": 1})
+
+
+@dataclass(frozen=True)
+class SharedConfig:
+    """Ресурсы, общие для всех ботов процесса в многобрендовом режиме (tenants.py)"""
+    db_workers: int = _positive(16)
+    max_updates: int = _positive(128)
+    http_connections: int = _positive(100)
+    requests_per_bot: int = _positive(10)
+
+
+@dataclass(frozen=True)
+class Config:
+    """Все настройки бота"""
+    bot: BotConfig = field(default_factory=BotConfig)
+    database: DatabaseConfig = field(default_factory=DatabaseConfig)
+    concurrency: ConcurrencyConfig = field(default_factory=ConcurrencyConfig)
+    dedup: DedupConfig = field(default_factory=DedupConfig)
+    buffers: BuffersConfig = field(default_factory=BuffersConfig)
+    context: ContextConfig = field(default_factory=ContextConfig)
+    throttling: ThrottlingConfig = field(default_factory=ThrottlingConfig)
+    knowledge: KnowledgeConfig = field(default_factory=KnowledgeConfig)
+    branding: BrandingConfig = field(default_factory=BrandingConfig)
+    maintenance: MaintenanceConfig = field(default_factory=MaintenanceConfig)
+    routes: RoutesConfig = field(default_factory=RoutesConfig)
+    profiling: ProfilingConfig = field(default_factory=ProfilingConfig)
+    logging: LoggingConfig = field(default_factory=LoggingConfig)
+    shared: SharedConfig = field(default_factory=SharedConfig)
+    
+    def override(self, section: str, **values: Any) -> "Config":
+        """Копия настроек с измененными значениями одной секции (для флагов командной строки)"""
+        return replace(self, **{section: replace(getattr(self, section), **values)})
+
+
+_LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+_TRUE = {"1", "true", "yes", "on"}
+_FALSE = {"0", "false", "no", "off"}
+
+
+def _convert(value: Any, annotation: Any, from_env: bool) -> Any:
+    """Привести значение к типу поля; ValueError, если это невозможно"""
+    if annotation is Optional[str]:
+        if value is None or (from_env and value == ""):
+            return None
+        annotation = str
+    if annotation is bool:
+        if isinstance(value, bool):
+            return value
+        if from_env and value.lower() in _TRUE | _FALSE:
+            return value.lower() in _TRUE
+        raise ValueError("ожидается true или false")
+    if annotation is int:
+        if from_env:
+            return int(value)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        raise ValueError("ожидается целое число")
+    if annotation is float:
+        if from_env:
+            return float(value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return float(value)
+        raise ValueError("ожидается число")
+    if annotation is str:
+        if isinstance(value, str):
+            return value
+        raise ValueError("ожидается строка")
+    if annotation == Tuple[int, ...]:
+        items = [item for item in value.split(",") if item.strip()] if from_env else value
+        if not isinstance(items, list):
+            raise ValueError("ожидается список чисел")
+        return tuple(_convert(item, int, from_env) for item in items)
+    raise ValueError(f"неподдерживаемый тип {annotation}")
+
+
+def _check_range(name: str, value: Any, metadata: Mapping[str, Any]) -> Optional[str]:
+    if "min" in metadata:
+        if metadata.get("exclusive") and value <= metadata["min"]:
+            return f"{name}: должно быть больше {metadata['min']}"
+        if value < metadata["min"]:
+            return f"{name}: должно быть не меньше {metadata['min']}"
+    if "max" in metadata and value > metadata["max"]:
+        return f"{name}: должно быть не больше {metadata['max']}"
+    return None
+
+
+def _build_section(base: Any, name: str, file_values: Mapping[str, Any], env: Mapping[str, str],
+                   errors: List[str]) -> Any:
+    cls = type(base)
+    hints = get_type_hints(cls)
+    known = {f.name for f in fields(cls)}
+    for key in file_values:
+        if key not in known:
+            errors.append(f"{name}.{key}: неизвестный параметр")
+    
+    values: Dict[str, Any] = {}
+    for f in fields(cls):
+        full_name = f"{name}.{f.name}"
+        env_name = f"{ENV_PREFIX}{name}_{f.name}".upper()
+        try:
+            if env_name in env:
+                values[f.name] = _convert(env[env_name], hints[f.name], from_env=True)
+            elif f.name in file_values:
+                values[f.name] = _convert(file_values[f.name], hints[f.name], from_env=False)
+            else:
+                continue
+        except ValueError as e:
+            source = env_name if env_name in env else full_name
+            errors.append(f"{source}: {e}")
+            continue
+        problem = _check_range(full_name, values[f.name], f.metadata)
+        if problem:
+            errors.append(problem)
+    return replace(base, **values)
+
+
+def load_config(path: Optional[str] = None, env: Optional[Mapping[str, str]] = None) -> Config:
+    """
+    Собрать и проверить настройки
+    
+    Args:
+        path: JSON-файл настроек; по умолчанию `WINDOWBOT_CONFIG` или
+            `config.json`, если он есть
+        env: Переменные окружения (по умолчанию `os.environ`)
+    
+    Raises:
+        ConfigError: если в настройках есть ошибки
+    """
+    env = os.environ if env is None else env
+    path = path or env.get(f"{ENV_PREFIX}CONFIG")
+    data: Dict[str, Any] = {}
+    if path or os.path.exists(DEFAULT_CONFIG_PATH):
+        path = path or DEFAULT_CONFIG_PATH
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ConfigError(f"Не удалось прочитать {path}: {e}")
+        if not isinstance(data, dict):
+            raise ConfigError(f"{path}: ожидается JSON-объект с секциями настроек")
+    
+    errors: List[str] = []
+    config = _merge(Config(), data, env, errors)
+    _raise_errors(errors)
+    return config
+
+
+def _raise_errors(errors: List[str]):
+    if errors:
+        raise ConfigError("Ошибки в настройках:\n" + "\n".join(f"  - {error}" for error in errors), errors)
+
+
+def _merge(base: Config, data: Mapping[str, Any], env: Mapping[str, str], errors: List[str],
+           prefix: str = "") -> Config:
+    """Наложить секции из `data` и переменные окружения на `base`, дописав ошибки в `errors`"""
+    sections = [f.name for f in fields(Config)]
+    for key in data:
+        if key not in sections:
+            errors.append(f"{prefix}{key}: неизвестная секция")
+    
+    values = {}
+    for name in sections:
+        section_values = data.get(name, {})
+        if not isinstance(section_values, dict):
+            errors.append(f"{prefix}{name}: ожидается объект")
+            section_values = {}
+        section_errors: List[str] = []
+        values[name] = _build_section(getattr(base, name), name, section_values, env, section_errors)
+        errors.extend(f"{prefix}{error}" for error in section_errors)
+    
+    if values["logging"].level.upper() not in _LOG_LEVELS:
+        errors.append(f"{prefix}logging.level: ожидается одно из {', '.join(_LOG_LEVELS)}")
+    if values["routes"].day_start >= values["routes"].day_end:
+        errors.append(f"{prefix}routes.day_start: должно быть меньше routes.day_end")
+    return Config(**values)
+
+
+def merge_config(base: Config, data: Mapping[str, Any], prefix: str = "") -> Config:
+    """
+    Наложить секции настроек из словаря на готовые настройки (без переменных окружения)
+    
+    Используется для настроек отдельных брендов поверх общих (см. tenants.py).
+    
+    Args:
+        prefix: Префикс для сообщений об ошибках, например "tenants.sever."
+    
+    Raises:
+        ConfigError: если в настройках есть ошибки
+    """
+    errors: List[str] = []
+    config = _merge(base, data, {}, errors, prefix)
+    _raise_errors(errors)
+    return config
+
+
+def read_token(config: BotConfig) -> str:
+    """Токен из настроек, а если он не задан - из файла `token_file`"""
+    if config.token:
+        return config.token
+    try:
+        with open(config.token_file, "r", encoding="utf-8") as f:
+            token = f.read().strip()
+    except FileNotFoundError:
+        raise ConfigError(
+            f"Токен не задан: укажите WINDOWBOT_BOT_TOKEN или создайте файл {config.token_file}"
+        )
+    if not token:
+        raise ConfigError(f"Файл {config.token_file} пуст")
+    return token
+
+
+def add_script_arguments(parser: argparse.ArgumentParser):
+    """Флаги `--config` и `--db` вспомогательных скриптов (выгрузка, отчеты, обслуживание)"""
+    parser.add_argument("--config", default=None, metavar="PATH",
+                        help="JSON с настройками (по умолчанию config.json, если он есть)")
+    parser.add_argument("--db", default=None, help="путь к БД (по умолчанию database.path из настроек)")
+
+
+def load_script_config(parser: argparse.ArgumentParser, args: argparse.Namespace) -> Config:
+    """
+    Настройки вспомогательного скрипта - те же, что у бота, а `--db` важнее `database.path`
+    
+    При ошибке в настройках скрипт завершается с кодом 2.
+    """
+    try:
+        config = load_config(args.config)
+    except ConfigError as e:
+        parser.exit(2, f"{e}\n")
+    if args.db is not None:
+        config = config.override("database", path=args.db)
+    return config
@@ -0,0 +1,159 @@
+"""
+Контекст диалога с пользователем
+
+Для каждого пользователя хранится короткая история последних сообщений и
+тем, на которые бот уже ответил. Это позволяет понимать уточняющие вопросы
+вроде "а для балкона?". Общий объем памяти ограничен: при превышении лимита
+вытесняются давно неактивные пользователи (LRU), а их контекст при желании
+сохраняется в SQLite и поднимается обратно при следующем сообщении.
+"""
+import json
+import sys
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+from concurrency import AsyncDatabase
+
+
+# Примерные накладные расходы на объект контекста и две очереди
+_CONTEXT_OVERHEAD = 1200
+
+
+class ConversationContext:
+    """Кольцевой буфер последних сообщений и тем одного пользователя"""
+    
+    __slots__ = ("messages", "topics", "size")
+    
+    def __init__(self, max_messages: int = 10, max_topics: int = 5):
+        self.messages: Deque[str] = deque(maxlen=max_messages)
+        self.topics: Deque[str] = deque(maxlen=max_topics)
+        self.size = _CONTEXT_OVERHEAD
+    
+    def _push(self, buffer: Deque[str], text: str):
+        if len(buffer) == buffer.maxlen:
+            self.size -= sys.getsizeof(buffer[0])
+        buffer.append(text)
+        self.size += sys.getsizeof(text)
+    
+    def add_message(self, text: str):
+        """Добавить сообщение пользователя"""
+        self._push(self.messages, text)
+    
+    def add_topic(self, topic: str):
+        """Добавить тему, на которую бот нашел ответ"""
+        self._push(self.topics, topic)
+    
+    @property
+    def last_topic(self) -> Optional[str]:
+        return self.topics[-1] if self.topics else None
+    
+    @property
+    def last_message(self) -> Optional[str]:
+        return self.messages[-1] if self.messages else None
+    
+    def to_json(self) -> str:
+        return json.dumps({"messages": list(self.messages), "topics": list(self.topics)},
+                          ensure_ascii=False)
+    
+    @classmethod
+    def from_json(cls, payload: str, max_messages: int = 10, max_topics: int = 5) -> "ConversationContext":
+        data = json.loads(payload)
+        context = cls(max_messages, max_topics)
+        for text in data.get("messages", []):
+            context.add_message(text)
+        for topic in data.get("topics", []):
+            context.add_topic(topic)
+        return context
+
+
+class ContextStore:
+    """
+    Хранилище контекстов с общим лимитом памяти и LRU-вытеснением
+    
+    Если передана `adb`, вытесненные контексты сохраняются в таблицу
+    `conversation_context`; контекста, которого нет в памяти, сначала ищем
+    там. Запросы к БД идут через пул потоков и не блокируют цикл событий, а в
+    памяти не остается ничего сверх самих контекстов.
+    """
+    
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, adb: Optional[AsyncDatabase] = None,
+                 max_messages: int = 10, max_topics: int = 5):
+        self.max_bytes = max_bytes
+        self.adb = adb
+        self.max_messages = max_messages
+        self.max_topics = max_topics
+        self.total_bytes = 0
+        self._contexts: "OrderedDict[int, ConversationContext]" = OrderedDict()
+        # Вытесненные контексты, запись которых в БД еще идет
+        self._spilling: Dict[int, ConversationContext] = {}
+    
+    def __len__(self) -> int:
+        return len(self._contexts)
+    
+    async def get(self, user_id: int) -> ConversationContext:
+        """Получить контекст пользователя (создается при первом обращении)"""
+        context = self._contexts.get(user_id)
+        if context is not None:
+            self._contexts.move_to_end(user_id)
+            return context
+        
+        context = (self._spilling.pop(user_id, None) or await self._load(user_id)
+                   or ConversationContext(self.max_messages, self.max_topics))
+        # Пока читали из БД, контекст мог появиться в памяти
+        existing = self._contexts.get(user_id)
+        if existing is not None:
+            self._contexts.move_to_end(user_id)
+            return existing
+        self._contexts[user_id] = context
+        self.total_bytes += context.size
+        return context
+    
+    async def add_message(self, user_id: int, text: str):
+        """Запомнить сообщение пользователя"""
+        await self._update(user_id, lambda context: context.add_message(text))
+    
+    async def add_topic(self, user_id: int, topic: str):
+        """Запомнить тему, на которую бот ответил"""
+        await self._update(user_id, lambda context: context.add_topic(topic))
+    
+    async def _update(self, user_id: int, change):
+        context = await self.get(user_id)
+        before = context.size
+        change(context)
+        if user_id in self._contexts:
+            self.total_bytes += context.size - before
+        await self._spill(self._evict())
+    
+    def _evict(self) -> List[tuple]:
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self._contexts) > 1:
+            user_id, context = self._contexts.popitem(last=False)
+            self.total_bytes -= context.size
+            evicted.append((user_id, context))
+        return evicted
+    
+    async def _spill(self, evicted: List[tuple]):
+        if not evicted or self.adb is None:
+            return
+        self._spilling.update(evicted)
+        try:
+            # Ошибку записи Database логирует сама; контекст тогда теряется, как без БД
+            await self.adb.save_conversation_contexts(
+                [(user_id, context.to_json()) for user_id, context in evicted]
+            )
+        finally:
+            for user_id, context in evicted:
+                # Контекст, который уже вернулся в память, не трогаем
+                if self._spilling.get(user_id) is context:
+                    del self._spilling[user_id]
+    
+    async def _load(self, user_id: int) -> Optional[ConversationContext]:
+        if self.adb is None:
+            return None
+        payload = await self.adb.load_conversation_context(user_id)
+        if payload is None:
+            return None
+        return ConversationContext.from_json(payload, self.max_messages, self.max_topics)
+    
+    async def flush(self):
+        """Сохранить все контексты из памяти в БД (при остановке бота)"""
+        await self._spill(list(self._contexts.items()))
@@ -0,0 +1,269 @@
+"""
+HTTP API для менеджеров поверх read-only снимка базы данных
+
+Отчеты читают не рабочую `appointments.db`, а ее копию, которая
+периодически обновляется через SQLite backup API. Поэтому тяжелые
+запросы менеджеров не держат блокировки и не мешают боту писать в БД.
+Рабочая БД открывается только на чтение и только для копирования: схему
+и данные в ней меняет один бот.
+
+Запуск:
+    python dashboard.py --port 8080 --refresh 60
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+from config import add_script_arguments, load_script_config
+from export import export_appointments
+from models import Appointment
+from routes import Gazetteer, plan_routes
+
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotReplica:
+    """Периодически обновляемый read-only снимок БД"""
+    
+    def __init__(self, source_path: str, snapshot_path: str = "appointments_snapshot.db",
+                 refresh_interval: float = 60.0, pages: int = 256):
+        self.source_path = source_path
+        self.pages = pages
+        self.snapshot_path = snapshot_path
+        self.refresh_interval = refresh_interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def refresh(self):
+        """Снять новую копию и атомарно подменить ею старую"""
+        tmp_path = f"{self.snapshot_path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        # Порции по `pages` страниц: между ними блокировка чтения снимается
+        source = sqlite3.connect(f"file:{self.source_path}?mode=ro", uri=True)
+        target = sqlite3.connect(tmp_path)
+        try:
+            source.backup(target, pages=self.pages)
+        finally:
+            target.close()
+            source.close()
+        # Уже открытые соединения дочитают старый файл, новые откроют свежий
+        os.replace(tmp_path, self.snapshot_path)
+    
+    def get_connection(self) -> sqlite3.Connection:
+        """Получить read-only соединение со снимком"""
+        conn = sqlite3.connect(f"file:{self.snapshot_path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def start(self):
+        """Снять первый снимок и запустить фоновое обновление"""
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name="snapshot-refresh", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Остановить фоновое обновление"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self):
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Ошибка обновления снимка БД")
+
+
+class DashboardQueries:
+    """Отчетные запросы к снимку БД"""
+    
+    def __init__(self, replica: SnapshotReplica, gazetteer: Optional[Gazetteer] = None):
+        self.replica = replica
+        self.gazetteer = gazetteer
+    
+    def _fetch(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        conn = self.replica.get_connection()
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
+    
+    def appointments_by_day(self, day: str) -> List[Dict[str, Any]]:
+        """Записи на указанный день (формат ДД.ММ.ГГГГ, как в таблице)"""
+        return self._fetch("""
+            SELECT a.id, a.date, a.time, a.address, a.phone, a.notes,
+                   a.user_id, c.username, c.first_name
+            FROM appointments a
+            LEFT JOIN clients c ON c.user_id = a.user_id
+            WHERE a.date = ?
+            ORDER BY a.time
+        """, (day,))
+    
+    def routes(self, day: str, surveyors: int = 3, max_stops: int = 8) -> Dict[str, Any]:
+        """Маршруты замерщиков на день (нужен справочник адресов)"""
+        if self.gazetteer is None:
+            raise ValueError("справочник адресов не загружен (запустите с --gazetteer)")
+        appointments = [
+            Appointment(row['id'], row['user_id'], row['date'], row['time'], row['address'],
+                        row['phone'], row['notes'])
+            for row in self.appointments_by_day(day)
+        ]
+        return plan_routes(appointments, self.gazetteer, surveyors, max_stops, day=day).as_dict()
+    
+    def new_clients(self, days: int = 7) -> List[Dict[str, Any]]:
+        """Количество новых клиентов по дням за последние `days` дней"""
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        return self._fetch("""
+            SELECT substr(created_at, 1, 10) AS day, COUNT(*) AS clients
+            FROM clients
+            WHERE created_at >= ?
+            GROUP BY day
+            ORDER BY day
+        """, (since,))
+    
+    def kb_hit_rate(self, days: int = 7) -> List[Dict[str, Any]]:
+        """Доля найденных ответов в базе знаний по дням"""
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        rows = self._fetch("""
+            SELECT bucket AS day,
+                   SUM(CASE WHEN event = 'kb_hit' THEN count ELSE 0 END) AS hits,
+                   SUM(CASE WHEN event = 'kb_miss' THEN count ELSE 0 END) AS misses
+            FROM analytics_rollup
+            WHERE period = 'day' AND bucket >= ? AND event IN ('kb_hit', 'kb_miss')
+            GROUP BY bucket
+            ORDER BY bucket
+        """, (since,))
+        for row in rows:
+            total = row['hits'] + row['misses']
+            row['hit_rate'] = round(row['hits'] / total, 4) if total else None
+        return rows
+    
+    def funnel(self, period: str = "day", days: int = 7) -> List[Dict[str, Any]]:
+        """Воронка записи: начатые, пройденные шаги, завершенные и брошенные записи"""
+        if period not in ("hour", "day"):
+            raise ValueError("period должен быть hour или day")
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        return self._fetch("""
+            SELECT bucket, event, step, count FROM analytics_rollup
+            WHERE period = ? AND bucket >= ? AND event NOT IN ('kb_hit', 'kb_miss')
+            ORDER BY bucket, event, step
+        """, (period, since))
+
+
+class DashboardHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP-запросов к отчетам"""
+    
+    queries: DashboardQueries
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        
+        if url.path == "/export":
+            self._send_export(params)
+            return
+        
+        try:
+            if url.path == "/appointments":
+                day = params.get("day", date.today().strftime("%d.%m.%Y"))
+                payload = self.queries.appointments_by_day(day)
+            elif url.path == "/routes":
+                day = params.get("day", date.today().strftime("%d.%m.%Y"))
+                payload = self.queries.routes(day, int(params.get("surveyors", 3)),
+                                              int(params.get("max_stops", 8)))
+            elif url.path == "/clients/new":
+                payload = self.queries.new_clients(int(params.get("days", 7)))
+            elif url.path == "/funnel":
+                payload = self.queries.funnel(params.get("period", "day"), int(params.get("days", 7)))
+            elif url.path == "/kb/hit-rate":
+                payload = self.queries.kb_hit_rate(int(params.get("days", 7)))
+            else:
+                self._send_json(404, {"error": "not found"})
+                return
+        except ValueError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        
+        self._send_json(200, payload)
+    
+    def _send_export(self, params: Dict[str, str]):
+        """Потоковая выгрузка записей: строки пишутся в ответ по мере чтения из снимка"""
+        fmt = params.get("format", "csv")
+        if fmt not in ("csv", "jsonl"):
+            self._send_json(400, {"error": "format должен быть csv или jsonl"})
+            return
+        
+        self.send_response(200)
+        if fmt == "csv":
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Content-Disposition", 'attachment; filename="appointments.csv"')
+        else:
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.end_headers()
+        
+        out = io.TextIOWrapper(self.wfile, encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="")
+        conn = self.queries.replica.get_connection()
+        try:
+            export_appointments(conn, out, fmt, params.get("from"), params.get("to"))
+            out.flush()
+        finally:
+            conn.close()
+            out.detach()
+    
+    def _send_json(self, status: int, payload: Any):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        # Не засоряем вывод логом каждого запроса
+        pass
+
+
+def create_server(queries: DashboardQueries, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+    """Создать HTTP-сервер отчетов"""
+    handler = type("BoundDashboardHandler", (DashboardHandler,), {"queries": queries})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API отчетов по записям")
+    add_script_arguments(parser)
+    parser.add_argument("--snapshot", default="appointments_snapshot.db", help="путь к снимку БД")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--refresh", type=float, default=60.0, help="период обновления снимка, сек")
+    parser.add_argument("--gazetteer", default=None, help="CSV справочника адресов для /routes")
+    args = parser.parse_args()
+    config = load_script_config(parser, args)
+    
+    gazetteer = Gazetteer.from_file(args.gazetteer) if args.gazetteer else None
+    replica = SnapshotReplica(config.database.path, args.snapshot, args.refresh)
+    replica.start()
+    server = create_server(DashboardQueries(replica, gazetteer), args.host, args.port)
+    
+    print(f"Отчеты доступны на http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nОстановка сервера отчетов...")
+    finally:
+        server.server_close()
+        replica.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,72 @@
 """
 Работа с базой данных SQLite
 """
+import logging
 import sqlite3
 import os
 import re
-from typing import List, Optional
+from dataclasses import fields
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 from models import Client, Appointment, KnowledgeBase
+from normalization import address_hash, clean_address, normalize_phone
+
+
+def _columns(model) -> str:
+    """Список колонок в порядке полей модели"""
+    return ", ".join(field.name for field in fields(model))
+
+
+def _model_factory(model) -> Callable[[sqlite3.Cursor, tuple], object]:
+    """row_factory, создающий модель прямо из кортежа строки"""
+    return lambda cursor, row: model(*row)
+
+
+def to_iso_date(date_text: str) -> Optional[str]:
+    """Перевести дату ДД.ММ.ГГГГ в ГГГГ-ММ-ДД (None, если формат другой)"""
+    from datetime import datetime
+    try:
+        return datetime.strptime(date_text, "%d.%m.%Y").date().isoformat()
+    except ValueError:
+        return None
+
+
+logger = logging.getLogger(__name__)
+
+CLIENT_COLUMNS = _columns(Client)
+APPOINTMENT_COLUMNS = _columns(Appointment)
+
+# Служебные слова: совпадение по одному такому слову не говорит о теме вопроса
+KB_STOP_WORDS = frozenset({
+    "для", "при", "без", "над", "под", "про", "через", "или", "это", "эти", "этот",
+    "тоже", "также", "уже", "еще", "ещё", "его", "она", "они", "оно", "мне", "меня",
+    "вас", "вам", "нас", "нам", "все", "всё", "так", "там", "тут", "чем", "если", "чтобы",
+})
 
 
 class Database:
     """Класс для работы с базой данных"""
     
-    def __init__(self, db_name: str = "appointments.db"):
+    def __init__(self, db_name: str = "appointments.db", seed_knowledge_base: bool = True,
+                 busy_timeout: float = 5.0):
+        """
+        Args:
+            db_name: Путь к файлу БД
+            seed_knowledge_base: Сразу заполнить пустую базу знаний начальными
+                вопросами; при False это делает `init_knowledge_base()` позже
+                (бот вызывает его в фоне после начала polling)
+            busy_timeout: Сколько секунд ждать, пока БД занята другой записью
+        """
         self.db_name = db_name
+        self.busy_timeout = busy_timeout
+        # Холодный архив: прошедшие записи и давние строки журнала приветствий
+        self.archive_path = f"{os.path.splitext(db_name)[0]}_archive.db"
         self.init_database()
-        self.init_knowledge_base()
+        if seed_knowledge_base:
+            self.init_knowledge_base()
     
     def get_connection(self) -> sqlite3.Connection:
         """Получить соединение с БД"""
-        conn = sqlite3.connect(self.db_name)
+        conn = sqlite3.connect(self.db_name, timeout=self.busy_timeout)
         conn.row_factory = sqlite3.Row
         return conn
     
@@ -27,6 +75,10 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # Освобождать место порциями (PRAGMA incremental_vacuum); на уже
+        # существующую базу действует только после VACUUM, см. enable_incremental_vacuum
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        
         # Таблица клиентов
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS clients (
@@ -50,10 +102,35 @@ class Database:
                 phone TEXT NOT NULL,
                 notes TEXT,
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                date_iso TEXT,
+                address_hash TEXT,
                 FOREIGN KEY (user_id) REFERENCES clients (user_id)
             )
         """)
         
+        # Дата записи в формате ГГГГ-ММ-ДД для сортировки и выборок по диапазону
+        # (в старых базах колонки нет - добавляем и заполняем)
+        columns = {row['name'] for row in cursor.execute("PRAGMA table_info(appointments)")}
+        if 'date_iso' not in columns:
+            cursor.execute("ALTER TABLE appointments ADD COLUMN date_iso TEXT")
+            cursor.execute("""
+                UPDATE appointments
+                SET date_iso = substr(date, 7, 4) || '-' || substr(date, 4, 2) || '-' || substr(date, 1, 2)
+                WHERE date GLOB '[0-9][0-9].[0-9][0-9].[0-9][0-9][0-9][0-9]'
+            """)
+        
+        # Хеш канонического адреса для поиска повторных записей (в старых
+        # базах колонки нет - добавляем и заполняем; сами адреса и телефоны
+        # не трогаем, их приводит к единому виду только normalize_appointment_contacts)
+        if 'address_hash' not in columns:
+            cursor.execute("ALTER TABLE appointments ADD COLUMN address_hash TEXT")
+            rows = cursor.execute("SELECT id, address FROM appointments").fetchall()
+            cursor.executemany(
+                "UPDATE appointments SET address_hash = ? WHERE id = ?",
+                [(address_hash(row['address']), row['id']) for row in rows]
+            )
+            logger.info("Добавлена колонка address_hash, заполнено записей: %d", len(rows))
+        
         # Таблица базы знаний
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS knowledge_base (
@@ -74,14 +151,85 @@ class Database:
             )
         """)
         
+        # Журнал событий воронки записи и базы знаний
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bot_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                user_id INTEGER,
+                event TEXT NOT NULL,
+                step TEXT NOT NULL DEFAULT ''
+            )
+        """)
+        
+        # Агрегаты событий по часам и дням, обновляются вместе с журналом
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS analytics_rollup (
+                period TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                event TEXT NOT NULL,
+                step TEXT NOT NULL DEFAULT '',
+                count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (period, bucket, event, step)
+            )
+        """)
+        
+        # Вопросы, на которые не нашлось ответа в базе знаний
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS kb_misses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                user_id INTEGER,
+                question TEXT NOT NULL
+            )
+        """)
+        
+        # Контекст диалогов, вытесненный из памяти
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_context (
+                user_id INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Служебное состояние бота (например, обработанные апдейты, см. dedup.py)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS bot_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Индексы для выборок по дням (используются в отчетах)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_date ON appointments (date, time)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_date_iso ON appointments (date_iso, time)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_appointments_address_hash ON appointments (address_hash, date_iso)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_clients_created_at ON clients (created_at)")
+        
         conn.commit()
         conn.close()
     
-    def init_knowledge_base(self):
-        """Инициализация базы знаний начальными данными"""
+    def init_knowledge_base(self, company: str = "Народные Окна"):
+        """
+        Инициализация базы знаний начальными данными
+        
+        Начальные вопросы добавляются только в пустую таблицу, иначе при
+        каждом запуске возвращались бы ответы, удаленные через перезагрузку
+        базы знаний из файла (см. knowledge.py).
+        
+        Args:
+            company: Название компании в ответах о компании (бренд бота)
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        cursor.execute("SELECT 1 FROM knowledge_base LIMIT 1")
+        if cursor.fetchone():
+            conn.close()
+            return
+        
         # Базовые вопросы и ответы
         default_qa = [
             # Вопросы о стоимости
@@ -127,8 +275,8 @@ class Database:
             ("какой стеклопакет", "Выбор стеклопакета зависит от требований к теплоизоляции. Для квартиры обычно достаточно двухкамерного. Специалист даст рекомендации при замере."),
             
             # Вопросы о компании
-            ("о компании", "Народные Окна - компания по производству и установке пластиковых окон. Мы предлагаем качественные окна с гарантией до 5 лет."),
-            ("кто вы", "Я помощник компании Народные Окна. Помогаю с выбором окон, записываю на бесплатный замер и отвечаю на вопросы."),
+            ("о компании", f"{company} - компания по производству и установке пластиковых окон. Мы предлагаем качественные окна с гарантией до 5 лет."),
+            ("кто вы", f"Я помощник компании {company}. Помогаю с выбором окон, записываю на бесплатный замер и отвечаю на вопросы."),
         ]
         
         for question, answer in default_qa:
@@ -150,14 +298,19 @@ class Database:
         
         try:
             cursor.execute("""
-                INSERT OR REPLACE INTO clients (user_id, username, first_name, phone, address, created_at)
+                INSERT INTO clients (user_id, username, first_name, phone, address, created_at)
                 VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    phone = excluded.phone,
+                    address = excluded.address
             """, (client.user_id, client.username, client.first_name, client.phone, 
                   client.address, client.created_at))
             conn.commit()
             return True
         except Exception as e:
-            print(f"Ошибка добавления клиента: {e}")
+            logger.error("Ошибка добавления клиента: %s", e)
             return False
         finally:
             conn.close()
@@ -166,21 +319,12 @@ class Database:
         """Получить клиента по user_id"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        cursor.row_factory = _model_factory(Client)
         
-        cursor.execute("SELECT * FROM clients WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
+        cursor.execute(f"SELECT {CLIENT_COLUMNS} FROM clients WHERE user_id = ?", (user_id,))
+        client = cursor.fetchone()
         conn.close()
-        
-        if row:
-            return Client(
-                user_id=row['user_id'],
-                username=row['username'],
-                first_name=row['first_name'],
-                phone=row['phone'],
-                address=row['address'],
-                created_at=row['created_at']
-            )
-        return None
+        return client
     
     def add_appointment(self, appointment: Appointment) -> bool:
         """Добавить запись на встречу"""
@@ -188,48 +332,161 @@ class Database:
         cursor = conn.cursor()
         
         try:
-            cursor.execute("""
-                INSERT INTO appointments (user_id, date, time, address, phone, notes, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
-            """, (appointment.user_id, appointment.date, appointment.time,
-                  appointment.address, appointment.phone, appointment.notes, appointment.created_at))
+            self._insert_appointment(cursor, appointment)
             conn.commit()
             return True
         except Exception as e:
-            print(f"Ошибка добавления записи: {e}")
+            logger.error("Ошибка добавления записи: %s", e)
             return False
         finally:
             conn.close()
     
+    def _insert_appointment(self, cursor: sqlite3.Cursor, appointment: Appointment):
+        """Вставить запись, нормализовав телефон и адрес"""
+        cursor.execute("""
+            INSERT INTO appointments (user_id, date, time, address, phone, notes, created_at, date_iso, address_hash)
+            VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?)
+        """, (appointment.user_id, appointment.date, appointment.time,
+              clean_address(appointment.address), normalize_phone(appointment.phone) or appointment.phone,
+              appointment.notes, appointment.created_at,
+              to_iso_date(appointment.date), address_hash(appointment.address)))
+    
+    def find_duplicate_appointment(self, appointment: Appointment) -> Optional[Appointment]:
+        """
+        Найти предстоящую запись того же пользователя на тот же адрес
+        (поиск по индексу хеша адреса)
+        """
+        from datetime import date
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = _model_factory(Appointment)
+        try:
+            return self._find_duplicate(cursor, appointment, date.today().isoformat())
+        finally:
+            conn.close()
+    
+    def _find_duplicate(self, cursor: sqlite3.Cursor, appointment: Appointment, today: str) -> Optional[Appointment]:
+        # Только записи того же пользователя: совпадение телефона и адреса у
+        # другого пользователя (родственник, сосед по квартире) - чужая запись
+        cursor.execute(f"""
+            SELECT {APPOINTMENT_COLUMNS} FROM appointments
+            WHERE address_hash = ? AND (date_iso >= ? OR date_iso IS NULL) AND user_id = ?
+            ORDER BY date_iso, time
+            LIMIT 1
+        """, (address_hash(appointment.address), today, appointment.user_id))
+        return cursor.fetchone()
+    
+    def add_or_merge_appointment(self, appointment: Appointment) -> Tuple[bool, Optional[Appointment]]:
+        """
+        Добавить запись или, если это повторная запись пользователя на тот же
+        адрес, перенести существующую на новые дату и время
+        
+        Адрес тоже заменяется только что введенным: канонически он тот же, а
+        пользователю в подтверждении показывается именно новое написание.
+        
+        Поиск повтора и изменение идут в одной транзакции, поэтому две
+        одновременные записи на один адрес не создадут дубль.
+        
+        Returns:
+            (успех, прежняя версия объединенной записи или None, если запись новая)
+        """
+        from datetime import date
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = _model_factory(Appointment)
+        
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            duplicate = self._find_duplicate(cursor, appointment, date.today().isoformat())
+            if duplicate is None:
+                self._insert_appointment(cursor, appointment)
+            else:
+                notes = duplicate.notes
+                if appointment.notes and appointment.notes != notes:
+                    notes = f"{notes}\n{appointment.notes}" if notes else appointment.notes
+                cursor.execute("""
+                    UPDATE appointments
+                    SET date = ?, time = ?, date_iso = ?, address = ?, phone = ?, notes = ?
+                    WHERE id = ?
+                """, (appointment.date, appointment.time, to_iso_date(appointment.date),
+                      clean_address(appointment.address),
+                      normalize_phone(appointment.phone) or appointment.phone, notes, duplicate.id))
+            conn.commit()
+            return True, duplicate
+        except Exception as e:
+            conn.rollback()
+            logger.error("Ошибка добавления записи: %s", e)
+            return False, None
+        finally:
+            conn.close()
+    
     def get_user_appointments(self, user_id: int) -> List[Appointment]:
         """Получить все записи пользователя"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        cursor.row_factory = _model_factory(Appointment)
         
-        cursor.execute("""
-            SELECT * FROM appointments 
+        cursor.execute(f"""
+            SELECT {APPOINTMENT_COLUMNS} FROM appointments 
             WHERE user_id = ? 
-            ORDER BY date, time
+            ORDER BY date_iso, time
         """, (user_id,))
         
-        rows = cursor.fetchall()
+        appointments = cursor.fetchall()
         conn.close()
+        return appointments
+    
+    def get_appointments_by_date(self, day_iso: str) -> List[Appointment]:
+        """Записи на день (дата в формате ГГГГ-ММ-ДД), по времени"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = _model_factory(Appointment)
         
-        appointments = []
-        for row in rows:
-            appointments.append(Appointment(
-                id=row['id'],
-                user_id=row['user_id'],
-                date=row['date'],
-                time=row['time'],
-                address=row['address'],
-                phone=row['phone'],
-                notes=row['notes'],
-                created_at=row['created_at']
-            ))
+        cursor.execute(f"""
+            SELECT {APPOINTMENT_COLUMNS} FROM appointments
+            WHERE date_iso = ?
+            ORDER BY time
+        """, (day_iso,))
         
+        appointments = cursor.fetchall()
+        conn.close()
         return appointments
     
+    def get_slot_loads(self, date_from: str, date_to: str) -> Dict[Tuple[str, int], int]:
+        """
+        Число записей по часам за период (даты в формате ГГГГ-ММ-ДД, включительно)
+        
+        Returns:
+            {(дата, час): число записей}
+        """
+        conn = self.get_connection()
+        try:
+            rows = conn.execute("""
+                SELECT date_iso, CAST(substr(time, 1, 2) AS INTEGER) AS hour, COUNT(*)
+                FROM appointments
+                WHERE date_iso BETWEEN ? AND ?
+                GROUP BY date_iso, hour
+            """, (date_from, date_to)).fetchall()
+        finally:
+            conn.close()
+        return {(day, hour): count for day, hour, count in rows}
+    
+    def iter_appointments(self, batch_size: int = 1000) -> Iterator[Appointment]:
+        """Потоково перебрать все записи (для выгрузок и массовых проверок)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = _model_factory(Appointment)
+        
+        try:
+            cursor.execute(f"SELECT {APPOINTMENT_COLUMNS} FROM appointments ORDER BY id")
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield from batch
+        finally:
+            conn.close()
+    
     def search_knowledge_base(self, query: str) -> Optional[str]:
         """Поиск ответа в базе знаний с улучшенным алгоритмом"""
         conn = self.get_connection()
@@ -253,8 +510,8 @@ class Database:
         cleaned_query = re.sub(r'[^\w\s]', '', query_lower)
         words = [w for w in cleaned_query.split() if len(w) > 2]  # Слова длиннее 2 символов
         
-        # Ищем по ключевым словам (приоритет более длинным словам)
-        words_sorted = sorted(words, key=len, reverse=True)
+        # Ищем по ключевым словам (приоритет более длинным словам, служебные пропускаем)
+        words_sorted = sorted((w for w in words if w not in KB_STOP_WORDS), key=len, reverse=True)
         
         for word in words_sorted:
             cursor.execute("""
@@ -284,6 +541,37 @@ class Database:
         conn.close()
         return None
     
+    def get_knowledge_entries(self) -> List[tuple]:
+        """Все пары (вопрос, ответ) в порядке добавления - в нем же идет поиск"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        try:
+            cursor.execute("SELECT question, answer FROM knowledge_base ORDER BY id")
+            return cursor.fetchall()
+        finally:
+            conn.close()
+    
+    def replace_knowledge_base(self, entries: List[tuple]) -> bool:
+        """Заменить всю базу знаний парами (вопрос, ответ) одной транзакцией"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("DELETE FROM knowledge_base")
+            cursor.executemany(
+                "INSERT OR REPLACE INTO knowledge_base (question, answer) VALUES (?, ?)",
+                [(question.lower(), answer) for question, answer in entries]
+            )
+            conn.commit()
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.error("Ошибка замены базы знаний: %s", e)
+            return False
+        finally:
+            conn.close()
+    
     def is_complex_question(self, query: str) -> bool:
         """Проверяет, является ли вопрос сложным (требует детального ответа)"""
         complex_keywords = [
@@ -328,7 +616,7 @@ class Database:
             conn.commit()
             return True
         except Exception as e:
-            print(f"Ошибка добавления в базу знаний: {e}")
+            logger.error("Ошибка добавления в базу знаний: %s", e)
             return False
         finally:
             conn.close()
@@ -343,9 +631,25 @@ class Database:
         conn.close()
         
         if row is None:
-            return True
+            # Давно неактивные пользователи перенесены в архив - они не новые
+            return not self._in_welcome_archive(user_id)
         return bool(row['is_new_user'])
     
+    def _in_welcome_archive(self, user_id: int) -> bool:
+        """Есть ли пользователь в архиве журнала приветствий"""
+        if not os.path.exists(self.archive_path):
+            return False
+        conn = sqlite3.connect(f"file:{self.archive_path}?mode=ro", uri=True)
+        try:
+            return conn.execute(
+                "SELECT 1 FROM user_welcome_log WHERE user_id = ?", (user_id,)
+            ).fetchone() is not None
+        except sqlite3.OperationalError:
+            # Архив есть, но журнал приветствий в него еще не переносился
+            return False
+        finally:
+            conn.close()
+    
     def get_last_activity_time(self, user_id: int) -> Optional[str]:
         """Получить время последней активности пользователя"""
         conn = self.get_connection()
@@ -374,7 +678,7 @@ class Database:
             """, (user_id, now, now, 1 if is_new else 0))
             conn.commit()
         except Exception as e:
-            print(f"Ошибка при сохранении лога приветствия: {e}")
+            logger.error("Ошибка при сохранении лога приветствия: %s", e)
         finally:
             conn.close()
     
@@ -386,23 +690,17 @@ class Database:
         
         now = datetime.now().isoformat()
         try:
-            # Проверяем, существует ли запись
-            cursor.execute("SELECT user_id FROM user_welcome_log WHERE user_id = ?", (user_id,))
-            if cursor.fetchone():
-                cursor.execute("""
-                    UPDATE user_welcome_log 
-                    SET last_activity_at = ?, is_new_user = 0
-                    WHERE user_id = ?
-                """, (now, user_id))
-            else:
-                cursor.execute("""
-                    INSERT INTO user_welcome_log 
-                    (user_id, last_activity_at, is_new_user)
-                    VALUES (?, ?, 0)
-                """, (user_id, now))
+            # Одним запросом: между проверкой наличия строки и вставкой ее мог добавить другой поток
+            cursor.execute("""
+                INSERT INTO user_welcome_log (user_id, last_activity_at, is_new_user)
+                VALUES (?, ?, 0)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    last_activity_at = excluded.last_activity_at,
+                    is_new_user = 0
+            """, (user_id, now))
             conn.commit()
         except Exception as e:
-            print(f"Ошибка при обновлении активности: {e}")
+            logger.error("Ошибка при обновлении активности: %s", e)
         finally:
             conn.close()
     
@@ -425,5 +723,328 @@ class Database:
             return time_diff > timedelta(hours=24)
         except (ValueError, TypeError):
             return True
-
-
+    
+    def record_event(self, event: str, user_id: Optional[int] = None, step: Optional[str] = None):
+        """Записать одно событие в журнал и обновить часовой и дневной агрегаты"""
+        from datetime import datetime
+        self.record_events([(datetime.now().isoformat(timespec="seconds"), user_id, event, step or '')])
+    
+    def record_events(self, events: List[tuple]):
+        """
+        Записать пачку событий: список (created_at, user_id, event, step)
+        
+        Агрегаты обновляются в той же транзакции, поэтому отчетам не нужно
+        сканировать журнал: достаточно прочитать по строке на час/день.
+        Одинаковые события пачки сворачиваются в одно обновление агрегата.
+        """
+        rollup = {}
+        for created_at, _, event, step in events:
+            for period, bucket in (("hour", created_at[:13]), ("day", created_at[:10])):
+                key = (period, bucket, event, step)
+                rollup[key] = rollup.get(key, 0) + 1
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.executemany("""
+                INSERT INTO bot_events (created_at, user_id, event, step)
+                VALUES (?, ?, ?, ?)
+            """, events)
+            cursor.executemany("""
+                INSERT INTO analytics_rollup (period, bucket, event, step, count)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (period, bucket, event, step) DO UPDATE SET count = count + excluded.count
+            """, [key + (count,) for key, count in rollup.items()])
+            conn.commit()
+        except Exception as e:
+            logger.error("Ошибка при сохранении события: %s", e)
+        finally:
+            conn.close()
+    
+    def get_rollup(self, period: str = "day", since: Optional[str] = None) -> List[dict]:
+        """Получить агрегаты событий за период ("hour" или "day") начиная с bucket `since`"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT bucket, event, step, count FROM analytics_rollup
+            WHERE period = ? AND bucket >= ?
+            ORDER BY bucket, event, step
+        """, (period, since or ''))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+    
+    def rebuild_rollups(self):
+        """Пересчитать агрегаты с нуля по журналу событий (после ручной правки журнала)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute("DELETE FROM analytics_rollup")
+            cursor.execute("""
+                INSERT INTO analytics_rollup (period, bucket, event, step, count)
+                SELECT 'hour', substr(created_at, 1, 13), event, step, COUNT(*)
+                FROM bot_events GROUP BY 2, 3, 4
+            """)
+            cursor.execute("""
+                INSERT INTO analytics_rollup (period, bucket, event, step, count)
+                SELECT 'day', substr(created_at, 1, 10), event, step, COUNT(*)
+                FROM bot_events GROUP BY 2, 3, 4
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def add_kb_misses(self, misses: List[tuple]) -> bool:
+        """Сохранить пачку вопросов без ответа: список (created_at, user_id, question)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.executemany(
+                "INSERT INTO kb_misses (created_at, user_id, question) VALUES (?, ?, ?)",
+                misses
+            )
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error("Ошибка сохранения вопросов без ответа: %s", e)
+            return False
+        finally:
+            conn.close()
+    
+    def iter_kb_misses(self, since: Optional[str] = None, batch_size: int = 1000) -> Iterator[str]:
+        """Потоково перебрать вопросы без ответа, не загружая их все в память"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.execute(
+                "SELECT question FROM kb_misses WHERE created_at >= ? ORDER BY id",
+                (since or '',)
+            )
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row['question']
+        finally:
+            conn.close()
+    
+    def save_conversation_contexts(self, contexts: List[tuple]) -> bool:
+        """Сохранить контексты диалогов: список (user_id, payload)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        try:
+            cursor.executemany("""
+                INSERT OR REPLACE INTO conversation_context (user_id, payload, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            """, contexts)
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error("Ошибка сохранения контекста диалогов: %s", e)
+            return False
+        finally:
+            conn.close()
+    
+    def load_conversation_context(self, user_id: int) -> Optional[str]:
+        """Получить сохраненный контекст диалога пользователя"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT payload FROM conversation_context WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if row:
+            return row['payload']
+        return None
+    
+    def get_bot_state(self, key: str) -> Optional[str]:
+        """Получить служебное значение бота"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute("SELECT value FROM bot_state WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        return row['value'] if row else None
+    
+    def set_bot_state(self, key: str, value: str) -> bool:
+        """Сохранить служебное значение бота"""
+        conn = self.get_connection()
+        try:
+            conn.execute("""
+                INSERT OR REPLACE INTO bot_state (key, value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+            """, (key, value))
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error("Ошибка сохранения состояния бота: %s", e)
+            return False
+        finally:
+            conn.close()
+    
+    def backup_to(self, target_path: str, pages: int = 256) -> None:
+        """
+        Сделать консистентную копию БД через SQLite backup API
+        
+        Копирование идет порциями по `pages` страниц, между порциями
+        блокировка чтения снимается, поэтому запись бота не простаивает.
+        """
+        source = sqlite3.connect(self.db_name)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=pages)
+        finally:
+            target.close()
+            source.close()
+    
+    def is_incremental_vacuum_enabled(self) -> bool:
+        """Включен ли режим auto_vacuum = INCREMENTAL"""
+        conn = self.get_connection()
+        try:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        finally:
+            conn.close()
+    
+    def normalize_appointment_contacts(self) -> int:
+        """
+        Привести адреса и телефоны записей, сделанных до нормализации, к
+        единому виду (телефон в E.164, адрес без лишних пробелов)
+        
+        Меняет данные клиентов, поэтому при запуске бота не выполняется:
+        вызывается один раз вручную (`python maintenance.py --normalize-contacts`).
+        
+        Returns:
+            int: число измененных записей
+        """
+        conn = self.get_connection()
+        try:
+            rows = conn.execute("SELECT id, address, phone FROM appointments").fetchall()
+            changes = []
+            for row in rows:
+                address = clean_address(row['address'])
+                phone = normalize_phone(row['phone']) or row['phone']
+                if (address, phone) != (row['address'], row['phone']):
+                    changes.append((address, phone, address_hash(address), row['id']))
+            conn.executemany(
+                "UPDATE appointments SET address = ?, phone = ?, address_hash = ? WHERE id = ?", changes
+            )
+            conn.commit()
+            logger.info("Нормализованы адреса и телефоны записей: %d", len(changes))
+            return len(changes)
+        finally:
+            conn.close()
+    
+    def enable_incremental_vacuum(self) -> bool:
+        """
+        Включить auto_vacuum = INCREMENTAL в уже существующей базе
+        
+        Требует одного полного VACUUM: он переписывает весь файл и на это
+        время блокирует базу целиком, поэтому вызывается только вручную при
+        остановленном боте (`python maintenance.py --enable-incremental-vacuum`).
+        
+        Returns:
+            bool: True если понадобился VACUUM
+        """
+        conn = self.get_connection()
+        try:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return False
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return True
+        finally:
+            conn.close()
+    
+    def incremental_vacuum(self, pages: int = 1000) -> int:
+        """Вернуть файловой системе до `pages` свободных страниц, вернуть их число"""
+        conn = self.get_connection()
+        try:
+            freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute() делает только один шаг прагмы (одну страницу),
+            # executescript() выполняет ее до конца
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            return freelist - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            conn.close()
+    
+    def archive_appointments(self, before: str) -> int:
+        """
+        Перенести записи с датой раньше `before` (ГГГГ-ММ-ДД) в архив
+        
+        В архивной базе записи лежат по годам: appointments_2024,
+        appointments_2025 и т.д. Перенос и удаление идут одной транзакцией.
+        
+        Returns:
+            int: Сколько записей перенесено
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            years = [row[0] for row in conn.execute(
+                "SELECT DISTINCT substr(date_iso, 1, 4) FROM main.appointments WHERE date_iso < ?", (before,)
+            )]
+            columns = [row[1] for row in conn.execute("PRAGMA main.table_info(appointments)")]
+            with conn:
+                for year in years:
+                    if not re.fullmatch(r"\d{4}", year or ""):
+                        continue
+                    table = f"archive.appointments_{year}"
+                    conn.execute(f"CREATE TABLE IF NOT EXISTS {table} AS SELECT * FROM main.appointments WHERE 0")
+                    # Колонки, добавленные в рабочую таблицу после создания архивной
+                    archived = {row[1] for row in conn.execute(f"PRAGMA archive.table_info(appointments_{year})")}
+                    for column in columns:
+                        if column not in archived:
+                            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+                    conn.execute(f"""
+                        INSERT INTO {table} ({', '.join(columns)})
+                        SELECT {', '.join(columns)} FROM main.appointments
+                        WHERE date_iso < ? AND substr(date_iso, 1, 4) = ?
+                    """, (before, year))
+                moved = conn.execute(
+                    "DELETE FROM main.appointments WHERE date_iso < ? AND date_iso GLOB '[0-9][0-9][0-9][0-9]-*'",
+                    (before,)
+                ).rowcount
+            conn.execute("DETACH DATABASE archive")
+            return moved
+        finally:
+            conn.close()
+    
+    def archive_welcome_log(self, before: str) -> int:
+        """
+        Перенести в архив строки журнала приветствий пользователей,
+        не проявлявших активности с `before` (ISO-дата или дата-время)
+        
+        Returns:
+            int: Сколько строк перенесено
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS archive.user_welcome_log (
+                    user_id INTEGER PRIMARY KEY,
+                    welcome_sent_at TEXT,
+                    last_activity_at TEXT,
+                    is_new_user INTEGER
+                )
+            """)
+            stale = "COALESCE(last_activity_at, welcome_sent_at) < ?"
+            with conn:
+                conn.execute(f"""
+                    INSERT OR REPLACE INTO archive.user_welcome_log
+                    SELECT user_id, welcome_sent_at, last_activity_at, is_new_user
+                    FROM main.user_welcome_log WHERE {stale}
+                """, (before,))
+                moved = conn.execute(f"DELETE FROM main.user_welcome_log WHERE {stale}", (before,)).rowcount
+            conn.execute("DETACH DATABASE archive")
+            return moved
+        finally:
+            conn.close()
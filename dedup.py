@@ -0,0 +1,230 @@
+"""
+Защита от повторной обработки апдейтов
+
+После перезапуска polling Telegram заново отдает апдейты, получение которых
+бот не успел подтвердить, а при webhook тот же апдейт приходит повторно, если
+ответ не дошел. Без защиты повтор последнего шага записи создает вторую запись.
+
+`UpdateWindow` помнит номера последних `size` апдейтов в кольцевом битовом
+массиве: проверка и отметка апдейта - O(1) без обращений к БД. Номера
+апдейтов в Telegram растут, а повтор приходит вскоре после оригинала,
+поэтому номер намного старше окна - не повтор. Так бывает, если бот неделю
+не получал апдейтов: Telegram начинает нумерацию заново со случайного, в том
+числе меньшего номера. Тогда окно начинается заново с этого номера.
+
+`UpdateDedupMiddleware` раз в `flush_interval` секунд (и при остановке бота)
+сохраняет в БД через пул потоков `AsyncDatabase` компактное состояние:
+границу, до которой все апдейты обработаны, и номера немногих уже
+обработанных апдейтов выше нее (их не больше, чем апдейтов обрабатывается
+одновременно). Апдейт, обработка которого
+прервалась из-за падения процесса, после перезапуска будет обработан заново.
+Сохраненное состояние читается при запуске polling (`load`), а не при
+создании бота.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from concurrency import AsyncDatabase
+
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = "update_dedup"
+
+
+class UpdateWindow:
+    """Номера последних `size` апдейтов в кольцевом битовом массиве"""
+    
+    def __init__(self, size: int = 4096):
+        self.size = size
+        self._bits = bytearray((size + 7) // 8)
+        # Наибольший отмеченный номер; окно - номера от top - size + 1 до top
+        self.top: Optional[int] = None
+    
+    def _test(self, update_id: int) -> bool:
+        index = update_id % self.size
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+    
+    def _set(self, update_id: int):
+        index = update_id % self.size
+        self._bits[index >> 3] |= 1 << (index & 7)
+    
+    def _clear(self, update_id: int):
+        index = update_id % self.size
+        self._bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+    
+    def _advance(self, update_id: int):
+        """Начать окно с `update_id`: сдвинуть вперед или, если номер вне окна, начать заново"""
+        if self.top is None or not 0 < update_id - self.top < self.size:
+            self._bits[:] = bytes(len(self._bits))
+        else:
+            # Ячейки новых номеров еще хранят номера, выпавшие из окна
+            for stale in range(self.top + 1, update_id + 1):
+                self._clear(stale)
+        self.top = update_id
+    
+    def in_window(self, update_id: int) -> bool:
+        """Попадает ли номер в окно (не новее и не намного старше последнего)"""
+        return self.top is not None and self.top - self.size < update_id <= self.top
+    
+    def contains(self, update_id: int) -> bool:
+        """Отмечен ли апдейт"""
+        return self.in_window(update_id) and self._test(update_id)
+    
+    def add(self, update_id: int) -> bool:
+        """
+        Отметить апдейт
+        
+        Номер новее окна сдвигает окно, а номер намного старше окна (Telegram
+        начал нумерацию заново) начинает окно с него.
+        
+        Returns:
+            False, если апдейт уже был отмечен (повтор)
+        """
+        if self.in_window(update_id):
+            if self._test(update_id):
+                return False
+        else:
+            self._advance(update_id)
+        self._set(update_id)
+        return True
+    
+    def marked_above(self, floor: int) -> List[int]:
+        """Отмеченные номера выше `floor` (в пределах окна)"""
+        if self.top is None:
+            return []
+        start = max(floor, self.top - self.size) + 1
+        return [update_id for update_id in range(start, self.top + 1) if self._test(update_id)]
+    
+    def restore(self, floor: int, marked: Iterable[int] = ()):
+        """Восстановить окно: номера окна до `floor` включительно и номера из `marked` обработаны"""
+        marked = [update_id for update_id in marked if update_id > floor]
+        self._bits[:] = bytes(len(self._bits))
+        self.top = max(marked, default=floor)
+        for update_id in range(self.top - self.size + 1, floor + 1):
+            self._set(update_id)
+        for update_id in marked:
+            if update_id > self.top - self.size:
+                self._set(update_id)
+
+
+class UpdateDedupMiddleware(BaseMiddleware):
+    """Outer-middleware: каждый апдейт обрабатывается один раз, повторы отбрасываются"""
+    
+    def __init__(self, adb: Optional[AsyncDatabase] = None, window: int = 4096, flush_interval: float = 5.0):
+        """
+        Args:
+            adb: БД для сохранения состояния; без нее окно живет только в памяти
+            window: Сколько последних номеров апдейтов помнить
+            flush_interval: Как часто сохранять состояние, сек
+        """
+        self.adb = adb
+        self.flush_interval = flush_interval
+        self.window = UpdateWindow(window)
+        # Апдейты, обработка которых началась, но не закончилась
+        self._in_flight: Set[int] = set()
+        self._dirty = False
+        self._last_flush = time.monotonic()
+        # Сохранения идут по одному, иначе старое состояние могло бы записаться поверх нового
+        self._flush_lock = asyncio.Lock()
+        # Сохраненное состояние читается не в конструкторе, а в `load`
+        self._loaded = adb is None
+        self._load_lock = asyncio.Lock()
+        self.duplicates = 0
+    
+    async def load(self):
+        """
+        Прочитать сохраненное состояние из БД (один раз)
+        
+        Бот вызывает его при запуске polling; если апдейт пришел раньше
+        (replay.py, тесты), состояние читается перед его обработкой.
+        """
+        async with self._load_lock:
+            if self._loaded:
+                return
+            payload = await self.adb.get_bot_state(STATE_KEY)
+            self._loaded = True
+            if payload is None:
+                return
+            try:
+                state = json.loads(payload)
+                self.window.restore(int(state["floor"]), [int(update_id) for update_id in state["done"]])
+            except (ValueError, KeyError, TypeError):
+                logger.warning("Состояние защиты от повторов повреждено, начинаем заново")
+    
+    def detach(self):
+        """
+        Забыть обработанные апдейты и больше не сохранять состояние
+        
+        Для намеренного повторного прогона (replay.py): прогон не должен
+        затереть сохраненное состояние рабочего бота.
+        """
+        self.adb = None
+        self.window = UpdateWindow(self.window.size)
+        self._in_flight.clear()
+        self._dirty = False
+        self._loaded = True
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        if not self._loaded:
+            await self.load()
+        
+        update_id = event.update_id
+        if self.window.top is not None and update_id <= self.window.top - self.window.size:
+            logger.warning("Номер апдейта намного меньше прежних: Telegram начал нумерацию заново",
+                           extra={"update_id": update_id, "previous_top": self.window.top})
+        if not self.window.add(update_id):
+            self.duplicates += 1
+            logger.info("Повторный апдейт пропущен", extra={"update_id": update_id})
+            return None
+        
+        self._in_flight.add(update_id)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(update_id)
+            self._dirty = True
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                await self.flush()
+    
+    def snapshot(self) -> Tuple[int, List[int]]:
+        """
+        Состояние для сохранения
+        
+        Returns:
+            (граница, номера выше нее): все апдейты до границы обработаны, выше -
+            обработаны только перечисленные
+        """
+        top = self.window.top
+        if top is None:
+            return 0, []
+        # Незаконченные апдейты не должны оказаться ниже границы: после падения их нужно повторить.
+        # Апдейты, начатые до того, как Telegram сбросил нумерацию, в окно уже не входят
+        in_flight = [update_id for update_id in self._in_flight if self.window.in_window(update_id)]
+        floor = min(in_flight) - 1 if in_flight else top
+        done = [update_id for update_id in self.window.marked_above(floor) if update_id not in in_flight]
+        return floor, done
+    
+    async def flush(self):
+        """Сохранить состояние в БД, если оно менялось"""
+        self._last_flush = time.monotonic()
+        if self.adb is None:
+            return
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            floor, done = self.snapshot()
+            self._dirty = False
+            if not await self.adb.set_bot_state(STATE_KEY, json.dumps({"floor": floor, "done": done})):
+                self._dirty = True
@@ -0,0 +1,141 @@
+"""
+Выгрузка записей на замер в CSV или JSONL
+
+Строки читаются из БД порциями (`fetchmany`) и сразу пишутся в файл, поэтому
+расход памяти не зависит от размера таблицы. Фильтр по датам идет по
+индексу `appointments (date_iso, time)`.
+
+Запуск:
+    python export.py --from 2024-12-01 --to 2024-12-31 -o december.csv
+    python export.py --format jsonl > all.jsonl
+"""
+import argparse
+import csv
+import json
+import sqlite3
+import sys
+from typing import Iterator, Optional, TextIO, Tuple
+from config import add_script_arguments, load_script_config
+
+
+EXPORT_COLUMNS = (
+    "id", "date", "time", "address", "phone", "notes", "created_at",
+    "user_id", "username", "first_name",
+)
+
+
+def open_read_only(path: str) -> sqlite3.Connection:
+    """
+    Открыть БД только для чтения
+    
+    Выгрузка не создает таблицы и не заполняет базу знаний, как это делает
+    `Database`, и не может ничего изменить в рабочей базе.
+    """
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def iter_export_rows(conn: sqlite3.Connection, date_from: Optional[str] = None,
+                     date_to: Optional[str] = None, batch_size: int = 1000) -> Iterator[Tuple]:
+    """
+    Потоково перебрать записи вместе с данными клиента
+    
+    Args:
+        conn: Соединение с БД (рабочей или снимком)
+        date_from: Начальная дата включительно, ГГГГ-ММ-ДД
+        date_to: Конечная дата включительно, ГГГГ-ММ-ДД
+        batch_size: Сколько строк читать за раз
+    """
+    conditions = []
+    params = []
+    if date_from:
+        conditions.append("a.date_iso >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("a.date_iso <= ?")
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    cursor = conn.cursor()
+    # Кортежи вместо sqlite3.Row: строки сразу уходят в writer
+    cursor.row_factory = None
+    cursor.execute(f"""
+        SELECT a.id, a.date, a.time, a.address, a.phone, a.notes, a.created_at,
+               a.user_id, c.username, c.first_name
+        FROM appointments a
+        LEFT JOIN clients c ON c.user_id = a.user_id
+        {where}
+        ORDER BY a.date_iso, a.time, a.id
+    """, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def write_csv(rows: Iterator[Tuple], out: TextIO, delimiter: str = ";") -> int:
+    """Записать строки в CSV с заголовком, вернуть количество строк"""
+    writer = csv.writer(out, delimiter=delimiter)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_jsonl(rows: Iterator[Tuple], out: TextIO) -> int:
+    """Записать строки в JSONL (по объекту на строку), вернуть количество строк"""
+    count = 0
+    for row in rows:
+        out.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+        out.write("\n")
+        count += 1
+    return count
+
+
+def export_appointments(conn: sqlite3.Connection, out: TextIO, fmt: str = "csv",
+                        date_from: Optional[str] = None, date_to: Optional[str] = None,
+                        delimiter: str = ";", batch_size: int = 1000) -> int:
+    """Выгрузить записи в `out` в формате csv или jsonl"""
+    rows = iter_export_rows(conn, date_from, date_to, batch_size)
+    if fmt == "csv":
+        return write_csv(rows, out, delimiter)
+    if fmt == "jsonl":
+        return write_jsonl(rows, out)
+    raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка записей на замер")
+    add_script_arguments(parser)
+    parser.add_argument("--from", dest="date_from", default=None, help="с даты ГГГГ-ММ-ДД")
+    parser.add_argument("--to", dest="date_to", default=None, help="по дату ГГГГ-ММ-ДД")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    parser.add_argument("--delimiter", default=";", help="разделитель CSV (для Excel - ';')")
+    parser.add_argument("-o", "--output", default=None, help="файл выгрузки (по умолчанию stdout)")
+    args = parser.parse_args()
+    path = load_script_config(parser, args).database.path
+    
+    try:
+        conn = open_read_only(path)
+        # Схему выгрузка не создает: в файле без таблицы записей это не база бота
+        conn.execute("SELECT 1 FROM appointments LIMIT 1")
+    except sqlite3.Error as e:
+        parser.error(f"не удалось открыть БД {path}: {e}")
+    try:
+        if args.output:
+            # utf-8-sig: Excel правильно открывает кириллицу
+            encoding = "utf-8-sig" if args.format == "csv" else "utf-8"
+            with open(args.output, "w", encoding=encoding, newline="") as out:
+                count = export_appointments(conn, out, args.format, args.date_from, args.date_to, args.delimiter)
+        else:
+            count = export_appointments(conn, sys.stdout, args.format, args.date_from, args.date_to, args.delimiter)
+    finally:
+        conn.close()
+    
+    print(f"Выгружено записей: {count}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
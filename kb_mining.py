@@ -0,0 +1,157 @@
+"""
+Сбор и разбор вопросов, на которые бот не нашел ответа
+
+Во время работы бот складывает промахи базы знаний в буфер `MissLogBuffer`
+(concurrency.py), который пишет их в БД пачками из фоновой задачи.
+Офлайн-задача группирует накопленные вопросы по почти-дубликатам (MinHash +
+LSH за один проход) и выводит самые частые группы, чтобы оператор добавил
+для них ответы через `add_to_knowledge_base`.
+
+Запуск отчета:
+    python kb_mining.py --top 20
+"""
+import argparse
+import re
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+from config import add_script_arguments, load_script_config
+from database import Database
+
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize_question(text: str) -> str:
+    """Привести вопрос к виду для сравнения: нижний регистр, без знаков препинания"""
+    return " ".join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+
+def shingles(text: str, size: int = 3) -> Set[int]:
+    """Множество хешей символьных n-грамм (устойчиво к окончаниям слов)"""
+    if len(text) <= size:
+        return {zlib.crc32(text.encode("utf-8"))}
+    return {zlib.crc32(text[i:i + size].encode("utf-8")) for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    """Вычисление MinHash-сигнатур фиксированной длины"""
+    
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        # Детерминированные параметры перестановок h(x) = (a*x + b) mod p
+        state = seed
+        self.params: List[Tuple[int, int]] = []
+        for _ in range(num_perm):
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            a = state % (_MERSENNE_PRIME - 1) + 1
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            b = state % _MERSENNE_PRIME
+            self.params.append((a, b))
+    
+    def signature(self, items: Set[int]) -> Tuple[int, ...]:
+        return tuple(min((a * x + b) % _MERSENNE_PRIME for x in items) for a, b in self.params)
+
+
+class QuestionCluster:
+    """Группа похожих вопросов"""
+    
+    __slots__ = ("representative", "signature", "count", "examples")
+    
+    def __init__(self, representative: str, signature: Tuple[int, ...]):
+        self.representative = representative
+        self.signature = signature
+        self.count = 0
+        self.examples: Dict[str, int] = {}
+
+
+class StreamingClusterer:
+    """
+    Однопроходная кластеризация почти-дубликатов через LSH по полосам MinHash
+    
+    Память растет с числом групп, а не с числом вопросов: каждый новый вопрос
+    сравнивается только с кандидатами из совпавших LSH-корзин.
+    """
+    
+    def __init__(self, num_perm: int = 64, bands: int = 16, threshold: float = 0.5,
+                 max_examples: int = 5):
+        if num_perm % bands:
+            raise ValueError("num_perm должен делиться на bands")
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.max_examples = max_examples
+        self.clusters: List[QuestionCluster] = []
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+    
+    def add(self, question: str):
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        signature = self.hasher.signature(shingles(normalized))
+        band_keys = [(band, signature[band * self.rows:(band + 1) * self.rows])
+                     for band in range(self.bands)]
+        
+        cluster = self._find_cluster(signature, band_keys)
+        if cluster is None:
+            cluster = QuestionCluster(normalized, signature)
+            index = len(self.clusters)
+            self.clusters.append(cluster)
+            for key in band_keys:
+                self._buckets.setdefault(key, []).append(index)
+        
+        cluster.count += 1
+        if normalized in cluster.examples or len(cluster.examples) < self.max_examples:
+            cluster.examples[normalized] = cluster.examples.get(normalized, 0) + 1
+    
+    def _find_cluster(self, signature: Tuple[int, ...], band_keys) -> Optional[QuestionCluster]:
+        best, best_similarity = None, self.threshold
+        seen: Set[int] = set()
+        for key in band_keys:
+            for index in self._buckets.get(key, ()):
+                if index in seen:
+                    continue
+                seen.add(index)
+                candidate = self.clusters[index]
+                similarity = sum(x == y for x, y in zip(signature, candidate.signature)) / len(signature)
+                if similarity >= best_similarity:
+                    best, best_similarity = candidate, similarity
+        return best
+    
+    def top(self, limit: int = 20) -> List[QuestionCluster]:
+        """Группы, отсортированные по частоте"""
+        return sorted(self.clusters, key=lambda c: c.count, reverse=True)[:limit]
+
+
+def mine_unanswered(db: Database, since: Optional[str] = None, limit: int = 20,
+                    threshold: float = 0.5) -> List[QuestionCluster]:
+    """Сгруппировать вопросы без ответа и вернуть самые частые группы"""
+    clusterer = StreamingClusterer(threshold=threshold)
+    for question in db.iter_kb_misses(since):
+        clusterer.add(question)
+    return clusterer.top(limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Самые частые вопросы без ответа в базе знаний")
+    add_script_arguments(parser)
+    parser.add_argument("--since", default=None, help="учитывать вопросы начиная с даты ГГГГ-ММ-ДД")
+    parser.add_argument("--top", type=int, default=20, help="сколько групп показать")
+    parser.add_argument("--threshold", type=float, default=0.5, help="порог сходства Жаккара")
+    args = parser.parse_args()
+    config = load_script_config(parser, args)
+    
+    db = Database(config.database.path, busy_timeout=config.database.busy_timeout)
+    clusters = mine_unanswered(db, args.since, args.top, args.threshold)
+    if not clusters:
+        print("Вопросов без ответа нет.")
+        return
+    
+    for i, cluster in enumerate(clusters, 1):
+        print(f"{i}. [{cluster.count}] {cluster.representative}")
+        for example, count in sorted(cluster.examples.items(), key=lambda item: item[1], reverse=True):
+            if example != cluster.representative:
+                print(f"     {count} x {example}")
+
+
+if __name__ == "__main__":
+    main()
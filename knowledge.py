@@ -0,0 +1,185 @@
+"""
+База знаний в памяти с перезагрузкой без перезапуска бота
+
+Бот ищет ответы не запросами к SQLite, а в неизменяемом снимке
+`KnowledgeSnapshot`. При изменении базы знаний собирается новый снимок и
+одним присваиванием подменяет старый: поиск не берет блокировок, а запросы,
+начатые до подмены, дорабатывают со старым снимком.
+
+Источник - таблица `knowledge_base` или JSON-файл, который при перезагрузке
+целиком переписывается в таблицу:
+    [{"question": "гарантия", "answer": "Гарантия до 5 лет"}, ...]
+Порядок элементов задает приоритет: при нескольких совпадениях выигрывает
+более ранний вопрос.
+
+Перезагрузка: команда /reload_kb (для администраторов) или наблюдение
+за изменением файла.
+
+Выгрузить текущую базу знаний в файл:
+    python knowledge.py --dump knowledge_base.json
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+from typing import Iterable, List, Optional, Tuple
+from config import add_script_arguments, load_script_config
+from database import KB_STOP_WORDS, Database
+
+
+logger = logging.getLogger(__name__)
+
+
+class KnowledgeSnapshot:
+    """Неизменяемый снимок базы знаний"""
+    
+    __slots__ = ("entries", "version")
+    
+    def __init__(self, entries: Iterable[Tuple[str, str]], version: int = 0):
+        self.entries: Tuple[Tuple[str, str], ...] = tuple(
+            (question.lower(), answer) for question, answer in entries
+        )
+        self.version = version
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def _find(self, fragment: str) -> Optional[str]:
+        for question, answer in self.entries:
+            if fragment in question:
+                return answer
+        return None
+    
+    def search(self, query: str) -> Optional[str]:
+        """
+        Поиск ответа - те же правила, что в `Database.search_knowledge_base`:
+        полное вхождение запроса, затем отдельные слова (сначала длинные,
+        кроме служебных), затем пары соседних слов
+        """
+        query_lower = query.lower().strip()
+        
+        answer = self._find(query_lower)
+        if answer is not None:
+            return answer
+        
+        cleaned_query = re.sub(r'[^\w\s]', '', query_lower)
+        words = [w for w in cleaned_query.split() if len(w) > 2]
+        
+        for word in sorted((w for w in words if w not in KB_STOP_WORDS), key=len, reverse=True):
+            answer = self._find(word)
+            if answer is not None:
+                return answer
+        
+        for i in range(len(words) - 1):
+            answer = self._find(f"{words[i]} {words[i+1]}")
+            if answer is not None:
+                return answer
+        
+        return None
+
+
+def load_kb_file(path: str) -> List[Tuple[str, str]]:
+    """Прочитать базу знаний из JSON-файла, проверив формат"""
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+    
+    entries = []
+    for i, item in enumerate(items):
+        question = str(item.get("question", "")).strip()
+        answer = str(item.get("answer", "")).strip()
+        if not question or not answer:
+            raise ValueError(f"Элемент {i}: нужны непустые question и answer")
+        entries.append((question, answer))
+    return entries
+
+
+class KnowledgeBaseStore:
+    """Текущий снимок базы знаний и его перезагрузка"""
+    
+    def __init__(self, db: Database, source_path: Optional[str] = None, watch_interval: float = 5.0):
+        self.db = db
+        self.source_path = source_path
+        self.watch_interval = watch_interval
+        self._snapshot = KnowledgeSnapshot(())
+        # Перезагрузки выполняются по одной; поиск эту блокировку не берет
+        self._reload_lock = threading.Lock()
+        self._source_mtime: Optional[float] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    @property
+    def snapshot(self) -> KnowledgeSnapshot:
+        return self._snapshot
+    
+    def search(self, query: str) -> Optional[str]:
+        """Найти ответ в текущем снимке"""
+        return self._snapshot.search(query)
+    
+    def reload(self) -> KnowledgeSnapshot:
+        """
+        Собрать новый снимок и подменить им текущий
+        
+        Если задан файл, его содержимое сначала переписывается в таблицу.
+        При ошибке в файле исключение пробрасывается, а текущий снимок
+        остается прежним.
+        """
+        with self._reload_lock:
+            if self.source_path:
+                mtime = os.path.getmtime(self.source_path)
+                entries = load_kb_file(self.source_path)
+                if not self.db.replace_knowledge_base(entries):
+                    raise RuntimeError("Не удалось записать базу знаний в БД")
+                self._source_mtime = mtime
+            snapshot = KnowledgeSnapshot(self.db.get_knowledge_entries(), self._snapshot.version + 1)
+            self._snapshot = snapshot
+        logger.info("База знаний загружена", extra={"kb_version": snapshot.version, "kb_entries": len(snapshot)})
+        return snapshot
+    
+    def start(self):
+        """Запустить наблюдение за файлом базы знаний (если он задан)"""
+        if not self.source_path or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="kb-watch", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Остановить наблюдение за файлом"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self):
+        while not self._stop_event.wait(self.watch_interval):
+            try:
+                mtime = os.path.getmtime(self.source_path)
+            except OSError:
+                # Файл могут заменять в этот момент - проверим в следующий раз
+                continue
+            if mtime == self._source_mtime:
+                continue
+            try:
+                self.reload()
+            except Exception:
+                logger.exception("Ошибка перезагрузки базы знаний")
+                # Ошибочную версию файла не перечитываем, ждем следующего изменения
+                self._source_mtime = mtime
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Выгрузка базы знаний в JSON")
+    add_script_arguments(parser)
+    parser.add_argument("--dump", required=True, metavar="PATH", help="файл для выгрузки")
+    args = parser.parse_args()
+    config = load_script_config(parser, args)
+    
+    db = Database(config.database.path, busy_timeout=config.database.busy_timeout)
+    entries = db.get_knowledge_entries()
+    with open(args.dump, "w", encoding="utf-8") as f:
+        json.dump([{"question": q, "answer": a} for q, a in entries], f, ensure_ascii=False, indent=2)
+    print(f"Выгружено вопросов: {len(entries)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,127 @@
 """
 Главный файл для запуска бота
+
+Тяжелые модули (aiogram и все, что от него зависит) импортируются внутри
+`main()`, по фазам: так каждую фазу запуска видно в отчете
+`--profile-startup`. Редко нужные подсистемы (запись апдейтов, обслуживание
+БД) подключаются только когда нужны, а начальное заполнение и загрузка
+базы знаний идут в фоне после начала polling.
 """
+from startup import StartupTimer
+
+# Таймер создается до всех остальных импортов, чтобы замерить и их
+STARTUP = StartupTimer()
+
+import argparse
 import asyncio
-from bot import WindowBot
+import logging
+import signal
+from typing import Optional
+from config import Config, ConfigError, load_config, read_token
 
 
-def read_token() -> str:
-    """Чтение токена из файла"""
-    try:
-        with open("token.txt", "r", encoding="utf-8") as f:
-            return f.read().strip()
-    except FileNotFoundError:
-        raise FileNotFoundError("Файл token.txt не найден! Создайте файл и укажите в нем токен бота.")
+logger = logging.getLogger(__name__)
 
 
-async def main():
+def apply_cli_overrides(config: Config, args: argparse.Namespace) -> Config:
+    """Флаги командной строки важнее файла настроек и переменных окружения"""
+    if args.kb_file is not None:
+        config = config.override("knowledge", file=args.kb_file)
+    if args.admin_id:
+        config = config.override("bot", admin_ids=tuple(args.admin_id))
+    if args.profile_every is not None:
+        if args.profile_every < 0:
+            raise ConfigError("--profile-every: должно быть не меньше 0")
+        config = config.override("profiling", sample_every=args.profile_every)
+    return config
+
+
+async def main(config: Config, record_updates: Optional[str] = None, profile_startup: bool = False):
     """Основная функция"""
-    token = read_token()
-    bot = WindowBot(token)
+    with STARTUP.phase("импорт aiogram"):
+        import aiogram  # noqa: F401
+    with STARTUP.phase("импорт модулей бота"):
+        from bot import WindowBot
+        from bot_logging import setup_logging
+        from database import Database
+    with STARTUP.phase("логирование"):
+        log_listener = setup_logging(getattr(logging, config.logging.level.upper()),
+                                     debug_sample_rate=config.logging.debug_sample_rate)
+    with STARTUP.phase("токен"):
+        token = read_token(config.bot)
+    with STARTUP.phase("база данных"):
+        # Начальные вопросы базы знаний добавляются позже, в фоне
+        db = Database(config.database.path, seed_knowledge_base=False,
+                      busy_timeout=config.database.busy_timeout)
+    with STARTUP.phase("создание бота"):
+        bot = WindowBot(token, db=db, config=config, defer_warm_up=True)
+    
+    # kill -USR1 <pid> сохраняет накопленный профиль в profiles/
+    if bot.profiler is not None and hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, bot.profiler.dump)
+    
+    # Запись входящих апдейтов для последующего воспроизведения (replay.py)
+    recorder = None
+    if record_updates:
+        from replay import UpdateRecorder
+        recorder = UpdateRecorder(record_updates)
+        bot.dp.update.outer_middleware(recorder)
     
-    print("Бот запущен...")
+    def on_first_update():
+        logger.info("Получен первый апдейт", extra={"startup_ms": STARTUP.as_dict()})
+        if profile_startup:
+            STARTUP.report()
+    
+    bot.dp.update.outer_middleware(STARTUP.first_update_hook(on_first_update))
+    
+    # Резервные копии, архивирование и сжатие БД - в фоне после начала polling
+    maintenance = None
+    
+    async def on_polling_started():
+        nonlocal maintenance
+        STARTUP.mark("начало polling")
+        if profile_startup:
+            STARTUP.report()
+        if not config.maintenance.enabled:
+            return
+        from maintenance import MaintenanceTask
+        maintenance = MaintenanceTask.from_config(bot.db, config.maintenance)
+        maintenance.start()
+    
+    bot.dp.startup.register(on_polling_started)
+    
+    logger.info("Бот запущен")
     try:
         await bot.start()
     except KeyboardInterrupt:
-        print("\nОстановка бота...")
+        logger.info("Остановка бота")
     finally:
         await bot.stop()
+        if maintenance is not None:
+            maintenance.stop()
+        if recorder is not None:
+            recorder.close()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
-
-
+    parser = argparse.ArgumentParser(description="Telegram бот записи на замер окон")
+    parser.add_argument("--config", default=None, metavar="PATH",
+                        help="JSON с настройками (по умолчанию config.json, если он есть)")
+    parser.add_argument("--record-updates", default=None, metavar="PATH",
+                        help="записывать входящие апдейты в JSONL для replay.py")
+    parser.add_argument("--kb-file", default=None, metavar="PATH",
+                        help="JSON с базой знаний; изменения подхватываются без перезапуска")
+    parser.add_argument("--admin-id", type=int, action="append", default=[], metavar="USER_ID",
+                        help="Telegram user_id администратора (для /reload_kb), можно повторять")
+    parser.add_argument("--profile-every", type=int, default=None, metavar="N",
+                        help="профилировать каждый N-й апдейт (cProfile и tracemalloc); 0 - выключено")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="вывести в stderr время фаз запуска и до первого апдейта")
+    args = parser.parse_args()
+    try:
+        with STARTUP.phase("настройки"):
+            config = apply_cli_overrides(load_config(args.config), args)
+    except ConfigError as e:
+        parser.exit(2, f"{e}\n")
+    asyncio.run(main(config, args.record_updates, args.profile_startup))
@@ -0,0 +1,201 @@
+"""
+Обслуживание базы данных: резервные копии, сжатие и архивирование
+
+`MaintenanceTask` работает в фоновом потоке бота:
+- раз в `backup_interval` снимает онлайн-копию через SQLite backup API и
+  хранит последние `keep_backups`. Каждая копия полная; если база не
+  менялась с прошлой копии (то же время изменения файла), копия не снимается;
+- раз в `maintenance_interval` переносит прошедшие записи и давно
+  неактивных пользователей в холодный архив (`appointments_archive.db`,
+  записи разложены по годам) и возвращает освободившееся место через
+  PRAGMA incremental_vacuum.
+
+В базе, созданной до появления auto_vacuum = INCREMENTAL, сжатие заработает
+только после одного полного VACUUM. Он блокирует базу на все время
+перезаписи файла, поэтому фоновая задача его не запускает: это делается
+вручную при остановленном боте.
+
+Разовый запуск всех шагов:
+    python maintenance.py --db appointments.db --backup-dir backups
+
+Включить инкрементальное сжатие в старой базе (бот должен быть остановлен):
+    python maintenance.py --db appointments.db --enable-incremental-vacuum
+
+Привести к единому виду телефоны и адреса записей, сделанных до нормализации:
+    python maintenance.py --db appointments.db --normalize-contacts
+"""
+import argparse
+import glob
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Optional
+from config import MaintenanceConfig, add_script_arguments, load_script_config
+from database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+class MaintenanceTask:
+    """Фоновое обслуживание БД по расписанию"""
+    
+    def __init__(self, db: Database, backup_dir: str = "backups", keep_backups: int = 7,
+                 backup_interval: float = 3600.0, maintenance_interval: float = 86400.0,
+                 appointment_retention_days: int = 180, welcome_retention_days: int = 365,
+                 vacuum_pages: int = 1000):
+        self.db = db
+        self.backup_dir = backup_dir
+        self.keep_backups = keep_backups
+        self.backup_interval = backup_interval
+        self.maintenance_interval = maintenance_interval
+        self.appointment_retention_days = appointment_retention_days
+        self.welcome_retention_days = welcome_retention_days
+        self.vacuum_pages = vacuum_pages
+        self._last_backup_mtime: Optional[float] = None
+        self._vacuum_warned = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    @classmethod
+    def from_config(cls, db: Database, settings: MaintenanceConfig) -> "MaintenanceTask":
+        """Обслуживание с параметрами из секции `maintenance` настроек"""
+        return cls(
+            db, backup_dir=settings.backup_dir, keep_backups=settings.keep_backups,
+            backup_interval=settings.backup_interval,
+            maintenance_interval=settings.maintenance_interval,
+            appointment_retention_days=settings.appointment_retention_days,
+            welcome_retention_days=settings.welcome_retention_days,
+            vacuum_pages=settings.vacuum_pages,
+        )
+    
+    def backup(self) -> Optional[str]:
+        """
+        Снять полную резервную копию, если база менялась с прошлой копии
+        
+        Returns:
+            Путь к новой копии или None, если копировать было нечего
+        """
+        mtime = os.path.getmtime(self.db.db_name)
+        if mtime == self._last_backup_mtime:
+            return None
+        
+        os.makedirs(self.backup_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(self.db.db_name))[0]
+        path = os.path.join(self.backup_dir, f"{stem}-{datetime.now():%Y%m%d-%H%M%S}.db")
+        tmp_path = f"{path}.tmp"
+        self.db.backup_to(tmp_path)
+        # Недописанная копия никогда не попадает под имя готовой
+        os.replace(tmp_path, path)
+        self._last_backup_mtime = mtime
+        
+        # Имена содержат время, поэтому сортировка по имени - по возрасту
+        backups = sorted(glob.glob(os.path.join(self.backup_dir, f"{stem}-*.db")))
+        for old in backups[:-self.keep_backups]:
+            os.remove(old)
+        logger.info("Резервная копия БД создана", extra={"path": path})
+        return path
+    
+    def archive(self) -> Dict[str, int]:
+        """Перенести прошедшие записи и неактивных пользователей в архив"""
+        today = date.today()
+        appointments = self.db.archive_appointments(
+            (today - timedelta(days=self.appointment_retention_days)).isoformat()
+        )
+        welcome_log = self.db.archive_welcome_log(
+            (today - timedelta(days=self.welcome_retention_days)).isoformat()
+        )
+        return {"appointments": appointments, "welcome_log": welcome_log}
+    
+    def compact(self) -> int:
+        """Освободить до `vacuum_pages` страниц, если инкрементальное сжатие включено"""
+        if not self.db.is_incremental_vacuum_enabled():
+            if not self._vacuum_warned:
+                self._vacuum_warned = True
+                logger.warning("Инкрементальное сжатие выключено: остановите бота и запустите "
+                               "python maintenance.py --enable-incremental-vacuum",
+                               extra={"db": self.db.db_name})
+            return 0
+        return self.db.incremental_vacuum(self.vacuum_pages)
+    
+    def run_maintenance(self) -> Dict[str, int]:
+        """Архивирование и сжатие за один проход"""
+        result = self.archive()
+        result["freed_pages"] = self.compact()
+        logger.info("Обслуживание БД выполнено", extra=result)
+        return result
+    
+    def start(self):
+        """Запустить обслуживание в фоновом потоке"""
+        self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Остановить фоновый поток"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _run(self):
+        next_backup = time.monotonic()
+        next_maintenance = time.monotonic() + self.maintenance_interval
+        while True:
+            now = time.monotonic()
+            if now >= next_backup:
+                next_backup = now + self.backup_interval
+                try:
+                    self.backup()
+                except Exception:
+                    logger.exception("Ошибка резервного копирования БД")
+            if now >= next_maintenance:
+                next_maintenance = now + self.maintenance_interval
+                try:
+                    self.run_maintenance()
+                except Exception:
+                    logger.exception("Ошибка обслуживания БД")
+            if self._stop_event.wait(max(0.0, min(next_backup, next_maintenance) - time.monotonic())):
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резервная копия, архивирование и сжатие БД")
+    add_script_arguments(parser)
+    # Без флагов - значения секции maintenance настроек
+    parser.add_argument("--backup-dir", default=None, help="каталог резервных копий")
+    parser.add_argument("--keep", type=int, default=None, help="сколько копий хранить")
+    parser.add_argument("--appointments-days", type=int, default=None,
+                        help="записи старше стольких дней переносятся в архив")
+    parser.add_argument("--welcome-days", type=int, default=None,
+                        help="пользователи, неактивные столько дней, переносятся в архив")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="включить инкрементальное сжатие полным VACUUM (только при остановленном боте)")
+    parser.add_argument("--normalize-contacts", action="store_true",
+                        help="разово привести телефоны и адреса старых записей к единому виду")
+    args = parser.parse_args()
+    config = load_script_config(parser, args)
+    db = Database(config.database.path, busy_timeout=config.database.busy_timeout)
+    
+    if args.normalize_contacts:
+        print(f"Изменено записей: {db.normalize_appointment_contacts()}")
+        return
+    
+    if args.enable_incremental_vacuum:
+        print("Выполнен VACUUM, сжатие включено" if db.enable_incremental_vacuum()
+              else "Инкрементальное сжатие уже включено")
+        return
+    
+    overrides = {
+        "backup_dir": args.backup_dir, "keep_backups": args.keep,
+        "appointment_retention_days": args.appointments_days, "welcome_retention_days": args.welcome_days,
+    }
+    settings = config.override("maintenance", **{key: value for key, value in overrides.items()
+                                                 if value is not None}).maintenance
+    task = MaintenanceTask.from_config(db, settings)
+    path = task.backup()
+    print(f"Резервная копия: {path or 'не нужна, база не менялась'}")
+    print(task.run_maintenance())
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,16 @@
 """
 Модели данных для бота записи на замер окон
+
+Модели объявлены со `__slots__` (без `__dict__` у каждого экземпляра), а
+порядок полей совпадает с порядком колонок в таблицах: строки из SQLite
+превращаются в модели позиционно, без промежуточных словарей.
 """
 from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class Client:
     """Модель клиента"""
     user_id: int
@@ -17,7 +21,7 @@ class Client:
     created_at: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class Appointment:
     """Модель записи на встречу"""
     id: Optional[int]
@@ -30,7 +34,7 @@ class Appointment:
     created_at: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class KnowledgeBase:
     """Модель базы знаний"""
     id: Optional[int]
@@ -0,0 +1,104 @@
+"""
+Нормализация телефонов и адресов
+
+Телефон приводится к E.164 (+79991234567), адрес - к каноническому ключу,
+в котором не важны регистр, знаки препинания и написание типовых слов
+("улица Ленина, дом 5" и "ул. ленина д5" дают один ключ). По хешу этого
+ключа в таблице `appointments` есть индекс, через который повторная запись
+на тот же адрес находится одним обращением к индексу.
+"""
+import hashlib
+import re
+from typing import Optional
+
+
+# Российские номера без кода страны: 8XXXXXXXXXX, 7XXXXXXXXXX или 9XXXXXXXXX
+_DEFAULT_COUNTRY_CODE = "7"
+
+# Местный номер без кода города: цифры, пробелы, скобки и дефисы
+_LOCAL_PHONE = re.compile(r"^[\d\s\+\-\(\)]{7,15}$")
+
+# Слова, которые не отличают один адрес от другого: тип улицы, "дом", "город"
+_ADDRESS_NOISE = frozenset({
+    "г", "город",
+    "ул", "улица",
+    "пр", "пр-т", "просп", "проспект",
+    "пер", "переулок",
+    "ш", "шоссе",
+    "б-р", "бул", "бульвар",
+    "пл", "площадь",
+    "наб", "набережная",
+    "пр-д", "проезд",
+    "д", "дом",
+})
+
+# Разные написания значимых частей адреса
+_ADDRESS_SYNONYMS = {
+    "корпус": "к", "корп": "к",
+    "строение": "стр",
+    "квартира": "кв",
+    "офис": "оф",
+}
+
+
+def normalize_phone(text: str) -> Optional[str]:
+    """
+    Привести телефон к формату E.164
+    
+    Returns:
+        Номер вида +79991234567 или None, если это не похоже на телефон
+    """
+    digits = re.sub(r"\D", "", text)
+    if text.strip().startswith("+"):
+        return f"+{digits}" if 8 <= len(digits) <= 15 else None
+    if len(digits) == 11 and digits[0] in "78":
+        return f"+{_DEFAULT_COUNTRY_CODE}{digits[1:]}"
+    if len(digits) == 10 and digits[0] == "9":
+        return f"+{_DEFAULT_COUNTRY_CODE}{digits}"
+    return None
+
+
+def is_valid_phone(text: str) -> bool:
+    """
+    Похоже ли это на телефон
+    
+    Кроме номеров, которые приводятся к E.164, принимаются и местные номера
+    без кода города (от 7 цифр), как принимал бот до нормализации.
+    """
+    if normalize_phone(text) is not None:
+        return True
+    return bool(_LOCAL_PHONE.match(text.strip())) and len(re.sub(r"\D", "", text)) >= 7
+
+
+def clean_phone(text: str) -> str:
+    """Телефон для хранения: E.164, а местный номер - как ввел пользователь"""
+    return normalize_phone(text) or " ".join(text.split())
+
+
+def clean_address(text: str) -> str:
+    """Адрес для хранения: как ввел пользователь, но без лишних пробелов"""
+    return " ".join(text.split())
+
+
+def address_key(text: str) -> str:
+    """Канонический ключ адреса для поиска повторов"""
+    text = text.lower().replace("ё", "е")
+    # Сокращения с дефисом и косая черта в номере дома значимы, остальная пунктуация - нет
+    text = re.sub(r"[^\w\s/-]", " ", text)
+    # "5 - а", "5-а", "5 а" -> "5а" (но не "5 к 3" - это корпус)
+    text = re.sub(r"(\d)\s*-?\s*([а-я])\b(?!\s*\d)", r"\1\2", text)
+    # "д5", "кв12", "12к3" -> "д 5", "кв 12", "12 к 3"
+    text = re.sub(r"(\d)([а-я]+)(?=\d)", r"\1 \2 ", text)
+    text = re.sub(r"\b([а-я]+)(\d)", r"\1 \2", text)
+    tokens = []
+    for token in text.split():
+        token = token.strip("-")
+        if not token or token in _ADDRESS_NOISE:
+            continue
+        tokens.append(_ADDRESS_SYNONYMS.get(token, token))
+    return " ".join(tokens)
+
+
+def address_hash(text: str) -> str:
+    """Короткий хеш канонического ключа адреса (для индекса в БД)"""
+    return hashlib.sha1(address_key(text).encode("utf-8")).hexdigest()[:16]
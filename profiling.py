@@ -0,0 +1,213 @@
+"""
+Выборочное профилирование обработки апдейтов
+
+`SamplingProfiler` профилирует каждый N-й апдейт: время - через cProfile,
+память - через tracemalloc. Для вызовов `Database`, которые `AsyncDatabase`
+выполняет в пуле потоков (бот ставит ей обертку `call_profiled`, только
+если профилирование включено), всегда записывается время, а до Python 3.12 они
+еще и профилируются в своем потоке и попадают в тот же отчет. С 3.12 cProfile
+работает через общий на интерпретатор `sys.monitoring`, и второй профилировщик
+в потоке БД запустить нельзя. Результаты накапливаются и выгружаются по
+запросу: командой /profile (для администраторов) или сигналом SIGUSR1.
+
+Профиль снимается со всего потока цикла событий, поэтому в него попадает и
+работа других апдейтов, выполнявшихся одновременно с выбранным. cProfile и
+tracemalloc общие на процесс, поэтому в каждый момент профилируется только
+один апдейт - даже если в процессе несколько ботов (tenants.py).
+
+При выключенном профилировании модуль не импортируется, middleware не
+регистрируется, а вызовы БД идут без обертки.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+logger = logging.getLogger(__name__)
+
+
+# Профилировать вызовы БД отдельным cProfile в их потоке (до Python 3.12)
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+# Один профилируемый апдейт на процесс: cProfile и tracemalloc общие
+_sampling = threading.Lock()
+
+
+class _Sample:
+    """Вызовы БД одного выбранного апдейта из потоков пула"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread_profiles: List[cProfile.Profile] = []
+        self.db_calls = 0
+        self.db_time = 0.0
+
+
+# Выбранный для профилирования апдейт (видно и в потоках AsyncDatabase)
+current_sample: ContextVar[Optional[_Sample]] = ContextVar("current_sample", default=None)
+
+
+def call_profiled(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Вызвать функцию, профилируя ее, если текущий апдейт выбран для профилирования"""
+    sample = current_sample.get()
+    if sample is None:
+        return func(*args, **kwargs)
+    profile = cProfile.Profile() if PER_THREAD_PROFILES else None
+    started = time.perf_counter()
+    try:
+        if profile is None:
+            return func(*args, **kwargs)
+        return profile.runcall(func, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        with sample.lock:
+            sample.db_calls += 1
+            sample.db_time += elapsed
+            if profile is not None:
+                sample.thread_profiles.append(profile)
+
+
+class SamplingProfiler(BaseMiddleware):
+    """Outer-middleware, профилирующий каждый `sample_every`-й апдейт"""
+    
+    def __init__(self, sample_every: int = 100, trace_memory: bool = True, memory_frames: int = 1,
+                 output_dir: str = "profiles"):
+        self.sample_every = sample_every
+        self.trace_memory = trace_memory
+        self.memory_frames = memory_frames
+        self.output_dir = output_dir
+        self._counter = 0
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Сбросить накопленные результаты"""
+        with self._lock:
+            self._stats: Optional[pstats.Stats] = None
+            # Строка кода -> [байты, число блоков], суммарно по выборкам
+            self._memory: Dict[str, List[int]] = {}
+            self._samples = 0
+            self._total_time = 0.0
+            self._max_time = 0.0
+            self._db_calls = 0
+            self._db_time = 0.0
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self._counter += 1
+        # Пока профилируется другой апдейт (в том числе другим ботом процесса), выборку пропускаем
+        if self._counter % self.sample_every or not _sampling.acquire(blocking=False):
+            return await handler(event, data)
+        
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Профилировщик уже запущен кем-то еще (отладчик, coverage)
+                logger.warning("cProfile занят другим инструментом, апдейт не профилируется")
+                return await handler(event, data)
+            
+            sample = _Sample()
+            token = current_sample.set(sample)
+            started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(self.memory_frames)
+            started = time.perf_counter()
+            try:
+                return await handler(event, data)
+            finally:
+                profile.disable()
+                elapsed = time.perf_counter() - started
+                snapshot = None
+                if started_tracing:
+                    snapshot = tracemalloc.take_snapshot()
+                    tracemalloc.stop()
+                current_sample.reset(token)
+                self._collect(profile, sample, snapshot, elapsed)
+        finally:
+            _sampling.release()
+    
+    def _collect(self, profile: cProfile.Profile, sample: _Sample,
+                 snapshot: Optional[tracemalloc.Snapshot], elapsed: float):
+        memory: List[Tuple[str, int, int]] = []
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            memory = [(str(stat.traceback[0]), stat.size, stat.count)
+                      for stat in snapshot.statistics("lineno")[:50]]
+        
+        with self._lock:
+            for source in [profile] + sample.thread_profiles:
+                if self._stats is None:
+                    self._stats = pstats.Stats(source)
+                else:
+                    self._stats.add(source)
+            for line, size, count in memory:
+                totals = self._memory.setdefault(line, [0, 0])
+                totals[0] += size
+                totals[1] += count
+            self._samples += 1
+            self._db_calls += sample.db_calls
+            self._db_time += sample.db_time
+            self._total_time += elapsed
+            self._max_time = max(self._max_time, elapsed)
+    
+    def report(self, limit: int = 25) -> str:
+        """Текстовый отчет: сводка, самые дорогие функции и строки, выделившие больше всего памяти"""
+        with self._lock:
+            if self._stats is None:
+                return "Профиль пуст: еще ни один апдейт не попал в выборку."
+            lines = [
+                f"Апдейтов в выборке: {self._samples} (каждый {self.sample_every}-й), "
+                f"среднее время {self._total_time / self._samples * 1000:.1f} мс, "
+                f"максимум {self._max_time * 1000:.1f} мс",
+                f"Вызовов БД в выборке: {self._db_calls}, "
+                f"в среднем {self._db_time / self._samples * 1000:.1f} мс на апдейт",
+                "",
+            ]
+            out = io.StringIO()
+            self._stats.stream = out
+            self._stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+            lines.append(out.getvalue().strip())
+            if self._memory:
+                lines += ["", f"Память (оставшиеся после апдейта выделения, сумма по {self._samples} выборкам):"]
+                top = sorted(self._memory.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+                lines += [f"{size / 1024:10.1f} KiB {count:8d} блоков  {line}" for line, (size, count) in top]
+        return "\n".join(lines)
+    
+    def dump(self) -> Optional[str]:
+        """
+        Сохранить отчет в `output_dir`: текст (.txt) и сырые данные cProfile (.pstats)
+        
+        Returns:
+            Путь к текстовому отчету или None, если профиль пуст
+        """
+        if self._stats is None:
+            return None
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"profile-{datetime.now():%Y%m%d-%H%M%S}")
+        report = self.report(limit=60)
+        with self._lock:
+            self._stats.dump_stats(f"{base}.pstats")
+        with open(f"{base}.txt", "w", encoding="utf-8") as f:
+            f.write(report)
+        logger.info("Профиль сохранен", extra={"path": f"{base}.txt", "samples": self._samples})
+        return f"{base}.txt"
@@ -0,0 +1,262 @@
+"""
+Запись и воспроизведение апдейтов Telegram
+
+`UpdateRecorder` сохраняет входящие апдейты в JSONL (по строке на апдейт,
+с временем получения). `replay.py` прогоняет такой файл через диспетчер
+`WindowBot` с поддельным Bot API: в исходном темпе, ускоренно или без
+пауз. Как и при polling, каждый апдейт обрабатывается отдельной задачей,
+не дожидаясь предыдущих, поэтому воспроизводится и одновременная нагрузка.
+Ответы бота можно сравнить с эталоном, а по итогам печатается задержка
+обработки апдейтов (p50/p95/p99).
+
+Формат строки записи:
+    {"ts": 1734712345.12, "update": {...апдейт Telegram...}}
+Строка может быть и просто объектом апдейта - тогда паузы не соблюдаются.
+
+Запуск:
+    python replay.py recorded_updates.jsonl --speed 10 --golden golden.jsonl
+    python replay.py recorded_updates.jsonl --write-golden golden.jsonl
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage, TelegramMethod
+from aiogram.types import Chat, Message, TelegramObject, Update
+
+
+# Вызовы Bot API апдейта, который обрабатывается в текущей задаче
+_update_calls: contextvars.ContextVar[Optional[List[TelegramMethod]]] = contextvars.ContextVar(
+    "replay_update_calls", default=None
+)
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Outer-middleware, дописывающий каждый входящий апдейт в JSONL-файл"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, Update):
+            line = json.dumps({
+                "ts": time.time(),
+                "update": event.model_dump(mode="json", by_alias=True, exclude_none=True),
+            }, ensure_ascii=False)
+            with self._lock:
+                self._file.write(line + "\n")
+        return await handler(event, data)
+    
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class FakeBotSession(BaseSession):
+    """
+    Сессия Bot API, которая ничего не отправляет, а запоминает вызовы
+    
+    Все вызовы копятся в `calls`; внутри `replay` они еще и разносятся по
+    апдейтам, которые обрабатываются одновременно.
+    """
+    
+    def __init__(self):
+        super().__init__()
+        self.calls: List[TelegramMethod] = []
+        self._message_id = 0
+    
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls.append(method)
+        update_calls = _update_calls.get()
+        if update_calls is not None:
+            update_calls.append(method)
+        if isinstance(method, SendMessage):
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id, type="private"),
+                text=method.text,
+            )
+        return True
+    
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        yield b""
+    
+    async def close(self):
+        pass
+
+
+def load_updates(path: str) -> Iterator[Tuple[Optional[float], Update]]:
+    """Прочитать записанные апдейты: пары (время получения, апдейт)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if "update" in record:
+                yield record.get("ts"), Update.model_validate(record["update"])
+            else:
+                yield None, Update.model_validate(record)
+
+
+def _reply_texts(calls: List[TelegramMethod]) -> List[str]:
+    return [call.text for call in calls if isinstance(call, SendMessage)]
+
+
+async def replay(window_bot, records: Iterator[Tuple[Optional[float], Update]],
+                 speed: float = 0.0) -> Tuple[Dict[int, List[str]], List[float]]:
+    """
+    Прогнать апдейты через диспетчер бота
+    
+    Каждый апдейт запускается отдельной задачей в момент, когда он пришел
+    в записи; задержка считается от запуска задачи до конца обработки.
+    
+    Args:
+        window_bot: WindowBot, у которого `bot` использует FakeBotSession
+        records: Апдейты из `load_updates`
+        speed: 1 - исходный темп, 10 - в 10 раз быстрее, 0 - без пауз
+    
+    Returns:
+        Ответы бота по update_id и задержки обработки каждого апдейта (сек)
+    """
+    replies: Dict[int, List[str]] = {}
+    latencies: List[float] = []
+    
+    async def process(update: Update):
+        calls: List[TelegramMethod] = []
+        _update_calls.set(calls)
+        begin = time.perf_counter()
+        await window_bot.dp.feed_update(window_bot.bot, update)
+        latencies.append(time.perf_counter() - begin)
+        replies[update.update_id] = _reply_texts(calls)
+    
+    tasks = []
+    first_ts = None
+    started = time.monotonic()
+    for ts, update in records:
+        if speed > 0 and ts is not None:
+            if first_ts is None:
+                first_ts = ts
+            delay = (ts - first_ts) / speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        
+        # Ответы - в порядке поступления апдейтов, а не завершения их обработки
+        replies[update.update_id] = []
+        tasks.append(asyncio.create_task(process(update)))
+    
+    await asyncio.gather(*tasks)
+    return replies, latencies
+
+
+def compare_with_golden(replies: Dict[int, List[str]], golden_path: str) -> List[int]:
+    """update_id апдейтов, ответы на которые отличаются от эталона"""
+    mismatches = []
+    with open(golden_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            expected = json.loads(line)
+            if replies.get(expected["update_id"]) != expected["replies"]:
+                mismatches.append(expected["update_id"])
+    return mismatches
+
+
+def write_golden(replies: Dict[int, List[str]], golden_path: str):
+    """Сохранить текущие ответы бота как эталон"""
+    with open(golden_path, "w", encoding="utf-8") as f:
+        for update_id, texts in replies.items():
+            f.write(json.dumps({"update_id": update_id, "replies": texts}, ensure_ascii=False) + "\n")
+
+
+def latency_report(latencies: List[float]) -> Dict[str, float]:
+    """Сводка задержек в миллисекундах"""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+    
+    def percentile(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 3)
+    
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+async def run_replay(path: str, db_path: str, speed: float = 0.0, golden: Optional[str] = None,
+                     write_golden_path: Optional[str] = None, throttle: bool = False) -> int:
+    from bot import WindowBot
+    from database import Database
+    
+    window_bot = WindowBot("42:REPLAY", db=Database(db_path))
+    # Прогон намеренно повторяет апдейты, которые эта БД могла уже видеть, и не должен
+    # затереть сохраненное состояние рабочего бота
+    window_bot.dedup.detach()
+    window_bot.bot = Bot("42:REPLAY", session=FakeBotSession())
+    if not throttle:
+        # Ускоренный прогон иначе упирается в антиспам, которого не было в исходном трафике
+        window_bot.throttling.rate_limit = float("inf")
+        window_bot.throttling.duplicate_window = 0
+    
+    try:
+        replies, latencies = await replay(window_bot, load_updates(path), speed)
+    finally:
+        await window_bot.stop()
+    
+    print(json.dumps(latency_report(latencies), ensure_ascii=False))
+    
+    if write_golden_path:
+        write_golden(replies, write_golden_path)
+        print(f"Эталон сохранен: {write_golden_path}")
+    if golden:
+        mismatches = compare_with_golden(replies, golden)
+        if mismatches:
+            print(f"Ответы отличаются от эталона для update_id: {mismatches}")
+            return 1
+        print("Ответы совпадают с эталоном")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение записанных апдейтов Telegram")
+    parser.add_argument("updates", help="JSONL-файл с записанными апдейтами")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="1 - исходный темп, N - в N раз быстрее, 0 - без пауз")
+    parser.add_argument("--golden", default=None, help="сравнить ответы с эталоном")
+    parser.add_argument("--write-golden", default=None, help="сохранить ответы как эталон")
+    parser.add_argument("--db", default=None, help="БД для прогона (по умолчанию чистая временная)")
+    parser.add_argument("--throttle", action="store_true", help="включить антиспам (имеет смысл при --speed 1)")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = args.db or os.path.join(tmp_dir, "replay.db")
+        code = asyncio.run(run_replay(args.updates, db_path, args.speed, args.golden,
+                                      args.write_golden, throttle=args.throttle))
+    raise SystemExit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Маршруты замерщиков и подсказка свободного времени
+
+Адреса записей переводятся в координаты по локальному справочнику адресов
+(CSV `address,lat,lon`, без обращений к сети). Справочник загружается в
+память один раз; поиск идет по тому же каноническому ключу адреса, что и
+поиск повторных записей (`normalization.address_key`), а если дома нет в
+справочнике - по центру улицы.
+
+Записи дня группируются в маршруты:
+1. адреса ближе `cluster_radius_km` друг к другу (через цепочку соседей)
+   попадают в одну группу; соседи ищутся по сетке с ячейкой в радиус, так
+   что каждый адрес сравнивается только с адресами соседних ячеек;
+2. группа больше `max_stops` адресов режется на части по порядку объезда;
+3. пока маршрутов больше, чем замерщиков, ближайшие маршруты сливаются;
+4. порядок объезда - ближайший сосед от самой ранней записи, затем 2-opt.
+
+Расстояния - по прямой на плоскости (для города этого достаточно). Порядок
+объезда не учитывает выбранное клиентами время: это предложение менеджеру,
+который согласует с клиентами время визита.
+
+Запуск:
+    python routes.py --gazetteer gazetteer.csv --day 25.12.2024
+"""
+import argparse
+import csv
+import json
+import math
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from config import add_script_arguments, load_script_config
+from database import Database
+from models import Appointment
+from normalization import address_key
+
+
+@dataclass(slots=True)
+class Stop:
+    """Адрес записи на карте"""
+    appointment: Appointment
+    lat: float
+    lon: float
+    precision: str
+    x: float = 0.0
+    y: float = 0.0
+
+
+@dataclass
+class Route:
+    """Маршрут одного замерщика: адреса в порядке объезда"""
+    stops: List[Stop]
+    length_km: float = 0.0
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "length_km": round(self.length_km, 2),
+            "stops": [
+                {
+                    "id": stop.appointment.id,
+                    "time": stop.appointment.time,
+                    "address": stop.appointment.address,
+                    "lat": stop.lat,
+                    "lon": stop.lon,
+                    "precision": stop.precision,
+                }
+                for stop in self.stops
+            ],
+        }
+
+
+@dataclass
+class RoutePlan:
+    """Маршруты на день и записи, адрес которых не найден в справочнике"""
+    day: str
+    routes: List[Route]
+    unlocated: List[Appointment]
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "day": self.day,
+            "routes": [route.as_dict() for route in self.routes],
+            "unlocated": [
+                {"id": appt.id, "time": appt.time, "address": appt.address}
+                for appt in self.unlocated
+            ],
+        }
+    
+    def report(self) -> str:
+        """Текстовый план для менеджера"""
+        lines = [f"Маршруты на {self.day}: {len(self.routes)}"]
+        for number, route in enumerate(self.routes, 1):
+            lines.append(f"\nМаршрут {number}: {len(route.stops)} адр., {route.length_km:.1f} км")
+            for position, stop in enumerate(route.stops, 1):
+                mark = "" if stop.precision == "house" else " (по улице)"
+                lines.append(f"  {position}. {stop.appointment.time} {stop.appointment.address}{mark}")
+        if self.unlocated:
+            lines.append(f"\nНет в справочнике адресов ({len(self.unlocated)}):")
+            lines += [f"  {appt.time} {appt.address}" for appt in self.unlocated]
+        return "\n".join(lines)
+
+
+def _street_key(key: str) -> str:
+    """Ключ улицы: часть ключа адреса до номера дома ("8 марта 5 к 2" -> "8 марта")"""
+    tokens = key.split()
+    named = False
+    for index, token in enumerate(tokens):
+        has_digit = any(char.isdigit() for char in token)
+        if has_digit and named:
+            return " ".join(tokens[:index])
+        named = named or not has_digit
+    return " ".join(tokens) if named else ""
+
+
+class Gazetteer:
+    """Локальный справочник координат адресов"""
+    
+    def __init__(self, entries: Iterable[Tuple[str, float, float]] = ()):
+        self._houses: Dict[str, Tuple[float, float]] = {}
+        # Ключ улицы -> [сумма широт, сумма долгот, число адресов] для центра улицы
+        streets: Dict[str, List[float]] = {}
+        for address, lat, lon in entries:
+            key = address_key(address)
+            self._houses[key] = (lat, lon)
+            totals = streets.setdefault(_street_key(key), [0.0, 0.0, 0])
+            totals[0] += lat
+            totals[1] += lon
+            totals[2] += 1
+        self._streets = {
+            street: (lat_sum / count, lon_sum / count)
+            for street, (lat_sum, lon_sum, count) in streets.items() if street
+        }
+    
+    @classmethod
+    def from_file(cls, path: str) -> "Gazetteer":
+        """
+        Загрузить справочник из CSV с колонками address, lat, lon
+        
+        Raises:
+            ValueError: если в файле нет нужных колонок или координаты не числа
+        """
+        entries = []
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.DictReader(f)
+            missing = {"address", "lat", "lon"} - set(reader.fieldnames or ())
+            if missing:
+                raise ValueError(f"{path}: нет колонок {', '.join(sorted(missing))}")
+            for line, row in enumerate(reader, 2):
+                try:
+                    entries.append((row["address"], float(row["lat"]), float(row["lon"])))
+                except (TypeError, ValueError):
+                    raise ValueError(f"{path}:{line}: координаты должны быть числами")
+        return cls(entries)
+    
+    def __len__(self) -> int:
+        return len(self._houses)
+    
+    def locate(self, address: str) -> Optional[Tuple[float, float, str]]:
+        """
+        Координаты адреса
+        
+        Returns:
+            (широта, долгота, точность) - точность "house" или "street";
+            None, если ни дома, ни улицы нет в справочнике
+        """
+        key = address_key(address)
+        point = self._houses.get(key)
+        if point is not None:
+            return point[0], point[1], "house"
+        point = self._streets.get(_street_key(key))
+        if point is not None:
+            return point[0], point[1], "street"
+        return None
+
+
+class GridIndex:
+    """Сетка с квадратными ячейками для поиска соседей в радиусе"""
+    
+    def __init__(self, cell_km: float):
+        self.cell_km = cell_km
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+    
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return math.floor(x / self.cell_km), math.floor(y / self.cell_km)
+    
+    def add(self, index: int, x: float, y: float):
+        self._cells.setdefault(self._cell(x, y), []).append(index)
+    
+    def candidates(self, x: float, y: float) -> Iterable[int]:
+        """Точки соседних ячеек: среди них все точки не дальше `cell_km`"""
+        cx, cy = self._cell(x, y)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                yield from self._cells.get((cx + dx, cy + dy), ())
+
+
+def _distance(a: Stop, b: Stop) -> float:
+    return math.hypot(a.x - b.x, a.y - b.y)
+
+
+def _path_length(stops: Sequence[Stop]) -> float:
+    return sum(_distance(a, b) for a, b in zip(stops, stops[1:]))
+
+
+def _project(stops: List[Stop]):
+    """Перевести широту и долготу в километры на плоскости вокруг центра точек"""
+    lat0 = math.radians(sum(stop.lat for stop in stops) / len(stops))
+    for stop in stops:
+        stop.x = stop.lon * 111.32 * math.cos(lat0)
+        stop.y = stop.lat * 110.57
+
+
+def _clusters(stops: List[Stop], radius_km: float) -> List[List[Stop]]:
+    """Группы адресов, связанных цепочками соседей ближе `radius_km`"""
+    grid = GridIndex(radius_km)
+    for index, stop in enumerate(stops):
+        grid.add(index, stop.x, stop.y)
+    
+    cluster_of = [-1] * len(stops)
+    clusters: List[List[Stop]] = []
+    for start in range(len(stops)):
+        if cluster_of[start] != -1:
+            continue
+        cluster_of[start] = len(clusters)
+        members = [start]
+        queue = [start]
+        while queue:
+            current = stops[queue.pop()]
+            for neighbor in grid.candidates(current.x, current.y):
+                if cluster_of[neighbor] == -1 and _distance(current, stops[neighbor]) <= radius_km:
+                    cluster_of[neighbor] = len(clusters)
+                    members.append(neighbor)
+                    queue.append(neighbor)
+        clusters.append([stops[index] for index in members])
+    return clusters
+
+
+def order_stops(stops: List[Stop], max_passes: int = 20) -> List[Stop]:
+    """
+    Порядок объезда: ближайший сосед от самой ранней записи, затем улучшение 2-opt
+    
+    Маршрут незамкнутый: замерщик не возвращается к первому адресу.
+    """
+    if len(stops) < 3:
+        return sorted(stops, key=lambda stop: stop.appointment.time)
+    remaining = sorted(stops, key=lambda stop: stop.appointment.time)
+    path = [remaining.pop(0)]
+    while remaining:
+        nearest = min(range(len(remaining)), key=lambda i: _distance(path[-1], remaining[i]))
+        path.append(remaining.pop(nearest))
+    
+    # 2-opt: разворот участка path[i..j], если это сокращает путь; первый адрес не двигается
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, len(path) - 1):
+            for j in range(i + 1, len(path)):
+                before = _distance(path[i - 1], path[i])
+                after = _distance(path[i - 1], path[j])
+                if j + 1 < len(path):
+                    before += _distance(path[j], path[j + 1])
+                    after += _distance(path[i], path[j + 1])
+                if after < before - 1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+        if not improved:
+            break
+    return path
+
+
+def _centroid(stops: Sequence[Stop]) -> Tuple[float, float]:
+    return sum(stop.x for stop in stops) / len(stops), sum(stop.y for stop in stops) / len(stops)
+
+
+def _merge_routes(groups: List[List[Stop]], surveyors: int, max_stops: int) -> List[List[Stop]]:
+    """Сливать ближайшие группы, пока их больше, чем замерщиков, и слияние не превышает max_stops"""
+    groups = [list(group) for group in groups]
+    while len(groups) > surveyors:
+        best = None
+        centroids = [_centroid(group) for group in groups]
+        for i in range(len(groups)):
+            for j in range(i + 1, len(groups)):
+                if len(groups[i]) + len(groups[j]) > max_stops:
+                    continue
+                distance = math.dist(centroids[i], centroids[j])
+                if best is None or distance < best[0]:
+                    best = (distance, i, j)
+        if best is None:
+            break
+        _, i, j = best
+        groups[i] += groups.pop(j)
+    return groups
+
+
+def plan_routes(appointments: Iterable[Appointment], gazetteer: Gazetteer, surveyors: int = 3,
+                max_stops: int = 8, cluster_radius_km: float = 3.0, day: str = "") -> RoutePlan:
+    """
+    Сгруппировать записи дня в маршруты замерщиков
+    
+    Args:
+        appointments: Записи на один день
+        surveyors: Число замерщиков (маршрутов может получиться больше,
+            если записей больше, чем `surveyors * max_stops`)
+        max_stops: Максимум адресов в одном маршруте
+        cluster_radius_km: Адреса ближе этого расстояния стараемся объединять в маршрут
+    
+    Raises:
+        ValueError: если `surveyors` или `max_stops` меньше 1
+    """
+    if surveyors < 1 or max_stops < 1:
+        raise ValueError("число замерщиков и адресов в маршруте должно быть не меньше 1")
+    stops: List[Stop] = []
+    unlocated: List[Appointment] = []
+    for appointment in appointments:
+        point = gazetteer.locate(appointment.address)
+        if point is None:
+            unlocated.append(appointment)
+        else:
+            stops.append(Stop(appointment, *point))
+    if not stops:
+        return RoutePlan(day, [], unlocated)
+    
+    _project(stops)
+    groups: List[List[Stop]] = []
+    for cluster in _clusters(stops, cluster_radius_km):
+        if len(cluster) <= max_stops:
+            groups.append(cluster)
+            continue
+        # Соседние по порядку объезда адреса лежат рядом: режем путь на части
+        path = order_stops(cluster)
+        parts = math.ceil(len(path) / max_stops)
+        size = math.ceil(len(path) / parts)
+        groups += [path[start:start + size] for start in range(0, len(path), size)]
+    
+    routes = []
+    for group in _merge_routes(groups, surveyors, max_stops):
+        path = order_stops(group)
+        routes.append(Route(path, _path_length(path)))
+    routes.sort(key=lambda route: route.stops[0].appointment.time)
+    return RoutePlan(day, routes, unlocated)
+
+
+def suggest_slots(loads: Dict[Tuple[str, int], int], day: date, hour: int, capacity: int,
+                  day_start: int = 9, day_end: int = 20, limit: int = 3,
+                  now: Optional[datetime] = None) -> List[Tuple[date, int]]:
+    """
+    Менее загруженные соседние слоты, если выбранный час уже заполнен
+    
+    Соседние слоты - тот же день на 1-2 часа раньше или позже: на шаге
+    выбора времени дату уже не поменять. Часы, которые сегодня уже
+    начались, не предлагаются.
+    
+    Args:
+        loads: Записи по часам `{(ГГГГ-ММ-ДД, час): число}` (см. `Database.get_slot_loads`)
+        capacity: Сколько выездов возможно в один час (число замерщиков)
+        now: Текущее время (по умолчанию `datetime.now()`)
+    
+    Returns:
+        До `limit` слотов (дата, час), сначала самые свободные и близкие;
+        пустой список, если выбранный слот не заполнен
+    """
+    if loads.get((day.isoformat(), hour), 0) < capacity:
+        return []
+    now = now or datetime.now()
+    if day < now.date():
+        return []
+    # Сегодня - только часы, которые еще не начались
+    first_hour = max(day_start, now.hour + 1) if day == now.date() else day_start
+    free = []
+    for order, shift in enumerate((-1, 1, -2, 2)):
+        slot_hour = hour + shift
+        if not first_hour <= slot_hour < day_end:
+            continue
+        load = loads.get((day.isoformat(), slot_hour), 0)
+        if load < capacity:
+            free.append((load, order, slot_hour))
+    return [(day, slot_hour) for _, _, slot_hour in sorted(free)[:limit]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Маршруты замерщиков на день")
+    add_script_arguments(parser)
+    parser.add_argument("--gazetteer", required=True, help="CSV справочника адресов (address,lat,lon)")
+    parser.add_argument("--day", default=date.today().strftime("%d.%m.%Y"), help="день, ДД.ММ.ГГГГ")
+    parser.add_argument("--surveyors", type=int, default=None,
+                        help="число замерщиков (по умолчанию routes.surveyors из настроек)")
+    parser.add_argument("--max-stops", type=int, default=8, help="максимум адресов в маршруте")
+    parser.add_argument("--radius", type=float, default=3.0, help="радиус объединения адресов, км")
+    parser.add_argument("--json", action="store_true", help="вывести план в JSON")
+    args = parser.parse_args()
+    config = load_script_config(parser, args)
+    surveyors = config.routes.surveyors if args.surveyors is None else args.surveyors
+    
+    day_iso = datetime.strptime(args.day, "%d.%m.%Y").date().isoformat()
+    gazetteer = Gazetteer.from_file(args.gazetteer)
+    db = Database(config.database.path, busy_timeout=config.database.busy_timeout)
+    appointments = db.get_appointments_by_date(day_iso)
+    try:
+        plan = plan_routes(appointments, gazetteer, surveyors, args.max_stops, args.radius, day=args.day)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.json:
+        print(json.dumps(plan.as_dict(), ensure_ascii=False, indent=2))
+    else:
+        print(plan.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Замер фаз запуска бота
+
+`StartupTimer` отмечает время каждой фазы запуска (импорты, БД, создание
+бота) и ключевые моменты: начало polling и первый полученный апдейт.
+Модуль намеренно ничего не импортирует из aiogram, чтобы его можно было
+подключить до тяжелых импортов и замерить и их.
+
+Отчет выводится при запуске с флагом:
+    python main.py --profile-startup
+"""
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+
+
+class StartupTimer:
+    """Фазы и отметки времени с момента создания таймера"""
+    
+    def __init__(self):
+        self.origin = time.perf_counter()
+        # (название, начало, длительность) в секундах от origin; у отметок длительность None
+        self.entries: List[Tuple[str, float, Optional[float]]] = []
+    
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Замерить фазу запуска"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.entries.append((name, started - self.origin, time.perf_counter() - started))
+    
+    def mark(self, name: str) -> float:
+        """Отметить момент запуска, вернуть секунды от начала"""
+        elapsed = time.perf_counter() - self.origin
+        self.entries.append((name, elapsed, None))
+        return elapsed
+    
+    def as_dict(self) -> Dict[str, float]:
+        """Длительности фаз и время отметок в миллисекундах (для логов)"""
+        return {
+            name: round((duration if duration is not None else at) * 1000, 1)
+            for name, at, duration in self.entries
+        }
+    
+    def report(self, out: Optional[TextIO] = None):
+        """Напечатать таблицу фаз (по умолчанию в stderr)"""
+        out = out or sys.stderr
+        print(f"{'фаза':<32}{'начало, мс':>12}{'длит., мс':>12}", file=out)
+        for name, at, duration in self.entries:
+            length = f"{duration * 1000:12.1f}" if duration is not None else f"{'':>12}"
+            print(f"{name:<32}{at * 1000:12.1f}{length}", file=out)
+        out.flush()
+    
+    def first_update_hook(self, on_first: Callable[[], Any]) -> Callable[..., Awaitable[Any]]:
+        """
+        Outer-middleware для апдейтов: отмечает первый апдейт и вызывает `on_first`
+        
+        После первого апдейта остается одна проверка флага на апдейт.
+        """
+        seen = False
+        
+        async def middleware(handler: Callable[..., Awaitable[Any]], event: Any, data: Dict[str, Any]) -> Any:
+            nonlocal seen
+            if not seen:
+                seen = True
+                self.mark("первый апдейт")
+                on_first()
+            return await handler(event, data)
+        
+        return middleware
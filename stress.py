@@ -0,0 +1,364 @@
+"""
+Нагрузочная проверка хранилища `Database` при одновременном доступе
+
+Несколько потоков (как пул `AsyncDatabase`) и множество asyncio-задач
+одновременно выполняют случайную смесь операций бота над одной временной
+БД: регистрацию клиентов, запись на замер (в том числе повторную на тот же
+адрес), чтение записей, поиск и пополнение базы знаний, запись событий
+аналитики. Пользователи и адреса берутся из небольших наборов, чтобы
+операции чаще сталкивались на одних и тех же строках. Часть записей идет с
+телефоном, общим для нескольких пользователей (семья, соседи по квартире):
+такие записи на один адрес объединяться не должны.
+
+После прогона проверяются инварианты:
+- ни одна операция не упала и не получила "database is locked";
+- нет двух будущих записей одного пользователя на один адрес;
+- запись объединяется только с записью того же пользователя, даже если
+  телефон и адрес совпали с чужими;
+- ни одна успешная запись не потерялась: каждая пара (пользователь, адрес)
+  есть в таблице ровно один раз, а созданных и объединенных записей вместе
+  столько же, сколько успешных операций записи;
+- все добавленные вопросы есть в базе знаний;
+- в журнале событий и в агрегатах ровно столько событий, сколько записано;
+- у каждого зарегистрированного пользователя есть ровно одна строка клиента
+  и одна строка журнала приветствий.
+
+Отчет показывает пропускную способность и задержки по операциям: рост
+p99 относительно p50 - признак ожидания блокировок.
+
+Смесь операций воспроизводима по `--seed` (порядок их выполнения между потоками - нет).
+
+Запуск:
+    python stress.py --threads 8 --tasks 32 --ops 200 --seed 1
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from concurrency import AsyncDatabase
+from database import Database
+from models import Appointment, Client
+
+
+# Небольшие наборы, чтобы операции сталкивались на одних и тех же строках
+USERS = 40
+ADDRESSES = ["ул. Ленина, д. 5", "Мира 12", "пр-т Победы 3к2", "ул. Садовая, 7", "Гагарина 1"]
+# Телефоны, общие для разных пользователей
+SHARED_PHONES = ["+79990000001", "+79990000002"]
+QUERIES = ["сколько стоит окно", "гарантия", "замер бесплатный?", "какие профили", "сроки изготовления"]
+
+# Вес операции в случайной смеси
+OPERATIONS = {
+    "register": 3,
+    "activity": 3,
+    "book": 3,
+    "read": 4,
+    "kb_search": 4,
+    "kb_add": 1,
+    "events": 2,
+}
+
+
+class ErrorLog(logging.Handler):
+    """Ошибки, которые методы `Database` записывают в лог вместо исключения"""
+    
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages: List[str] = []
+        self._lock = threading.Lock()
+    
+    def emit(self, record: logging.LogRecord):
+        with self._lock:
+            self.messages.append(record.getMessage())
+
+
+class StressRun:
+    """Общее состояние прогона: что было записано и сколько заняли операции"""
+    
+    def __init__(self, db: Database, seed: int):
+        self.db = db
+        self.seed = seed
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures: List[str] = []
+        self.registered: Set[int] = set()
+        self.active: Set[int] = set()
+        self.booked: Set[Tuple[int, str]] = set()
+        self.bookings_ok = 0
+        self.bookings_merged = 0
+        self.foreign_merges = 0
+        self.kb_added: Set[str] = set()
+        self.events = 0
+        self._counter = 0
+    
+    def next_id(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+    
+    def record(self, name: str, elapsed: float, error: Optional[str] = None):
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            if error is not None:
+                self.failures.append(f"{name}: {error}")
+    
+    def operation(self, rng: random.Random) -> Tuple[str, Callable[[Database], Any], Callable[[Any], None]]:
+        """
+        Случайная операция
+        
+        Returns:
+            (название, вызов над БД, обработка результата)
+        """
+        name = rng.choices(list(OPERATIONS), weights=list(OPERATIONS.values()))[0]
+        user_id = rng.randrange(1, USERS + 1)
+        
+        if name == "register":
+            client = Client(user_id=user_id, username=f"user{user_id}", first_name="Тест")
+            
+            def call(db: Database):
+                # Как /start: регистрация и проверки приветствия без общей транзакции
+                if db.get_client(user_id) is None:
+                    if not db.add_client(client):
+                        raise RuntimeError("add_client вернул False")
+                db.is_new_user(user_id)
+                db.should_send_welcome_again(user_id)
+                db.mark_welcome_sent(user_id, is_new=True)
+            
+            return name, call, lambda _: self._add(self.registered, user_id)
+        
+        if name == "activity":
+            return name, lambda db: db.update_user_activity(user_id), lambda _: self._add(self.active, user_id)
+        
+        if name == "book":
+            address = rng.choice(ADDRESSES)
+            day = date.today() + timedelta(days=rng.randrange(1, 8))
+            phone = rng.choice(SHARED_PHONES) if rng.random() < 0.5 else f"+7999{user_id:07d}"
+            appointment = Appointment(
+                id=None, user_id=user_id, date=day.strftime("%d.%m.%Y"),
+                time=f"{rng.randrange(9, 20):02d}:00", address=address,
+                phone=phone, notes=rng.choice([None, "позвонить заранее"]),
+            )
+            
+            def done(result: Tuple[bool, Optional[Appointment]]):
+                saved, merged = result
+                if not saved:
+                    raise RuntimeError("add_or_merge_appointment вернул False")
+                with self._lock:
+                    self.bookings_ok += 1
+                    self.bookings_merged += merged is not None
+                    self.foreign_merges += merged is not None and merged.user_id != user_id
+                    self.booked.add((user_id, address))
+            
+            return name, lambda db: db.add_or_merge_appointment(appointment), done
+        
+        if name == "read":
+            def call(db: Database):
+                db.get_user_appointments(user_id)
+                today = date.today()
+                db.get_slot_loads(today.isoformat(), (today + timedelta(days=7)).isoformat())
+            
+            return name, call, lambda _: None
+        
+        if name == "kb_search":
+            query = rng.choice(QUERIES)
+            return name, lambda db: db.search_knowledge_base(query), lambda _: None
+        
+        if name == "kb_add":
+            question = f"стресс-вопрос {self.seed}-{self.next_id()}"
+            
+            def done(saved: bool):
+                if not saved:
+                    raise RuntimeError("add_to_knowledge_base вернул False")
+                self._add(self.kb_added, question.lower())
+            
+            return name, lambda db: db.add_to_knowledge_base(question, "ответ"), done
+        
+        count = rng.randrange(1, 20)
+        now = datetime.now().isoformat(timespec="seconds")
+        events = [(now, user_id, rng.choice(["kb_hit", "kb_miss", "step_completed"]), "") for _ in range(count)]
+        
+        def done(_):
+            with self._lock:
+                self.events += count
+        
+        return name, lambda db: db.record_events(events), done
+    
+    def _add(self, target: set, value: Any):
+        with self._lock:
+            target.add(value)
+    
+    def run_sync(self, rng: random.Random, ops: int):
+        """Поток: операции напрямую над `Database`"""
+        for _ in range(ops):
+            name, call, done = self.operation(rng)
+            started = time.perf_counter()
+            try:
+                done(call(self.db))
+                self.record(name, time.perf_counter() - started)
+            except Exception as e:
+                self.record(name, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+    
+    async def run_async(self, adb: AsyncDatabase, rng: random.Random, ops: int):
+        """Задача: операции через пул потоков `AsyncDatabase`, как в боте"""
+        for _ in range(ops):
+            name, call, done = self.operation(rng)
+            started = time.perf_counter()
+            try:
+                done(await adb.run(call))
+                self.record(name, time.perf_counter() - started)
+            except Exception as e:
+                self.record(name, time.perf_counter() - started, f"{type(e).__name__}: {e}")
+    
+    def check(self, errors: ErrorLog) -> List[str]:
+        """Проверить инварианты; вернуть описания нарушений"""
+        problems = list(self.failures)
+        problems += [f"ошибка в логе Database: {message}" for message in errors.messages]
+        locked = sum("locked" in problem for problem in problems)
+        if locked:
+            problems.insert(0, f"'database is locked': {locked} раз")
+        
+        conn = sqlite3.connect(self.db.db_name)
+        try:
+            today = date.today().isoformat()
+            duplicates = conn.execute("""
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM appointments WHERE date_iso >= ?
+                    GROUP BY user_id, address_hash HAVING COUNT(*) > 1
+                )
+            """, (today,)).fetchone()[0]
+            if duplicates:
+                problems.append(f"повторные записи на один адрес: {duplicates}")
+            if self.foreign_merges:
+                problems.append(f"записи объединены с записями других пользователей: {self.foreign_merges}")
+            
+            rows = conn.execute("SELECT COUNT(*) FROM appointments").fetchone()[0]
+            if rows != len(self.booked):
+                problems.append(f"записей в таблице {rows}, а разных пар (пользователь, адрес) {len(self.booked)}")
+            if rows + self.bookings_merged != self.bookings_ok:
+                problems.append(
+                    f"потеряны записи: создано {rows} и объединено {self.bookings_merged}, "
+                    f"а успешных операций {self.bookings_ok}"
+                )
+            
+            questions = {row[0] for row in conn.execute(
+                "SELECT question FROM knowledge_base WHERE question LIKE 'стресс-вопрос %'"
+            )}
+            if questions != self.kb_added:
+                problems.append(f"в базе знаний {len(questions)} добавленных вопросов из {len(self.kb_added)}")
+            
+            logged = conn.execute("SELECT COUNT(*) FROM bot_events").fetchone()[0]
+            rolled = conn.execute(
+                "SELECT COALESCE(SUM(count), 0) FROM analytics_rollup WHERE period = 'day'"
+            ).fetchone()[0]
+            if logged != self.events or rolled != self.events:
+                problems.append(f"событий записано {self.events}, в журнале {logged}, в агрегатах {rolled}")
+            
+            clients = {row[0] for row in conn.execute("SELECT user_id FROM clients")}
+            if clients != self.registered:
+                problems.append(f"клиентов {len(clients)}, зарегистрировано {len(self.registered)}")
+            welcomed = {row[0] for row in conn.execute("SELECT user_id FROM user_welcome_log")}
+            if welcomed != self.registered | self.active:
+                problems.append(
+                    f"строк журнала приветствий {len(welcomed)}, ожидалось {len(self.registered | self.active)}"
+                )
+        finally:
+            conn.close()
+        return problems
+    
+    def report(self, elapsed: float) -> str:
+        """Пропускная способность и задержки по операциям"""
+        lines = [f"{'операция':<12}{'кол-во':>8}{'оп/с':>10}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}"]
+        total = 0
+        for name in OPERATIONS:
+            values = sorted(self.latencies.get(name, []))
+            if not values:
+                continue
+            total += len(values)
+            
+            def percentile(p: float) -> float:
+                return values[min(len(values) - 1, int(p * len(values)))] * 1000
+            
+            lines.append(
+                f"{name:<12}{len(values):>8}{len(values) / elapsed:>10.0f}"
+                f"{percentile(0.50):>10.2f}{percentile(0.99):>10.2f}{values[-1] * 1000:>10.2f}"
+            )
+        lines.append(f"Всего {total} операций за {elapsed:.2f} с ({total / elapsed:.0f} оп/с)")
+        lines.append(
+            f"Записей на замер: {self.bookings_ok} успешных операций, из них объединено {self.bookings_merged}"
+        )
+        return "\n".join(lines)
+
+
+async def run_stress(db_path: str, threads: int = 8, tasks: int = 32, ops: int = 200, workers: int = 8,
+                     seed: int = 1, busy_timeout: float = 5.0) -> Tuple[StressRun, float]:
+    """Выполнить прогон: `threads` потоков и `tasks` задач по `ops` операций"""
+    db = Database(db_path, busy_timeout=busy_timeout)
+    run = StressRun(db, seed)
+    adb = AsyncDatabase(db, max_workers=workers)
+    master = random.Random(seed)
+    loop = asyncio.get_running_loop()
+    
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *(loop.run_in_executor(None, run.run_sync, random.Random(master.random()), ops)
+              for _ in range(threads)),
+            *(run.run_async(adb, random.Random(master.random()), ops) for _ in range(tasks)),
+        )
+    finally:
+        adb.close()
+    return run, time.perf_counter() - started
+
+
+def stress_test(db_path: str, threads: int = 8, tasks: int = 32, ops: int = 200, workers: int = 8,
+                seed: int = 1, busy_timeout: float = 5.0) -> Tuple[StressRun, float, List[str]]:
+    """Выполнить прогон на пустой БД и проверить инварианты; вернуть прогон, время и нарушения"""
+    errors = ErrorLog()
+    logger = logging.getLogger("database")
+    logger.addHandler(errors)
+    try:
+        run, elapsed = asyncio.run(run_stress(db_path, threads, tasks, ops, workers, seed, busy_timeout))
+        return run, elapsed, run.check(errors)
+    finally:
+        logger.removeHandler(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочная проверка Database при одновременном доступе")
+    parser.add_argument("--threads", type=int, default=8, help="потоков с прямыми вызовами Database")
+    parser.add_argument("--tasks", type=int, default=32, help="asyncio-задач через AsyncDatabase")
+    parser.add_argument("--ops", type=int, default=200, help="операций на поток или задачу")
+    parser.add_argument("--workers", type=int, default=8, help="размер пула потоков AsyncDatabase")
+    parser.add_argument("--busy-timeout", type=float, default=5.0, help="ожидание блокировки SQLite, сек")
+    parser.add_argument("--seed", type=int, default=1, help="зерно случайной смеси операций")
+    parser.add_argument("--db", default=None, help="файл БД (по умолчанию временный)")
+    args = parser.parse_args()
+    
+    if args.db and os.path.exists(args.db):
+        parser.error("--db: инварианты проверяются на пустой БД, укажите новый файл")
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = args.db or os.path.join(tmp_dir, "stress.db")
+        run, elapsed, problems = stress_test(db_path, args.threads, args.tasks, args.ops, args.workers,
+                                             args.seed, args.busy_timeout)
+        print(run.report(elapsed))
+    
+    if problems:
+        print(f"\nНарушены инварианты (seed={args.seed}):")
+        for problem in problems[:50]:
+            print(f"  - {problem}")
+        sys.exit(1)
+    print("\nИнварианты соблюдены")
+
+
+if __name__ == "__main__":
+    main()
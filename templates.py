@@ -0,0 +1,216 @@
+"""
+Готовые тексты и клавиатуры бота
+
+Клавиатуры и длинные тексты (приветствие, справка, FAQ) создаются один раз
+при запуске и дальше переиспользуются во всех ответах без копирования.
+Объект клавиатуры общий для всех ответов, поэтому хендлеры его не меняют:
+нужна другая клавиатура - зарегистрируйте ее отдельно.
+
+Тексты можно переопределять для отдельных языков (`language_code` из
+Telegram); если перевода нет, используется русский вариант.
+
+У каждого бренда (tenants.py) может быть свое оформление - секция
+`branding` настроек: название компании подставляется в тексты при сборке
+реестра, а JSON-файл `templates_file` заменяет отдельные тексты:
+
+    {"welcome_body": "...", "help": {"ru": "...", "en": "..."}}
+
+Боты без собственного оформления используют общий реестр `TEMPLATES`.
+"""
+import json
+from typing import Any, Dict, Optional, Tuple, Union
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+
+DEFAULT_LOCALE = "ru"
+DEFAULT_COMPANY = "Народные Окна"
+
+Markup = Union[ReplyKeyboardMarkup, ReplyKeyboardRemove]
+
+
+class TemplateRegistry:
+    """Реестр текстов и клавиатур с вариантами по языкам"""
+    
+    def __init__(self, default_locale: str = DEFAULT_LOCALE):
+        self.default_locale = default_locale
+        self._texts: Dict[Tuple[str, str], str] = {}
+        self._markups: Dict[Tuple[str, str], Markup] = {}
+    
+    def add_text(self, name: str, text: str, locale: Optional[str] = None):
+        """Зарегистрировать текст"""
+        self._texts[(name, locale or self.default_locale)] = text
+    
+    def add_markup(self, name: str, markup: Markup, locale: Optional[str] = None):
+        """Зарегистрировать клавиатуру"""
+        self._markups[(name, locale or self.default_locale)] = markup
+    
+    def text(self, name: str, locale: Optional[str] = None) -> str:
+        """Получить текст для языка пользователя"""
+        if locale:
+            text = self._texts.get((name, locale))
+            if text is not None:
+                return text
+        return self._texts[(name, self.default_locale)]
+    
+    def render(self, template_name: str, locale: Optional[str] = None, **values: Any) -> str:
+        """Получить текст с подставленными значениями"""
+        return self.text(template_name, locale).format(**values)
+    
+    def markup(self, name: str, locale: Optional[str] = None) -> Markup:
+        """Получить общую клавиатуру для языка пользователя (не изменять)"""
+        if locale:
+            markup = self._markups.get((name, locale))
+            if markup is not None:
+                return markup
+        return self._markups[(name, self.default_locale)]
+    
+    def load_overrides(self, path: str):
+        """
+        Заменить тексты текстами из JSON-файла бренда
+        
+        Raises:
+            ValueError: если файл не в формате "имя -> текст" или "имя -> {язык: текст}"
+                или в нем есть незарегистрированный текст
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: ожидается JSON-объект \"имя -> текст\"")
+        known = {name for name, _ in self._texts}
+        for name, value in data.items():
+            if name not in known:
+                raise ValueError(f"{path}: неизвестный текст {name}")
+            variants = value if isinstance(value, dict) else {self.default_locale: value}
+            for locale, text in variants.items():
+                if not isinstance(text, str):
+                    raise ValueError(f"{path}: {name}: ожидается строка")
+                self.add_text(name, text, locale)
+
+
+def build_default_registry(company: str = DEFAULT_COMPANY) -> TemplateRegistry:
+    """Собрать реестр со всеми текстами и клавиатурами бота"""
+    registry = TemplateRegistry()
+    
+    registry.add_markup("main", ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text="Записаться на замер")],
+            [KeyboardButton(text="Мои записи"), KeyboardButton(text="Консультация")]
+        ],
+        resize_keyboard=True
+    ))
+    registry.add_markup("remove", ReplyKeyboardRemove())
+    
+    # Приветствие: меняется только первая строка, остальное собрано заранее
+    registry.add_text("greeting_returning", "С возвращением, {name}! 👋")
+    registry.add_text("greeting_new", "Привет, {name}! 👋\nРады видеть вас впервые!")
+    registry.add_text("greeting_default", "Добро пожаловать, {name}! 👋")
+    registry.add_text("welcome_body", (
+        f"Я ваш умный помощник от компании {company}!\n\n"
+        "Я помогу вам:\n"
+        "🪟 Подобрать пластиковые окна и профили\n"
+        "📅 Записаться на бесплатный замер\n"
+        "💬 Ответить на вопросы по монтажу и ценам\n"
+        "📍 Выбрать оптимальное решение для вашего помещения\n\n"
+        "Вы можете спросить меня:\n"
+        "• Какие окна лучше для квартиры?\n"
+        "• Сколько стоит установка?\n"
+        "• Как записаться на замер?\n\n"
+        "Напишите ваш вопрос или выберите команду:\n"
+        "/help - справка по командам\n"
+        "/book - запись на замер\n"
+        "/my_appointments - мои записи\n\n"
+        "Готовы подобрать идеальные окна? ☀️"
+    ))
+    
+    registry.add_text("help", (
+        "📋 Доступные команды:\n\n"
+        "/start - Начать работу с ботом\n"
+        "/book - Записаться на замер\n"
+        "/my_appointments - Показать мои записи\n"
+        "/faq - Часто задаваемые вопросы\n"
+        "/ask - Задать вопрос\n"
+        "/cancel - Отменить текущую операцию\n\n"
+        "Также вы можете просто написать вопрос, и я постараюсь на него ответить!"
+    ))
+    
+    registry.add_text("faq", (
+        "📋 Часто задаваемые вопросы:\n\n"
+        "💰 **О стоимости:**\n"
+        "• Цена зависит от размера, профиля и стеклопакета\n"
+        "• Минимальная цена от 5000 рублей\n"
+        "• Точную стоимость рассчитает замерщик бесплатно\n\n"
+        "📅 **О замере:**\n"
+        "• Замер производится бесплатно\n"
+        "• Используйте /book для записи\n"
+        "• Специалист приедет в удобное время\n\n"
+        "⏱️ **О сроках:**\n"
+        "• Изготовление: 5-7 рабочих дней\n"
+        "• Установка: 1-2 дня после изготовления\n\n"
+        "🛡️ **О гарантии:**\n"
+        "• Гарантия на окна до 5 лет\n"
+        "• Гарантия на установку\n\n"
+        "🪟 **О выборе окон:**\n"
+        "• Работаем с профилями Rehau, KBE, Veka\n"
+        "• Подберем оптимальный вариант при замере\n\n"
+        "💬 Для сложных вопросов (сравнение, отличия) рекомендую записаться на бесплатный замер - наш специалист даст детальную консультацию!"
+    ))
+    
+    registry.add_text("complex_question", (
+        "Этот вопрос сложный, я не могу ответить.\n\n"
+        "Это можно узнать:\n"
+        "• 📋 В разделе /faq с часто задаваемыми вопросами\n"
+        "• 📅 Записавшись на бесплатный замер (/book) - наш специалист даст детальную консультацию и ответит на все вопросы\n"
+        "• 💬 Задав более простой вопрос, на который я смогу ответить"
+    ))
+    
+    registry.add_text("no_answer", (
+        "Извините, я не нашел точный ответ на ваш вопрос в базе знаний.\n\n"
+        "Попробуйте:\n"
+        "• Переформулировать вопрос более просто\n"
+        "• Посмотреть /faq с часто задаваемыми вопросами\n"
+        "• Записаться на бесплатный замер (/book) - наш специалист ответит на все вопросы\n"
+        "• Задать другой вопрос"
+    ))
+    
+    registry.add_text("ask", "💬 Задайте ваш вопрос о пластиковых окнах, и я постараюсь помочь!")
+    registry.add_text("no_appointments", "📋 У вас пока нет записей. Используйте /book для создания новой записи.")
+    registry.add_text("nothing_to_cancel", "Нет активных операций для отмены.")
+    registry.add_text("cancelled", "❌ Операция отменена.")
+    registry.add_text("booking_cancelled_for_question", "ℹ️ Запись отменена. Отвечаю на ваш вопрос:")
+    registry.add_text("kb_reloaded", "✅ База знаний обновлена: {count} вопросов (версия {version}).")
+    registry.add_text("kb_reload_failed", "❌ База знаний не обновлена, работает прежняя версия.\n{error}")
+    registry.add_text("profile_disabled", "Профилирование выключено (запустите бота с --profile-every N).")
+    registry.add_text("profile_empty", "Профиль пуст: еще ни один апдейт не попал в выборку.")
+    registry.add_text("profile_reset", "Накопленный профиль сброшен.")
+    registry.add_text("profile_saved", "📊 Профиль сохранен: {path}\n\n{summary}")
+    registry.add_text(
+        "slot_crowded",
+        "⚠️ На {time} {date} уже записано много клиентов, замерщик может задержаться.\n"
+        "Свободнее: {slots}.\n\n"
+        "Отправьте другое время или «да», чтобы оставить {time}. "
+        "Чтобы выбрать другой день, начните запись заново: /book",
+    )
+    registry.add_text("throttled", "⏳ Слишком много сообщений. Пожалуйста, подождите {wait} сек.")
+    registry.add_text("booking_failed", "❌ Произошла ошибка при сохранении записи. Попробуйте еще раз.")
+    
+    return registry
+
+
+# Реестр собирается один раз при импорте модуля
+TEMPLATES = build_default_registry()
+
+
+def brand_registry(company: str = DEFAULT_COMPANY, templates_file: Optional[str] = None) -> TemplateRegistry:
+    """
+    Реестр бренда: общий `TEMPLATES`, если у бренда нет своего оформления,
+    иначе отдельный реестр, собранный один раз при создании бота
+    
+    Raises:
+        OSError, ValueError: если файл текстов бренда не читается или неверен
+    """
+    if company == DEFAULT_COMPANY and templates_file is None:
+        return TEMPLATES
+    registry = build_default_registry(company)
+    if templates_file:
+        registry.load_overrides(templates_file)
+    return registry
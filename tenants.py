@@ -0,0 +1,245 @@
+"""
+Многобрендовый режим: несколько ботов в одном процессе
+
+Каждый бренд (франшиза) - отдельный `WindowBot` со своим токеном, базой
+знаний и своей базой записей, но все боты процесса делят:
+
+- пул потоков для запросов к SQLite (квота бренда - `database.workers`);
+- лимит одновременно обрабатываемых апдейтов (квота - `concurrency.max_updates`);
+- HTTP-сессию и пул соединений к Telegram (не больше `shared.requests_per_bot`
+  одновременных запросов одного бота, не считая long polling);
+- логирование и цикл событий.
+
+Тексты бота у бренда свои, если задана секция `branding` (название компании
+и файл с собственными текстами, см. templates.py); бренды без нее делят
+общий реестр шаблонов.
+
+Настройки брендов - JSON-объект "бренд -> секции настроек". Секции бренда
+накладываются на общие настройки (config.json и переменные окружения):
+
+    {
+        "sever": {"bot": {"admin_ids": [1]}, "knowledge": {"file": "kb/sever.json"},
+                  "branding": {"company": "Северные Окна", "templates_file": "kb/sever_texts.json"}},
+        "yug": {"database": {"workers": 2}, "throttling": {"rate_limit": 3}}
+    }
+
+Данные бренда по умолчанию лежат в `tenants/<бренд>/`: токен (`token.txt`),
+база записей (`appointments.db` и архив к ней), резервные копии и профили.
+У каждого бренда свой файл БД: записи и клиенты разных брендов не смешиваются,
+а блокировка записи в одной базе не задерживает остальные.
+
+Запуск:
+    python tenants.py tenants.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import signal
+from contextlib import suppress
+from typing import Any, Dict, List, Mapping, Optional
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import GetUpdates, TelegramMethod
+from bot import WindowBot
+from bot_logging import setup_logging
+from concurrency import SharedResources
+from config import Config, ConfigError, SharedConfig, load_config, merge_config, read_token
+from database import Database
+from maintenance import MaintenanceTask
+
+
+logger = logging.getLogger(__name__)
+
+TENANTS_DIR = "tenants"
+_NAME_RE = re.compile(r"^[\w-]+$")
+
+
+class QuotaSession(AiohttpSession):
+    """Общая HTTP-сессия ботов: один пул соединений, не больше `requests_per_bot` запросов одного бота"""
+    
+    def __init__(self, requests_per_bot: int = 10, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.requests_per_bot = requests_per_bot
+        self._quotas: Dict[int, asyncio.Semaphore] = {}
+    
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        # Long polling висит на соединении до минуты и в квоту не входит
+        if isinstance(method, GetUpdates):
+            return await super().make_request(bot, method, timeout)
+        quota = self._quotas.get(bot.id)
+        if quota is None:
+            quota = self._quotas[bot.id] = asyncio.Semaphore(self.requests_per_bot)
+        async with quota:
+            return await super().make_request(bot, method, timeout)
+
+
+def tenant_config(base: Config, name: str, data: Mapping[str, Any]) -> Config:
+    """
+    Настройки бренда: общие настройки, пути в `tenants/<name>/` и секции бренда
+    
+    Raises:
+        ConfigError: если в секциях бренда есть ошибки
+    """
+    root = os.path.join(TENANTS_DIR, name)
+    config = base.override("bot", name=name, token="", token_file=os.path.join(root, "token.txt"))
+    config = config.override("database", path=os.path.join(root, "appointments.db"))
+    config = config.override("maintenance", backup_dir=os.path.join(root, "backups"))
+    config = config.override("profiling", output_dir=os.path.join(root, "profiles"))
+    if "shared" in data:
+        raise ConfigError(f"{name}.shared: общие ресурсы задаются только в общих настройках")
+    return merge_config(config, data, prefix=f"{name}.")
+
+
+def load_tenants(path: str, base: Config) -> Dict[str, Config]:
+    """
+    Прочитать и проверить настройки всех брендов
+    
+    Raises:
+        ConfigError: со всеми найденными ошибками
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        raise ConfigError(f"Не удалось прочитать {path}: {e}")
+    if not isinstance(data, dict) or not data:
+        raise ConfigError(f"{path}: ожидается JSON-объект \"бренд -> настройки\" хотя бы с одним брендом")
+    
+    errors: List[str] = []
+    configs: Dict[str, Config] = {}
+    for name, sections in data.items():
+        if not _NAME_RE.match(name):
+            errors.append(f"{name}: имя бренда - латиница, цифры, '_' и '-'")
+        elif not isinstance(sections, dict):
+            errors.append(f"{name}: ожидается объект")
+        else:
+            try:
+                configs[name] = tenant_config(base, name, sections)
+            except ConfigError as e:
+                errors.extend(e.errors)
+    
+    # Два бренда на одной базе или с одним токеном смешали бы записи и апдейты
+    for field, values in (
+        ("database.path", [os.path.abspath(c.database.path) for c in configs.values()]),
+        ("bot.token_file", [c.bot.token_file for c in configs.values() if not c.bot.token]),
+        ("bot.token", [c.bot.token for c in configs.values() if c.bot.token]),
+    ):
+        if len(set(values)) != len(values):
+            errors.append(f"{field}: у каждого бренда должно быть свое значение")
+    if errors:
+        raise ConfigError("Ошибки в настройках брендов:\n" + "\n".join(f"  - {error}" for error in errors),
+                          errors)
+    return configs
+
+
+class TenantRuntime:
+    """Боты всех брендов на общих ресурсах процесса"""
+    
+    def __init__(self, configs: Mapping[str, Config], shared: SharedConfig = SharedConfig()):
+        self.configs = dict(configs)
+        self.resources = SharedResources(
+            QuotaSession(shared.requests_per_bot, limit=shared.http_connections),
+            db_workers=shared.db_workers, max_updates=shared.max_updates,
+        )
+        self.bots: Dict[str, WindowBot] = {}
+        self.maintenance: List[MaintenanceTask] = []
+        self._stop_task: Optional[asyncio.Task] = None
+    
+    def build(self):
+        """
+        Создать боты брендов
+        
+        Raises:
+            ConfigError: если у бренда нет токена
+        """
+        for name, config in self.configs.items():
+            token = read_token(config.bot)
+            os.makedirs(os.path.dirname(config.database.path) or ".", exist_ok=True)
+            db = Database(config.database.path, seed_knowledge_base=False,
+                          busy_timeout=config.database.busy_timeout)
+            bot = WindowBot(token, db=db, config=config, defer_warm_up=True, shared=self.resources)
+            if config.maintenance.enabled:
+                bot.dp.startup.register(self._maintenance_starter(bot))
+            self.bots[name] = bot
+        logger.info("Боты брендов созданы", extra={"tenants": list(self.bots)})
+    
+    def _maintenance_starter(self, bot: WindowBot):
+        async def start_maintenance():
+            task = MaintenanceTask.from_config(bot.db, bot.config.maintenance)
+            task.start()
+            self.maintenance.append(task)
+        
+        return start_maintenance
+    
+    async def run(self):
+        """Polling всех ботов до сигнала остановки; сбой одного бренда не останавливает остальные"""
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, self.request_stop)
+        if hasattr(signal, "SIGUSR1"):
+            loop.add_signal_handler(signal.SIGUSR1, self.dump_profiles)
+        await asyncio.gather(*(self._run_bot(name, bot) for name, bot in self.bots.items()))
+    
+    async def _run_bot(self, name: str, bot: WindowBot):
+        try:
+            await bot.start(handle_signals=False)
+        except Exception:
+            logger.exception("Бот бренда остановился с ошибкой", extra={"tenant": name})
+    
+    def request_stop(self):
+        """Остановить polling всех ботов (обработчик SIGINT/SIGTERM)"""
+        if self._stop_task is None:
+            self._stop_task = asyncio.create_task(self._stop_polling())
+    
+    async def _stop_polling(self):
+        for bot in self.bots.values():
+            # RuntimeError - polling этого бота уже не идет
+            with suppress(RuntimeError):
+                await bot.dp.stop_polling()
+    
+    def dump_profiles(self):
+        """Сохранить профили всех брендов, где включено профилирование (SIGUSR1)"""
+        for bot in self.bots.values():
+            if bot.profiler is not None:
+                bot.profiler.dump()
+    
+    async def stop(self):
+        """Сбросить буферы ботов, остановить обслуживание и закрыть общие ресурсы"""
+        for bot in self.bots.values():
+            await bot.stop()
+        for task in self.maintenance:
+            task.stop()
+        await self.resources.close()
+
+
+async def main(base: Config, configs: Mapping[str, Config]):
+    """Запуск всех брендов"""
+    log_listener = setup_logging(getattr(logging, base.logging.level.upper()),
+                                 debug_sample_rate=base.logging.debug_sample_rate)
+    runtime = TenantRuntime(configs, base.shared)
+    try:
+        runtime.build()
+        await runtime.run()
+    except ConfigError as e:
+        logger.error(str(e))
+    finally:
+        await runtime.stop()
+        log_listener.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Боты нескольких брендов в одном процессе")
+    parser.add_argument("tenants", metavar="TENANTS_JSON", help="JSON с настройками брендов")
+    parser.add_argument("--config", default=None, metavar="PATH",
+                        help="общие настройки (по умолчанию config.json, если он есть)")
+    args = parser.parse_args()
+    try:
+        base_config = load_config(args.config)
+        tenant_configs = load_tenants(args.tenants, base_config)
+    except ConfigError as e:
+        parser.exit(2, f"{e}\n")
+    asyncio.run(main(base_config, tenant_configs))
@@ -0,0 +1,52 @@
+"""Общие фикстуры тестов"""
+import itertools
+from datetime import datetime
+from typing import List
+import pytest
+from aiogram import Bot
+from aiogram.methods import SendMessage
+from aiogram.types import Chat, Message, Update, User
+from database import Database
+from replay import FakeBotSession
+
+
+_update_ids = itertools.count(1)
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: долгие нагрузочные тесты (пропустить: -m 'not slow')")
+
+
+@pytest.fixture
+def db(tmp_path) -> Database:
+    """Пустая БД во временном каталоге (без начальной базы знаний)"""
+    return Database(str(tmp_path / "appointments.db"), seed_knowledge_base=False)
+
+
+def make_update(user_id: int, text: str) -> Update:
+    """Апдейт с текстовым сообщением пользователя"""
+    update_id = next(_update_ids)
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), text=text,
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="Тест"),
+    ))
+
+
+def make_bot(db: Database):
+    """WindowBot с поддельным Bot API и без антиспама"""
+    from bot import WindowBot
+    
+    window_bot = WindowBot("42:TEST", db=db)
+    window_bot.bot = Bot("42:TEST", session=FakeBotSession())
+    window_bot.throttling.rate_limit = float("inf")
+    window_bot.throttling.duplicate_window = 0
+    return window_bot
+
+
+async def send(window_bot, user_id: int, text: str) -> List[str]:
+    """Отправить боту сообщение и вернуть тексты ответов"""
+    session: FakeBotSession = window_bot.bot.session
+    session.calls.clear()
+    await window_bot.dp.feed_update(window_bot.bot, make_update(user_id, text))
+    return [call.text for call in session.calls if isinstance(call, SendMessage)]
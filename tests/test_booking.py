@@ -0,0 +1,96 @@
+import asyncio
+from datetime import date, timedelta
+from aiogram.fsm.storage.base import StorageKey
+from booking import AppointmentStates, BOOKING_STEPS, NEXT_STEP, STEP_BY_STATE
+from models import Appointment
+from tests.conftest import make_bot, send
+
+
+def _day(offset: int = 3) -> str:
+    return (date.today() + timedelta(days=offset)).strftime("%d.%m.%Y")
+
+
+def _key(window_bot, user_id: int) -> StorageKey:
+    return StorageKey(bot_id=window_bot.bot.id, chat_id=user_id, user_id=user_id)
+
+
+def test_step_table_covers_every_state_in_order():
+    assert [step.state for step in BOOKING_STEPS] == list(AppointmentStates.__states__)
+    assert set(STEP_BY_STATE) == {state.state for state in AppointmentStates.__states__}
+    chain, step = [], BOOKING_STEPS[0]
+    while step is not None:
+        chain.append(step.name)
+        step = NEXT_STEP[step.name]
+    assert chain == ["date", "time", "address", "phone", "notes"]
+
+
+def test_step_validators_and_normalizers():
+    steps = {step.name: step for step in BOOKING_STEPS}
+    assert steps["date"].validator("25.12.2030")
+    assert not steps["date"].validator("2030-12-25")
+    assert steps["time"].validator("14:00")
+    assert not steps["time"].validator("25:00")
+    assert steps["phone"].validator("8 (999) 123-45-67")
+    assert not steps["phone"].validator("123")
+    assert steps["phone"].normalizer("8 (999) 123-45-67") == "+79991234567"
+    assert steps["phone"].validator("123-45-67")
+    assert steps["phone"].normalizer("123-45-67") == "123-45-67"
+    assert "нет" in steps["notes"].skip_words
+    assert steps["address"].validator is None
+
+
+def test_booking_walks_the_table_and_saves_the_appointment(db):
+    day = _day()
+    
+    async def scenario():
+        window_bot = make_bot(db)
+        try:
+            await send(window_bot, 1, "/start")
+            replies = [await send(window_bot, 1, text) for text in (
+                "/book", "завтра", day, "14:00", "ул. Ленина, д. 5", "123", "89991234567", "нет",
+            )]
+            return replies, await window_bot.dp.storage.get_state(key=_key(window_bot, 1))
+        finally:
+            await window_bot.stop()
+    
+    replies, state = asyncio.run(scenario())
+    steps = {step.name: step for step in BOOKING_STEPS}
+    assert replies[0] == [steps["date"].prompt]
+    assert replies[1] == [steps["date"].error]
+    assert replies[2] == [steps["time"].prompt]
+    assert replies[3] == [steps["address"].prompt]
+    assert replies[4] == [steps["phone"].prompt]
+    assert replies[5] == [steps["phone"].error]
+    assert replies[6] == [steps["notes"].prompt]
+    assert replies[7][0].startswith("✅ Запись успешно создана!")
+    assert state is None
+    
+    appointment, = db.get_user_appointments(1)
+    assert (appointment.date, appointment.time, appointment.phone, appointment.notes) == (
+        day, "14:00", "+79991234567", None,
+    )
+
+
+def test_crowded_hour_is_flagged_once_and_can_be_kept(db):
+    day = _day()
+    for user_id in (10, 11, 12):
+        db.add_or_merge_appointment(Appointment(
+            id=None, user_id=user_id, date=day, time="14:00", address=f"Мира {user_id}", phone="+79990000000",
+        ))
+    
+    async def scenario():
+        window_bot = make_bot(db)
+        try:
+            await send(window_bot, 1, "/start")
+            for text in ("/book", day):
+                await send(window_bot, 1, text)
+            hint = await send(window_bot, 1, "14:00")
+            kept = await send(window_bot, 1, "да")
+            return hint, kept
+        finally:
+            await window_bot.stop()
+    
+    hint, kept = asyncio.run(scenario())
+    assert len(hint) == 1 and hint[0].startswith("⚠️ На 14:00")
+    assert "13:00" in hint[0] or "15:00" in hint[0]
+    assert kept == [BOOKING_STEPS[2].prompt]
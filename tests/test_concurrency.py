@@ -0,0 +1,81 @@
+import asyncio
+import pytest
+from concurrency import AsyncDatabase, BatchBuffer, EventBuffer
+
+
+def _count_events(db) -> int:
+    conn = db.get_connection()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM bot_events").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_event_buffer_flushes_by_timer(db):
+    async def scenario():
+        adb = AsyncDatabase(db, max_workers=2)
+        events = EventBuffer(adb, batch_size=100, flush_interval=0.05)
+        events.add("kb_hit", 1)
+        # add только кладет событие в память
+        assert _count_events(db) == 0
+        await asyncio.sleep(0.2)
+        assert _count_events(db) == 1
+        await events.stop()
+        adb.close()
+    
+    asyncio.run(scenario())
+
+
+def test_event_buffer_flushes_full_batch_and_rest_on_stop(db):
+    async def scenario():
+        adb = AsyncDatabase(db, max_workers=2)
+        events = EventBuffer(adb, batch_size=3, flush_interval=60)
+        for user_id in range(3):
+            events.add("kb_miss", user_id)
+        await asyncio.sleep(0.1)
+        assert _count_events(db) == 3
+        events.add("kb_miss", 3)
+        await events.stop()
+        assert _count_events(db) == 4
+        adb.close()
+    
+    asyncio.run(scenario())
+
+
+class FailingBuffer(BatchBuffer):
+    """Буфер, запись которого не удается, пока не выставлен `online`"""
+    
+    def __init__(self, **kwargs):
+        super().__init__(adb=None, **kwargs)
+        self.online = False
+        self.written = []
+    
+    def add(self, value: int):
+        self._append((value,))
+    
+    async def _write(self, batch):
+        if self.online:
+            self.written += batch
+        return self.online
+
+
+def test_batch_buffer_requires_write():
+    with pytest.raises(TypeError):
+        BatchBuffer(adb=None)
+
+
+def test_failed_batches_are_retried_with_bounded_backlog(caplog):
+    async def scenario():
+        buffer = FailingBuffer(batch_size=100, flush_interval=60, max_backlog=3)
+        for value in range(5):
+            buffer.add(value)
+        await buffer.flush()
+        assert buffer._buffer == [(2,), (3,), (4,)]
+        assert "отброшено старых строк: 2" in caplog.text
+        
+        buffer.online = True
+        buffer.add(5)
+        await buffer.stop()
+        assert buffer.written == [(2,), (3,), (4,), (5,)]
+    
+    asyncio.run(scenario())
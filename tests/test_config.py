@@ -0,0 +1,113 @@
+import argparse
+import json
+import pytest
+from config import (Config, ConfigError, add_script_arguments, load_config, load_script_config, merge_config,
+                    read_token)
+
+
+def _write(tmp_path, data) -> str:
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return str(path)
+
+
+def test_defaults_without_file_or_env(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert load_config(env={}) == Config()
+
+
+def test_env_overrides_file_and_file_overrides_defaults(tmp_path):
+    path = _write(tmp_path, {
+        "database": {"path": "bot.db", "workers": 4},
+        "throttling": {"rate_limit": 10, "window": 2},
+        "maintenance": {"enabled": False},
+    })
+    config = load_config(path, env={
+        "WINDOWBOT_DATABASE_WORKERS": "16",
+        "WINDOWBOT_BOT_ADMIN_IDS": "1, 2,",
+        "WINDOWBOT_KNOWLEDGE_FILE": "",
+        "WINDOWBOT_MAINTENANCE_ENABLED": "yes",
+    })
+    assert config.database.path == "bot.db"
+    assert config.database.workers == 16
+    assert config.database.busy_timeout == Config().database.busy_timeout
+    assert config.throttling.rate_limit == 10
+    assert config.throttling.window == 2.0 and isinstance(config.throttling.window, float)
+    assert config.bot.admin_ids == (1, 2)
+    assert config.knowledge.file is None
+    assert config.maintenance.enabled is True
+
+
+def test_config_path_from_env(tmp_path):
+    path = _write(tmp_path, {"concurrency": {"max_updates": 7}})
+    assert load_config(env={"WINDOWBOT_CONFIG": path}).concurrency.max_updates == 7
+
+
+def test_all_errors_are_reported_at_once(tmp_path):
+    path = _write(tmp_path, {
+        "database": {"workers": 0, "pool": 3},
+        "throttling": {"rate_limit": "10"},
+        "routes": {"day_start": 20, "day_end": 9},
+        "logging": {"level": "verbose"},
+        "bogus": {},
+        "context": [],
+    })
+    with pytest.raises(ConfigError) as error:
+        load_config(path, env={"WINDOWBOT_THROTTLING_WINDOW": "soon"})
+    assert sorted(error.value.errors) == sorted([
+        "database.pool: неизвестный параметр",
+        "database.workers: должно быть больше 0",
+        "throttling.rate_limit: ожидается целое число",
+        "WINDOWBOT_THROTTLING_WINDOW: could not convert string to float: 'soon'",
+        "routes.day_start: должно быть меньше routes.day_end",
+        "logging.level: ожидается одно из DEBUG, INFO, WARNING, ERROR, CRITICAL",
+        "bogus: неизвестная секция",
+        "context: ожидается объект",
+    ])
+
+
+def test_unreadable_file_is_a_config_error(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text("[1, 2]", encoding="utf-8")
+    with pytest.raises(ConfigError, match="ожидается JSON-объект"):
+        load_config(str(path), env={})
+    with pytest.raises(ConfigError, match="Не удалось прочитать"):
+        load_config(str(tmp_path / "missing.json"), env={})
+
+
+def test_merge_config_layers_tenant_sections_over_shared_settings():
+    base = Config().override("database", workers=12).override("throttling", rate_limit=3)
+    tenant = merge_config(base, {"database": {"path": "tenants/sever/appointments.db"}}, prefix="tenants.sever.")
+    assert tenant.database.path == "tenants/sever/appointments.db"
+    assert tenant.database.workers == 12
+    assert tenant.throttling.rate_limit == 3
+    
+    with pytest.raises(ConfigError) as error:
+        merge_config(base, {"database": {"workers": -1}}, prefix="tenants.yug.")
+    assert error.value.errors == ["tenants.yug.database.workers: должно быть больше 0"]
+
+
+def test_read_token_prefers_config_then_file(tmp_path):
+    token_file = tmp_path / "token.txt"
+    config = Config().override("bot", token_file=str(token_file)).bot
+    with pytest.raises(ConfigError, match="Токен не задан"):
+        read_token(config)
+    token_file.write_text("  42:FILE\n", encoding="utf-8")
+    assert read_token(config) == "42:FILE"
+    assert read_token(Config().override("bot", token="42:ENV", token_file=str(token_file)).bot) == "42:ENV"
+
+
+def test_script_database_path_comes_from_config_unless_given(tmp_path):
+    parser = argparse.ArgumentParser()
+    add_script_arguments(parser)
+    path = _write(tmp_path, {"database": {"path": "/var/lib/windowbot/bot.db"}})
+    
+    config = load_script_config(parser, parser.parse_args(["--config", path]))
+    assert config.database.path == "/var/lib/windowbot/bot.db"
+    config = load_script_config(parser, parser.parse_args(["--config", path, "--db", "copy.db"]))
+    assert config.database.path == "copy.db"
+    
+    bad = _write(tmp_path, {"database": {"workers": 0}})
+    with pytest.raises(SystemExit) as error:
+        load_script_config(parser, parser.parse_args(["--config", bad]))
+    assert error.value.code == 2
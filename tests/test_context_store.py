@@ -0,0 +1,60 @@
+import asyncio
+from concurrency import AsyncDatabase
+from context_store import ContextStore
+
+
+def test_evicted_context_is_spilled_and_loaded_back(db):
+    async def scenario():
+        adb = AsyncDatabase(db, max_workers=2)
+        store = ContextStore(max_bytes=3000, adb=adb)
+        await store.add_topic(1, "сколько стоит окно")
+        await store.add_message(2, "гарантия")
+        await store.add_message(3, "замер")
+        # Лимит - два контекста: самый давний ушел в БД
+        assert len(store) == 2
+        assert db.load_conversation_context(1) is not None
+        assert db.load_conversation_context(2) is None
+        
+        context = await store.get(1)
+        assert context.last_topic == "сколько стоит окно"
+        adb.close()
+    
+    asyncio.run(scenario())
+
+
+def test_flush_saves_contexts_in_memory(db):
+    async def scenario():
+        adb = AsyncDatabase(db, max_workers=2)
+        store = ContextStore(adb=adb)
+        await store.add_topic(7, "гарантия")
+        await store.flush()
+        adb.close()
+    
+    asyncio.run(scenario())
+    assert db.load_conversation_context(7) is not None
+
+
+def test_new_store_finds_saved_context_on_demand(db):
+    db.save_conversation_contexts([(5, '{"messages": ["окна"], "topics": ["гарантия"]}')])
+    
+    async def scenario():
+        adb = AsyncDatabase(db, max_workers=1)
+        try:
+            store = ContextStore(adb=adb)
+            context = await store.get(5)
+            return context.last_topic, context.last_message, store.total_bytes == context.size
+        finally:
+            adb.close()
+    
+    assert asyncio.run(scenario()) == ("гарантия", "окна", True)
+
+
+def test_store_without_db_drops_evicted_contexts():
+    async def scenario():
+        store = ContextStore(max_bytes=3000)
+        for user_id in range(5):
+            await store.add_message(user_id, "вопрос")
+        assert len(store) == 2
+        assert (await store.get(0)).last_topic is None
+    
+    asyncio.run(scenario())
@@ -0,0 +1,54 @@
+import json
+import os
+import sqlite3
+import threading
+import urllib.error
+import urllib.request
+import pytest
+from dashboard import DashboardQueries, SnapshotReplica, create_server
+from models import Client
+from routes import Gazetteer
+
+
+def test_refresh_copies_without_writing_source(db, tmp_path):
+    db.add_client(Client(user_id=1, username="user1", first_name="Тест"))
+    with open(db.db_name, "rb") as f:
+        before = f.read()
+    mtime = os.stat(db.db_name).st_mtime_ns
+    
+    replica = SnapshotReplica(db.db_name, str(tmp_path / "snapshot.db"))
+    replica.refresh()
+    
+    with open(db.db_name, "rb") as f:
+        assert f.read() == before
+    assert os.stat(db.db_name).st_mtime_ns == mtime
+    conn = replica.get_connection()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0] == 1
+    finally:
+        conn.close()
+
+
+def test_refresh_does_not_create_missing_source(tmp_path):
+    source = tmp_path / "missing.db"
+    replica = SnapshotReplica(str(source), str(tmp_path / "snapshot.db"))
+    with pytest.raises(sqlite3.OperationalError):
+        replica.refresh()
+    assert not source.exists()
+
+
+@pytest.mark.parametrize("query", ["surveyors=0", "max_stops=0", "max_stops=-2", "surveyors=x"])
+def test_invalid_route_limits_are_a_bad_request(db, tmp_path, query):
+    replica = SnapshotReplica(db.db_name, str(tmp_path / "snapshot.db"))
+    replica.refresh()
+    gazetteer = Gazetteer([("ул. Ленина, д. 5", 55.754, 37.600)])
+    server = create_server(DashboardQueries(replica, gazetteer), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/routes?day=25.12.2030&{query}")
+        assert error.value.code == 400
+        assert "error" in json.loads(error.value.read())
+    finally:
+        server.shutdown()
+        server.server_close()
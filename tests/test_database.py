@@ -0,0 +1,152 @@
+import sqlite3
+from datetime import date, timedelta
+from database import Database
+from models import Appointment, Client
+
+
+def _booking(user_id: int, address: str, phone: str, day_offset: int = 3, time: str = "14:00",
+             notes=None) -> Appointment:
+    day = (date.today() + timedelta(days=day_offset)).strftime("%d.%m.%Y")
+    return Appointment(id=None, user_id=user_id, date=day, time=time, address=address, phone=phone, notes=notes)
+
+
+def test_repeat_booking_of_same_user_is_merged(db):
+    saved, merged = db.add_or_merge_appointment(_booking(1, "ул. Ленина, д. 5", "89991234567"))
+    assert saved and merged is None
+    
+    saved, merged = db.add_or_merge_appointment(
+        _booking(1, "улица Ленина 5", "+7 999 123 45 67", day_offset=5, time="10:00", notes="домофон 12")
+    )
+    assert saved and merged is not None
+    
+    appointments = db.get_user_appointments(1)
+    assert len(appointments) == 1
+    assert appointments[0].time == "10:00"
+    assert appointments[0].address == "улица Ленина 5"
+    assert appointments[0].phone == "+79991234567"
+    assert appointments[0].notes == "домофон 12"
+
+
+def test_same_phone_and_address_of_another_user_is_not_merged(db):
+    db.add_or_merge_appointment(_booking(1, "ул. Ленина, д. 5", "+79991234567", notes="позвонить заранее"))
+    
+    saved, merged = db.add_or_merge_appointment(
+        _booking(2, "ул. Ленина, д. 5", "89991234567", day_offset=6, time="18:00")
+    )
+    assert saved and merged is None
+    
+    first, = db.get_user_appointments(1)
+    assert first.time == "14:00"
+    assert first.notes == "позвонить заранее"
+    second, = db.get_user_appointments(2)
+    assert second.time == "18:00"
+
+
+def test_booking_on_other_address_is_separate(db):
+    db.add_or_merge_appointment(_booking(1, "ул. Ленина, д. 5", "+79991234567"))
+    db.add_or_merge_appointment(_booking(1, "ул. Ленина, д. 15", "+79991234567"))
+    assert len(db.get_user_appointments(1)) == 2
+
+
+def _old_database(path: str) -> None:
+    """База в схеме до появления date_iso и address_hash, с одной записью"""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE appointments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, date TEXT NOT NULL,
+            time TEXT NOT NULL, address TEXT NOT NULL, phone TEXT NOT NULL, notes TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    day = (date.today() + timedelta(days=3)).strftime("%d.%m.%Y")
+    conn.execute("INSERT INTO appointments (user_id, date, time, address, phone) VALUES (1, ?, '14:00', ?, ?)",
+                 (day, "ул.  Ленина,  д. 5", "8 (999) 123-45-67"))
+    conn.commit()
+    conn.close()
+
+
+def test_migration_fills_address_hash_without_rewriting_contacts(tmp_path, caplog):
+    path = str(tmp_path / "old.db")
+    _old_database(path)
+    
+    with caplog.at_level("INFO", logger="database"):
+        db = Database(path, seed_knowledge_base=False)
+    assert "address_hash" in caplog.text
+    old, = db.get_user_appointments(1)
+    assert (old.address, old.phone) == ("ул.  Ленина,  д. 5", "8 (999) 123-45-67")
+    assert db.find_duplicate_appointment(_booking(1, "улица Ленина 5", "+79991234567")).id == old.id
+
+
+def test_contacts_are_normalized_only_on_request(tmp_path):
+    path = str(tmp_path / "old.db")
+    _old_database(path)
+    db = Database(path, seed_knowledge_base=False)
+    
+    assert db.normalize_appointment_contacts() == 1
+    old, = db.get_user_appointments(1)
+    assert (old.address, old.phone) == ("ул. Ленина, д. 5", "+79991234567")
+    assert db.normalize_appointment_contacts() == 0
+
+
+def test_rollups_count_events_by_hour_and_day_and_rebuild_is_idempotent(db):
+    db.record_events([
+        ("2024-12-01T10:05:00", 1, "booking_started", "date"),
+        ("2024-12-01T10:40:00", 2, "booking_started", "date"),
+        ("2024-12-01T11:00:00", 1, "step_completed", "date"),
+    ])
+    db.record_events([
+        ("2024-12-01T10:59:00", 3, "booking_started", "date"),
+        ("2024-12-02T09:00:00", 1, "kb_hit", ""),
+    ])
+    
+    def counts(period):
+        return {(row["bucket"], row["event"], row["step"]): row["count"] for row in db.get_rollup(period)}
+    
+    day = {
+        ("2024-12-01", "booking_started", "date"): 3,
+        ("2024-12-01", "step_completed", "date"): 1,
+        ("2024-12-02", "kb_hit", ""): 1,
+    }
+    hour = {
+        ("2024-12-01T10", "booking_started", "date"): 3,
+        ("2024-12-01T11", "step_completed", "date"): 1,
+        ("2024-12-02T09", "kb_hit", ""): 1,
+    }
+    assert counts("day") == day
+    assert counts("hour") == hour
+    assert [row["bucket"] for row in db.get_rollup("day", since="2024-12-02")] == ["2024-12-02"]
+    
+    for _ in range(2):
+        db.rebuild_rollups()
+        assert counts("day") == day
+        assert counts("hour") == hour
+    
+    # Ручная правка журнала: пересчет берет агрегаты только из него
+    with sqlite3.connect(db.db_name) as conn:
+        conn.execute("DELETE FROM bot_events WHERE event = 'kb_hit'")
+    db.rebuild_rollups()
+    assert ("2024-12-02", "kb_hit", "") not in counts("day")
+
+
+def test_slotted_models_round_trip_through_row_factories(db):
+    client = Client(user_id=7, username="ivan", first_name="Иван", phone="+79991234567", address="ул. Мира, д. 1")
+    assert db.add_client(client)
+    stored = db.get_client(7)
+    assert isinstance(stored, Client) and not hasattr(stored, "__dict__")
+    assert (stored.user_id, stored.username, stored.first_name, stored.phone, stored.address) == (
+        7, "ivan", "Иван", "+79991234567", "ул. Мира, д. 1",
+    )
+    assert stored.created_at is not None
+    
+    booking = _booking(7, "ул. Мира, д. 1", "+79991234567", time="09:30", notes="домофон 4")
+    assert db.add_appointment(booking)
+    appointment, = db.get_user_appointments(7)
+    assert isinstance(appointment, Appointment) and not hasattr(appointment, "__dict__")
+    assert appointment.id is not None and appointment.created_at is not None
+    # Колонки ложатся на поля позиционно: каждое поле получает свое значение
+    assert (appointment.user_id, appointment.date, appointment.time, appointment.address,
+            appointment.phone, appointment.notes) == (
+        7, booking.date, "09:30", "ул. Мира, д. 1", "+79991234567", "домофон 4",
+    )
+    day_iso = date.today() + timedelta(days=3)
+    assert db.get_appointments_by_date(day_iso.isoformat()) == [appointment]
@@ -0,0 +1,97 @@
+import asyncio
+import json
+from concurrency import AsyncDatabase
+from database import Database
+from dedup import STATE_KEY, UpdateDedupMiddleware, UpdateWindow
+from replay import run_replay
+from tests.conftest import make_bot, make_update, send
+
+
+def test_window_marks_repeats_and_slides():
+    window = UpdateWindow(8)
+    assert window.add(100)
+    assert not window.add(100)
+    assert window.add(99)
+    assert window.add(105)
+    assert window.contains(99) and window.contains(100) and not window.contains(101)
+    # Ячейка 100 % 8 переходит к номеру 108: старая отметка не должна его скрыть
+    assert window.add(108)
+    assert not window.contains(100)
+    assert window.marked_above(100) == [105, 108]
+
+
+def test_window_starts_over_when_telegram_resets_ids():
+    window = UpdateWindow(8)
+    for update_id in range(1000, 1010):
+        window.add(update_id)
+    
+    # Номер намного меньше прежних - новая нумерация, а не повтор
+    assert not window.contains(5)
+    assert window.add(5)
+    assert window.top == 5
+    assert not window.add(5)
+    assert window.add(6)
+    assert not window.contains(1009)
+
+
+def test_window_restore_keeps_gaps_above_floor():
+    window = UpdateWindow(16)
+    window.restore(50, [53, 55])
+    assert window.top == 55
+    assert all(window.contains(update_id) for update_id in (40, 50, 53, 55))
+    assert not window.contains(51) and not window.contains(54)
+
+
+def test_repeated_update_is_dropped_and_state_survives_restart(db):
+    async def first_run():
+        window_bot = make_bot(db)
+        try:
+            await send(window_bot, 1, "/start")
+            update = make_update(1, "/help")
+            await window_bot.dp.feed_update(window_bot.bot, update)
+            await window_bot.dp.feed_update(window_bot.bot, update)
+            return update, window_bot.dedup.duplicates
+        finally:
+            await window_bot.stop()
+    
+    update, duplicates = asyncio.run(first_run())
+    assert duplicates == 1
+    assert json.loads(db.get_bot_state(STATE_KEY))["floor"] == update.update_id
+    
+    async def second_run():
+        window_bot = make_bot(db)
+        try:
+            await window_bot.dp.feed_update(window_bot.bot, update)
+            return window_bot.dedup.duplicates, window_bot.bot.session.calls
+        finally:
+            await window_bot.stop()
+    
+    duplicates, calls = asyncio.run(second_run())
+    assert duplicates == 1
+    assert calls == []
+
+
+def test_flush_writes_through_the_executor(db):
+    async def scenario():
+        adb = AsyncDatabase(db, max_workers=1)
+        dedup = UpdateDedupMiddleware(adb)
+        dedup.window.add(7)
+        dedup._dirty = True
+        try:
+            await dedup.flush()
+        finally:
+            adb.close()
+    
+    asyncio.run(scenario())
+    assert json.loads(db.get_bot_state(STATE_KEY)) == {"floor": 7, "done": []}
+
+
+def test_replay_does_not_touch_saved_state(tmp_path):
+    db_path = str(tmp_path / "replay.db")
+    state = json.dumps({"floor": 10 ** 9, "done": []})
+    Database(db_path, seed_knowledge_base=False).set_bot_state(STATE_KEY, state)
+    updates = tmp_path / "updates.jsonl"
+    updates.write_text(make_update(1, "/start").model_dump_json(exclude_none=True) + "\n", encoding="utf-8")
+    
+    assert asyncio.run(run_replay(str(updates), db_path)) == 0
+    assert Database(db_path, seed_knowledge_base=False).get_bot_state(STATE_KEY) == state
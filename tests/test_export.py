@@ -0,0 +1,56 @@
+import csv
+import io
+import json
+import sqlite3
+import pytest
+from export import EXPORT_COLUMNS, export_appointments, open_read_only
+from models import Appointment, Client
+
+
+@pytest.fixture
+def filled_db(db):
+    """БД с двумя клиентами и тремя записями в декабре"""
+    db.add_client(Client(user_id=1, username="ivan", first_name="Иван"))
+    db.add_client(Client(user_id=2, username=None, first_name="Ольга"))
+    for user_id, day, time in ((1, "05.12.2024", "14:00"), (2, "01.12.2024", "10:00"), (1, "20.12.2024", "09:00")):
+        db.add_appointment(Appointment(id=None, user_id=user_id, date=day, time=time,
+                                       address="ул. Ленина, д. 5", phone="+79991234567", notes=None))
+    return db
+
+
+def test_csv_export_streams_all_rows_in_date_order(filled_db):
+    conn = open_read_only(filled_db.db_name)
+    out = io.StringIO()
+    try:
+        assert export_appointments(conn, out, "csv", batch_size=2) == 3
+    finally:
+        conn.close()
+    
+    header, *rows = csv.reader(io.StringIO(out.getvalue()), delimiter=";")
+    assert tuple(header) == EXPORT_COLUMNS
+    assert [(row[1], row[9]) for row in rows] == [
+        ("01.12.2024", "Ольга"), ("05.12.2024", "Иван"), ("20.12.2024", "Иван"),
+    ]
+
+
+def test_jsonl_export_with_date_range(filled_db):
+    conn = open_read_only(filled_db.db_name)
+    out = io.StringIO()
+    try:
+        assert export_appointments(conn, out, "jsonl", date_from="2024-12-02", date_to="2024-12-31") == 2
+    finally:
+        conn.close()
+    
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [line["date"] for line in lines] == ["05.12.2024", "20.12.2024"]
+    assert lines[0]["username"] == "ivan" and lines[0]["user_id"] == 1
+    assert set(lines[0]) == set(EXPORT_COLUMNS)
+
+
+def test_export_connection_cannot_write(filled_db):
+    conn = open_read_only(filled_db.db_name)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM appointments")
+    finally:
+        conn.close()
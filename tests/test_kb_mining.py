@@ -0,0 +1,52 @@
+import asyncio
+from concurrency import AsyncDatabase, MissLogBuffer
+from kb_mining import StreamingClusterer, mine_unanswered, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  Сколько СТОИТ окно?!  ") == "сколько стоит окно"
+
+
+def test_clusterer_groups_near_duplicates():
+    clusterer = StreamingClusterer()
+    for question in ["Сколько стоит окно?", "сколько стоит окно", "Сколько стоит окно!!",
+                     "есть ли рассрочка", "Есть ли рассрочка?"]:
+        clusterer.add(question)
+    
+    top = clusterer.top()
+    assert [cluster.count for cluster in top] == [3, 2]
+    assert top[0].representative == "сколько стоит окно"
+    assert top[1].representative == "есть ли рассрочка"
+
+
+def test_clusterer_keeps_distinct_questions_apart():
+    clusterer = StreamingClusterer()
+    clusterer.add("какая гарантия на окна")
+    clusterer.add("можно ли заказать москитную сетку")
+    assert len(clusterer.clusters) == 2
+
+
+def test_clusterer_limits_examples():
+    clusterer = StreamingClusterer(max_examples=2)
+    for question in ["сколько стоит окно", "сколько стоит окна", "сколько стоит окно?", "сколько стоят окна"]:
+        clusterer.add(question)
+    assert len(clusterer.clusters) == 1
+    assert len(clusterer.clusters[0].examples) == 2
+
+
+def test_miss_buffer_writes_in_background_and_on_stop(db):
+    async def scenario():
+        adb = AsyncDatabase(db, max_workers=2)
+        misses = MissLogBuffer(adb, batch_size=2, flush_interval=60)
+        misses.add(1, "сколько стоит окно")
+        assert list(db.iter_kb_misses()) == []
+        misses.add(2, "Сколько стоит окно?")
+        await asyncio.sleep(0.1)
+        assert len(list(db.iter_kb_misses())) == 2
+        misses.add(3, "есть ли рассрочка")
+        await misses.stop()
+        adb.close()
+    
+    asyncio.run(scenario())
+    clusters = mine_unanswered(db)
+    assert [cluster.count for cluster in clusters] == [2, 1]
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import pytest
+from knowledge import KnowledgeBaseStore, KnowledgeSnapshot
+from templates import TEMPLATES
+from tests.conftest import make_bot, send
+
+
+ENTRIES = [
+    ("сколько стоит", "Цена от 5000 рублей"),
+    ("какие окна для квартиры", "Для квартиры - двухкамерный стеклопакет"),
+    ("гарантия", "Гарантия до 5 лет"),
+]
+
+
+def test_search_prefers_full_match_then_long_words():
+    snapshot = KnowledgeSnapshot(ENTRIES)
+    assert snapshot.search("Гарантия") == "Гарантия до 5 лет"
+    assert snapshot.search("а гарантия какая?") == "Гарантия до 5 лет"
+    assert snapshot.search("окна для квартиры") == "Для квартиры - двухкамерный стеклопакет"
+
+
+def test_stop_word_alone_is_not_a_hit():
+    snapshot = KnowledgeSnapshot(ENTRIES)
+    assert snapshot.search("а для балкона?") is None
+
+
+def test_follow_up_uses_previous_topic(db):
+    async def scenario():
+        window_bot = make_bot(db)
+        try:
+            await send(window_bot, 1, "/start")
+            await send(window_bot, 1, "сколько стоит окно")
+            return await send(window_bot, 1, "а для балкона?")
+        finally:
+            await window_bot.stop()
+    
+    # Ответ о цене (предыдущая тема), а не о случайном вопросе со словом "для"
+    follow_up = asyncio.run(scenario())
+    assert len(follow_up) == 1
+    assert "Стоимость" in follow_up[0]
+    assert "квартиры" not in follow_up[0]
+
+
+def test_follow_ups_keep_the_topic(db):
+    async def scenario():
+        window_bot = make_bot(db)
+        try:
+            await send(window_bot, 1, "/start")
+            await send(window_bot, 1, "сколько стоит окно")
+            for _ in range(3):
+                await send(window_bot, 1, "а для балкона?")
+            return list((await window_bot.contexts.get(1)).topics)
+        finally:
+            await window_bot.stop()
+    
+    assert asyncio.run(scenario()) == ["сколько стоит окно"]
+
+
+def test_follow_up_without_topic_gets_no_answer(db):
+    async def scenario():
+        window_bot = make_bot(db)
+        try:
+            await send(window_bot, 2, "/start")
+            return await send(window_bot, 2, "а для балкона?")
+        finally:
+            await window_bot.stop()
+    
+    assert asyncio.run(scenario()) == [TEMPLATES.text("no_answer")]
+
+
+def _write_kb(path, answer: str, mtime: float):
+    path.write_text(json.dumps([{"question": "гарантия", "answer": answer}]), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def test_reload_swaps_snapshot_under_concurrent_lookups(db, tmp_path):
+    path = tmp_path / "kb.json"
+    _write_kb(path, "Гарантия 3 года", 1000)
+    store = KnowledgeBaseStore(db, source_path=str(path))
+    store.reload()
+    
+    stop = threading.Event()
+    seen, errors = set(), []
+    
+    def lookups():
+        while not stop.is_set():
+            try:
+                seen.add(store.search("гарантия"))
+            except Exception as e:
+                errors.append(e)
+    
+    readers = [threading.Thread(target=lookups) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    try:
+        for version in range(2, 22):
+            _write_kb(path, f"Гарантия {version} лет", 1000 + version)
+            assert store.reload().version == version
+    finally:
+        stop.set()
+        for reader in readers:
+            reader.join()
+    
+    # Поиск всегда видит целый снимок: какую-то версию ответа, но не пустоту
+    assert errors == []
+    assert None not in seen
+    assert seen <= {"Гарантия 3 года"} | {f"Гарантия {version} лет" for version in range(2, 22)}
+    assert store.search("гарантия") == "Гарантия 21 лет"
+
+
+def test_failed_reload_keeps_previous_snapshot(db, tmp_path):
+    path = tmp_path / "kb.json"
+    _write_kb(path, "Гарантия 3 года", 1000)
+    store = KnowledgeBaseStore(db, source_path=str(path), watch_interval=0.01)
+    before = store.reload()
+    
+    path.write_text(json.dumps([{"question": "гарантия"}]), encoding="utf-8")
+    os.utime(path, (2000, 2000))
+    with pytest.raises(ValueError):
+        store.reload()
+    assert store.snapshot is before
+    assert db.get_knowledge_entries() == [("гарантия", "Гарантия 3 года")]
+    
+    # Наблюдатель тоже оставляет прежний снимок и ждет следующего изменения файла
+    store.start()
+    try:
+        time.sleep(0.1)
+        assert store.snapshot is before
+        _write_kb(path, "Гарантия 5 лет", 3000)
+        deadline = time.monotonic() + 2
+        while store.snapshot is before and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        store.stop()
+    assert store.search("гарантия") == "Гарантия 5 лет"
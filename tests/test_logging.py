@@ -0,0 +1,86 @@
+import asyncio
+import io
+import json
+import logging
+import pytest
+from aiogram.types import User
+from bot_logging import CorrelationMiddleware, SamplingFilter, setup_logging
+from tests.conftest import make_update
+
+
+@pytest.fixture
+def log_lines():
+    """Настроить JSON-логирование в буфер; вернуть функцию, дописывающую очередь и читающую строки"""
+    root = logging.getLogger()
+    saved = root.handlers[:], root.level
+    stream = io.StringIO()
+    listener = setup_logging(logging.INFO, stream=stream)
+    stopped = []
+    
+    def read():
+        listener.stop()
+        stopped.append(True)
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        return [line for line in lines if line["logger"] == "windowbot.test"]
+    
+    yield read
+    if not stopped:
+        listener.stop()
+    root.handlers[:], level = saved
+    root.setLevel(level)
+
+
+def test_record_is_one_json_line_with_extra_fields(log_lines):
+    logging.getLogger("windowbot.test").info("Запись %s", "создана", extra={"appointment_id": 7})
+    
+    line, = log_lines()
+    assert line["level"] == "INFO"
+    assert line["logger"] == "windowbot.test"
+    assert line["msg"] == "Запись создана"
+    assert line["appointment_id"] == 7
+    assert line["ts"].endswith("+00:00")
+    assert "exc" not in line
+
+
+def test_traceback_goes_to_its_own_field(log_lines):
+    try:
+        raise RuntimeError("сбой БД")
+    except RuntimeError:
+        logging.getLogger("windowbot.test").exception("Ошибка записи")
+    
+    line, = log_lines()
+    assert line["msg"] == "Ошибка записи"
+    assert line["exc"].startswith("Traceback")
+    assert "RuntimeError: сбой БД" in line["exc"]
+
+
+def test_update_context_is_added_to_every_record(log_lines):
+    update = make_update(5, "привет")
+    
+    async def handler(event, data):
+        logging.getLogger("windowbot.test").info("Обработка")
+    
+    middleware = CorrelationMiddleware(tenant="sever")
+    data = {"event_from_user": User(id=5, is_bot=False, first_name="Тест"), "raw_state": "Booking:date"}
+    asyncio.run(middleware(handler, update, data))
+    logging.getLogger("windowbot.test").info("Вне апдейта")
+    
+    inside, outside = log_lines()
+    assert (inside["update_id"], inside["user_id"], inside["fsm_state"], inside["tenant"]) == (
+        update.update_id, 5, "Booking:date", "sever",
+    )
+    assert "update_id" not in outside
+
+
+def test_debug_records_are_sampled(monkeypatch):
+    draws = iter([0.1, 0.9, 0.3])
+    monkeypatch.setattr("bot_logging.random.random", lambda: next(draws))
+    sampling = SamplingFilter(rate=0.5)
+    
+    def record(level: int) -> logging.LogRecord:
+        return logging.makeLogRecord({"levelno": level})
+    
+    assert [sampling.filter(record(logging.DEBUG)) for _ in range(3)] == [True, False, True]
+    # Остальные уровни не прореживаются и случайное число не тратят
+    assert sampling.filter(record(logging.INFO))
+    assert SamplingFilter(rate=1.0).filter(record(logging.DEBUG))
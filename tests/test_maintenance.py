@@ -0,0 +1,36 @@
+import os
+import sqlite3
+from database import Database
+from maintenance import MaintenanceTask
+
+
+def _legacy_database(path: str) -> Database:
+    """База, созданная до auto_vacuum = INCREMENTAL: режим уже не сменить без VACUUM"""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE legacy (id INTEGER)")
+    conn.commit()
+    conn.close()
+    return Database(path, seed_knowledge_base=False)
+
+
+def test_compact_never_runs_full_vacuum(tmp_path):
+    db = _legacy_database(str(tmp_path / "appointments.db"))
+    task = MaintenanceTask(db, backup_dir=str(tmp_path / "backups"))
+    
+    assert task.compact() == 0
+    assert not db.is_incremental_vacuum_enabled()
+
+
+def test_enable_incremental_vacuum_is_explicit(tmp_path):
+    db = _legacy_database(str(tmp_path / "appointments.db"))
+    assert db.enable_incremental_vacuum()
+    assert db.is_incremental_vacuum_enabled()
+    assert not db.enable_incremental_vacuum()
+
+
+def test_backup_skipped_when_database_unchanged(db, tmp_path):
+    task = MaintenanceTask(db, backup_dir=str(tmp_path / "backups"), keep_backups=2)
+    
+    path = task.backup()
+    assert path is not None and os.path.exists(path)
+    assert task.backup() is None
@@ -0,0 +1,49 @@
+import pytest
+from normalization import address_hash, address_key, clean_address, clean_phone, is_valid_phone, normalize_phone
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("+7 (999) 123-45-67", "+79991234567"),
+    ("89991234567", "+79991234567"),
+    ("79991234567", "+79991234567"),
+    ("9991234567", "+79991234567"),
+    ("+44 20 7946 0958", "+442079460958"),
+    ("12345", None),
+    ("позвоните мне", None),
+])
+def test_normalize_phone(text, expected):
+    assert normalize_phone(text) == expected
+
+
+@pytest.mark.parametrize("text, valid, stored", [
+    ("8 (999) 123-45-67", True, "+79991234567"),
+    ("123-45-67", True, "123-45-67"),
+    ("  22 33  444 ", True, "22 33 444"),
+    ("12345", False, None),
+    ("123-45-6", False, None),
+    ("позвоните 1234567", False, None),
+])
+def test_local_phones_are_accepted_as_typed(text, valid, stored):
+    assert is_valid_phone(text) is valid
+    if valid:
+        assert clean_phone(text) == stored
+
+
+@pytest.mark.parametrize("first, second", [
+    ("улица Ленина, дом 5", "ул. ленина д5"),
+    ("пр-т Победы 3к2", "проспект Победы, д. 3, корп. 2"),
+    ("Мира 12-а", "мира 12а"),
+    ("ул. Зелёная, 7", "улица Зеленая 7"),
+])
+def test_address_variants_share_key(first, second):
+    assert address_key(first) == address_key(second)
+    assert address_hash(first) == address_hash(second)
+
+
+def test_different_houses_have_different_keys():
+    assert address_key("Ленина 5") != address_key("Ленина 15")
+    assert address_key("Ленина 5 к 2") != address_key("Ленина 5")
+
+
+def test_clean_address_collapses_whitespace():
+    assert clean_address("  ул.  Ленина,   д. 5 ") == "ул. Ленина, д. 5"
@@ -0,0 +1,63 @@
+import asyncio
+import tracemalloc
+import profiling
+from profiling import SamplingProfiler, _Sample, call_profiled, current_sample
+
+
+def test_profilers_of_two_bots_do_not_overlap():
+    first = SamplingProfiler(sample_every=1)
+    second = SamplingProfiler(sample_every=1)
+    tracing = []
+    
+    async def inner(event, data):
+        tracing.append(tracemalloc.is_tracing())
+        return "ok"
+    
+    async def outer(event, data):
+        # Апдейт второго бота во время выборки первого
+        result = await second(inner, event, data)
+        tracing.append(tracemalloc.is_tracing())
+        return result
+    
+    assert asyncio.run(first(outer, object(), {})) == "ok"
+    assert tracing == [True, True]
+    assert not tracemalloc.is_tracing()
+    assert first.report().startswith("Апдейтов в выборке: 1")
+    assert second.dump() is None
+    
+    # Когда выборка первого закончилась, второй снова может профилировать
+    asyncio.run(second(inner, object(), {}))
+    assert second.report().startswith("Апдейтов в выборке: 1")
+
+
+class _BusyProfile:
+    """cProfile.Profile на Python 3.12+, когда другой профилировщик уже запущен"""
+    
+    def enable(self):
+        raise ValueError("Another profiling tool is already active")
+    
+    def runcall(self, func, *args, **kwargs):
+        self.enable()
+
+
+def test_db_calls_record_time_only_without_per_thread_profiles(monkeypatch):
+    monkeypatch.setattr(profiling, "PER_THREAD_PROFILES", False)
+    monkeypatch.setattr(profiling.cProfile, "Profile", _BusyProfile)
+    sample = _Sample()
+    token = current_sample.set(sample)
+    try:
+        assert call_profiled(sum, [1, 2, 3]) == 6
+    finally:
+        current_sample.reset(token)
+    assert sample.db_calls == 1
+    assert sample.thread_profiles == []
+
+
+def test_busy_profiler_does_not_fail_the_update(monkeypatch):
+    monkeypatch.setattr(profiling.cProfile, "Profile", _BusyProfile)
+    profiler = SamplingProfiler(sample_every=1)
+    
+    async def handler(event, data):
+        return "ok"
+    
+    assert asyncio.run(profiler(handler, object(), {})) == "ok"
@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any
+from aiogram import BaseMiddleware
+from replay import latency_report, replay
+from tests.conftest import make_bot, make_update
+
+
+class InFlight(BaseMiddleware):
+    """Сколько апдейтов обрабатывалось одновременно"""
+    
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+    
+    async def __call__(self, handler, event, data) -> Any:
+        self.current += 1
+        self.peak = max(self.peak, self.current)
+        # Отдаем управление: одновременно запущенные апдейты успеют войти
+        await asyncio.sleep(0)
+        try:
+            return await handler(event, data)
+        finally:
+            self.current -= 1
+
+
+def test_replay_runs_updates_concurrently_and_keeps_replies_apart(db):
+    updates = [make_update(user_id, text) for text in ("/start", "/help") for user_id in (1, 2, 3)]
+    
+    async def scenario():
+        window_bot = make_bot(db)
+        in_flight = InFlight()
+        window_bot.dp.update.outer_middleware(in_flight)
+        try:
+            replies, latencies = await replay(window_bot, ((None, update) for update in updates))
+        finally:
+            await window_bot.stop()
+        return in_flight.peak, replies, latencies
+    
+    peak, replies, latencies = asyncio.run(scenario())
+    assert peak > 1
+    assert list(replies) == [update.update_id for update in updates]
+    assert len(latencies) == len(updates)
+    assert latency_report(latencies)["count"] == len(updates)
+    for update in updates:
+        texts = replies[update.update_id]
+        assert len(texts) == 1
+        if update.message.text == "/help":
+            assert texts[0].startswith("📋 Доступные команды")
+        else:
+            assert "Тест" in texts[0]
@@ -0,0 +1,87 @@
+from datetime import date, datetime, time, timedelta
+import pytest
+from models import Appointment
+from routes import Gazetteer, plan_routes, suggest_slots
+
+
+GAZETTEER = Gazetteer([
+    ("ул. Ленина, д. 1", 55.750, 37.600),
+    ("ул. Ленина, д. 3", 55.752, 37.600),
+    ("ул. Ленина, д. 5", 55.754, 37.600),
+    ("Мира 10", 55.950, 37.600),
+    ("Мира 12", 55.952, 37.600),
+])
+
+
+def _appointments():
+    bookings = [
+        ("Ленина 5", "10:00"), ("улица Ленина 1", "11:00"), ("Ленина, 3", "12:00"),
+        ("Мира 12", "09:00"), ("Мира 99", "13:00"), ("Неизвестная 1", "14:00"),
+    ]
+    return [
+        Appointment(id=number, user_id=number, date="25.12.2030", time=time, address=address, phone="+79990000000")
+        for number, (address, time) in enumerate(bookings, 1)
+    ]
+
+
+def _addresses(plan):
+    return [[stop.appointment.address for stop in route.stops] for route in plan.routes]
+
+
+def test_gazetteer_falls_back_to_street_center():
+    assert GAZETTEER.locate("улица Ленина 5") == (55.754, 37.600, "house")
+    lat, lon, precision = GAZETTEER.locate("Мира 99")
+    assert (round(lat, 3), lon, precision) == (55.951, 37.600, "street")
+    assert GAZETTEER.locate("Неизвестная 1") is None
+
+
+def test_plan_groups_nearby_addresses_and_orders_them():
+    plan = plan_routes(_appointments(), GAZETTEER, surveyors=2, day="25.12.2030")
+    assert _addresses(plan) == [["Мира 12", "Мира 99"], ["Ленина 5", "Ленина, 3", "улица Ленина 1"]]
+    assert plan.routes[0].stops[1].precision == "street"
+    assert [appt.address for appt in plan.unlocated] == ["Неизвестная 1"]
+    assert abs(plan.routes[1].length_km - 0.004 * 110.57) < 0.01
+    assert "Нет в справочнике адресов (1)" in plan.report()
+
+
+def test_routes_merge_down_to_surveyors_and_split_by_max_stops():
+    merged = plan_routes(_appointments(), GAZETTEER, surveyors=1)
+    assert len(merged.routes) == 1 and len(merged.routes[0].stops) == 5
+    
+    split = plan_routes(_appointments(), GAZETTEER, surveyors=3, max_stops=2)
+    assert len(split.routes) == 3
+    assert max(len(route.stops) for route in split.routes) == 2
+    assert sorted(sum(_addresses(split), [])) == sorted(
+        appt.address for appt in _appointments() if appt.address != "Неизвестная 1"
+    )
+
+
+def test_no_slots_suggested_while_hour_has_room():
+    day = date.today() + timedelta(days=3)
+    assert suggest_slots({(day.isoformat(), 14): 1}, day, 14, capacity=2) == []
+
+
+def test_freest_and_closest_slots_come_first():
+    day = date.today() + timedelta(days=3)
+    loads = {(day.isoformat(), 14): 2, (day.isoformat(), 13): 1, (day.isoformat(), 15): 2}
+    assert suggest_slots(loads, day, 14, capacity=2) == [(day, 12), (day, 16), (day, 13)]
+
+
+def test_only_future_hours_of_the_same_day_are_suggested():
+    today = date.today()
+    now = datetime.combine(today, time(10, 30))
+    loads = {(today.isoformat(), 11): 1}
+    # 10:00 уже началось, 9:00 прошло; соседние дни не предлагаются
+    assert suggest_slots(loads, today, 11, capacity=1, day_start=9, day_end=20, now=now) == [
+        (today, 12), (today, 13),
+    ]
+    assert suggest_slots(loads, today, 11, capacity=1, day_end=13, now=now) == [(today, 12)]
+    yesterday = today - timedelta(days=1)
+    assert suggest_slots({(yesterday.isoformat(), 11): 1}, yesterday, 11, capacity=1, now=now) == []
+
+
+def test_invalid_route_limits_are_rejected():
+    with pytest.raises(ValueError):
+        plan_routes(_appointments(), GAZETTEER, surveyors=0)
+    with pytest.raises(ValueError):
+        plan_routes(_appointments(), GAZETTEER, max_stops=0)
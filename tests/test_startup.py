@@ -0,0 +1,73 @@
+import asyncio
+import io
+import json
+import subprocess
+import sys
+from bot import WindowBot
+from dedup import STATE_KEY
+from startup import StartupTimer
+
+
+def test_phases_and_marks_are_timed_from_origin():
+    timer = StartupTimer()
+    with timer.phase("база данных"):
+        pass
+    timer.mark("начало polling")
+    
+    (phase, phase_at, duration), (mark, mark_at, no_duration) = timer.entries
+    assert (phase, mark, no_duration) == ("база данных", "начало polling", None)
+    assert 0 <= phase_at <= mark_at and duration >= 0
+    assert set(timer.as_dict()) == {"база данных", "начало polling"}
+    
+    out = io.StringIO()
+    timer.report(out)
+    assert out.getvalue().splitlines()[1].startswith("база данных")
+
+
+def test_first_update_hook_fires_once():
+    timer = StartupTimer()
+    fired = []
+    hook = timer.first_update_hook(lambda: fired.append(True))
+    
+    async def handler(event, data):
+        return event
+    
+    async def scenario():
+        return [await hook(handler, update, {}) for update in (1, 2)]
+    
+    assert asyncio.run(scenario()) == [1, 2]
+    assert fired == [True]
+    assert [name for name, _, _ in timer.entries] == ["первый апдейт"]
+
+
+def test_deferred_bot_does_not_touch_db_until_warm_up(db, monkeypatch):
+    db.set_bot_state(STATE_KEY, json.dumps({"floor": 500, "done": [502]}))
+    reads = []
+    for name in ("get_bot_state", "init_knowledge_base", "get_knowledge_entries"):
+        method = getattr(db, name)
+        monkeypatch.setattr(db, name, lambda *args, _name=name, _method=method: reads.append(_name) or _method(*args))
+    
+    async def scenario():
+        window_bot = WindowBot("42:TEST", db=db, defer_warm_up=True)
+        try:
+            assert reads == []
+            assert not window_bot._kb_ready.is_set() and len(window_bot.kb.snapshot) == 0
+            
+            await window_bot.dedup.load()
+            await window_bot._start_warm_up()
+            await window_bot._warm_up_task
+            assert window_bot.dedup.window.top == 502
+            assert window_bot._kb_ready.is_set() and len(window_bot.kb.snapshot) > 0
+        finally:
+            await window_bot.stop()
+    
+    asyncio.run(scenario())
+    assert reads.count("get_bot_state") == 1
+    assert "init_knowledge_base" in reads
+
+
+def test_bot_module_does_not_import_optional_features():
+    code = ("import sys, bot; "
+            "print(sorted(m for m in ('routes', 'profiling', 'kb_mining', 'dedup') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,11 @@
+import pytest
+from stress import stress_test
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("seed", [1, 2])
+def test_concurrent_bookings_keep_invariants(tmp_path, seed):
+    run, _, problems = stress_test(str(tmp_path / "stress.db"), threads=3, tasks=6, ops=40, workers=3, seed=seed)
+    assert problems == []
+    assert run.bookings_ok > 0
+    assert sum(map(len, run.latencies.values())) == (3 + 6) * 40
@@ -0,0 +1,41 @@
+import json
+import pytest
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+from templates import TEMPLATES, TemplateRegistry, brand_registry
+
+
+def test_markup_is_built_once_and_shared():
+    registry = TemplateRegistry()
+    keyboard = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="Да")]])
+    registry.add_markup("kb", keyboard)
+    
+    assert registry.markup("kb") is keyboard
+    assert registry.markup("kb", "en") is keyboard
+    assert TEMPLATES.markup("main") is TEMPLATES.markup("main", "de")
+
+
+def test_locale_falls_back_to_default():
+    registry = TemplateRegistry()
+    registry.add_text("hello", "Привет, {name}")
+    registry.add_text("hello", "Hello, {name}", locale="en")
+    registry.add_markup("kb", ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text="Да")]]))
+    
+    assert registry.render("hello", "en", name="Ann") == "Hello, Ann"
+    assert registry.render("hello", "de", name="Ann") == "Привет, Ann"
+    assert registry.markup("kb", "en").keyboard[0][0].text == "Да"
+
+
+def test_brand_registry_overrides_texts_per_locale(tmp_path):
+    assert brand_registry() is TEMPLATES
+    
+    path = tmp_path / "texts.json"
+    path.write_text(json.dumps({"help": "Справка бренда", "ask": {"en": "Ask us"}}), encoding="utf-8")
+    registry = brand_registry("Окна Юга", str(path))
+    assert "компании Окна Юга" in registry.text("welcome_body")
+    assert registry.text("help") == "Справка бренда"
+    assert registry.text("ask", "en") == "Ask us"
+    assert registry.text("ask") == TEMPLATES.text("ask")
+    
+    path.write_text(json.dumps({"welcom_body": "опечатка"}), encoding="utf-8")
+    with pytest.raises(ValueError, match="welcom_body"):
+        brand_registry("Окна Юга", str(path))
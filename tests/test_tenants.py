@@ -0,0 +1,106 @@
+import asyncio
+import json
+import os
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import GetUpdates, SendMessage
+from config import Config, ConfigError
+from replay import FakeBotSession
+from templates import TEMPLATES
+from tenants import QuotaSession, load_tenants, tenant_config
+from tests.conftest import send
+
+
+def _tenants_file(tmp_path, data) -> str:
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return str(path)
+
+
+def test_tenant_data_lives_in_its_own_directory():
+    base = Config().override("bot", token="42:SHARED").override("database", workers=12)
+    config = tenant_config(base, "sever", {"throttling": {"rate_limit": 3}})
+    root = os.path.join("tenants", "sever")
+    assert config.bot.name == "sever"
+    # Общий токен бренду не достается: у него свой token.txt
+    assert (config.bot.token, config.bot.token_file) == ("", os.path.join(root, "token.txt"))
+    assert config.database.path == os.path.join(root, "appointments.db")
+    assert config.maintenance.backup_dir == os.path.join(root, "backups")
+    assert config.profiling.output_dir == os.path.join(root, "profiles")
+    assert (config.database.workers, config.throttling.rate_limit) == (12, 3)
+    
+    with pytest.raises(ConfigError, match="общие ресурсы"):
+        tenant_config(base, "sever", {"shared": {"db_workers": 1}})
+
+
+def test_load_tenants_rejects_shared_database_and_token(tmp_path):
+    path = _tenants_file(tmp_path, {
+        "sever": {"database": {"path": "one.db"}, "bot": {"token": "1:A"}},
+        "yug": {"database": {"path": "one.db"}, "bot": {"token": "1:A"}},
+        "bad name": {},
+    })
+    with pytest.raises(ConfigError) as error:
+        load_tenants(path, Config())
+    assert sorted(error.value.errors) == sorted([
+        "bad name: имя бренда - латиница, цифры, '_' и '-'",
+        "database.path: у каждого бренда должно быть свое значение",
+        "bot.token: у каждого бренда должно быть свое значение",
+    ])
+    
+    configs = load_tenants(_tenants_file(tmp_path, {"sever": {}, "yug": {"database": {"workers": 2}}}), Config())
+    assert list(configs) == ["sever", "yug"]
+    assert configs["sever"].database.path != configs["yug"].database.path
+
+
+def test_quota_session_limits_requests_per_bot(monkeypatch):
+    active = {}
+    peak = {}
+    
+    async def fake_request(self, bot, method, timeout=None):
+        active[bot.id] = active.get(bot.id, 0) + 1
+        peak[bot.id] = max(peak.get(bot.id, 0), active[bot.id])
+        await asyncio.sleep(0.01)
+        active[bot.id] -= 1
+        return True
+    
+    monkeypatch.setattr(AiohttpSession, "make_request", fake_request)
+    
+    async def scenario():
+        session = QuotaSession(requests_per_bot=2)
+        first, second = Bot("1:A", session=session), Bot("2:B", session=session)
+        send_message = SendMessage(chat_id=1, text="привет")
+        await asyncio.gather(*(session.make_request(bot, send_message) for bot in (first, second) * 5))
+        assert peak == {1: 2, 2: 2}
+        # Long polling в квоту не входит
+        peak.clear()
+        await asyncio.gather(*(session.make_request(first, GetUpdates()) for _ in range(4)))
+        assert peak == {1: 4}
+    
+    asyncio.run(scenario())
+
+
+def test_brand_greets_with_its_own_company(db, tmp_path):
+    from bot import WindowBot
+    
+    texts = tmp_path / "texts.json"
+    texts.write_text(json.dumps({"ask": "Спросите Северные Окна"}), encoding="utf-8")
+    config = Config().override("branding", company="Северные Окна", templates_file=str(texts))
+    
+    async def scenario():
+        window_bot = WindowBot("42:TEST", db=db, config=config)
+        window_bot.bot = Bot("42:TEST", session=FakeBotSession())
+        window_bot.throttling.rate_limit = float("inf")
+        try:
+            welcome, = await send(window_bot, 1, "/start")
+            asked = await send(window_bot, 1, "/ask")
+        finally:
+            await window_bot.stop()
+        return welcome, asked, window_bot.templates
+    
+    welcome, asked, templates = asyncio.run(scenario())
+    assert "компании Северные Окна" in welcome
+    assert asked == ["Спросите Северные Окна"]
+    assert templates is not TEMPLATES
+    assert "Народные Окна" in TEMPLATES.text("welcome_body")
+    assert "Северные Окна" in db.search_knowledge_base("кто вы")
@@ -0,0 +1,71 @@
+import asyncio
+from templates import TEMPLATES
+from tests.conftest import make_bot, send
+from throttling import ThrottlingMiddleware
+
+
+def test_rate_limit_blocks_with_growing_penalty():
+    throttling = ThrottlingMiddleware(rate_limit=3, window=10, duplicate_window=0, penalty=30, max_penalty=100)
+    assert [throttling.check(1, f"м{i}", now=i) for i in range(3)] == ["allowed"] * 3
+    assert throttling.check(1, "м3", now=3) == "throttled"
+    assert throttling.check(1, "м4", now=20) == "blocked"
+    # Другого пользователя блокировка не касается
+    assert throttling.check(2, "м0", now=3) == "allowed"
+    
+    # Блокировка кончилась в 33; следующее нарушение - вдвое дольше
+    assert [throttling.check(1, f"н{i}", now=33 + i) for i in range(3)] == ["allowed"] * 3
+    assert throttling.check(1, "н3", now=36) == "throttled"
+    assert throttling.check(1, "н4", now=95) == "blocked"
+    assert throttling.check(1, "н5", now=96) == "allowed"
+
+
+def test_window_slides_and_penalty_is_capped():
+    throttling = ThrottlingMiddleware(rate_limit=2, window=10, duplicate_window=0, penalty=30, max_penalty=40)
+    assert throttling.check(1, "а", now=0) == "allowed"
+    assert throttling.check(1, "б", now=5) == "allowed"
+    # Первое сообщение вышло из окна
+    assert throttling.check(1, "в", now=10) == "allowed"
+    assert throttling.check(1, "г", now=11) == "throttled"
+    assert throttling._users[1].blocked_until == 41
+    assert throttling.check(1, "д", now=41) == "allowed"
+    assert throttling.check(1, "е", now=42) == "allowed"
+    assert throttling.check(1, "ж", now=43) == "throttled"
+    assert throttling._users[1].blocked_until == 83
+
+
+def test_duplicates_are_suppressed_within_window():
+    throttling = ThrottlingMiddleware(rate_limit=10, window=10, duplicate_window=5)
+    assert throttling.check(1, "привет", now=0) == "allowed"
+    assert throttling.check(1, "привет", now=3) == "duplicates"
+    # Каждый повтор продлевает окно дублей
+    assert throttling.check(1, "привет", now=7) == "duplicates"
+    assert throttling.check(1, "привет", now=13) == "allowed"
+    assert throttling.check(1, "пока", now=14) == "allowed"
+
+
+def test_least_recent_users_are_forgotten():
+    throttling = ThrottlingMiddleware(max_users=2)
+    throttling.check(1, "а", now=0)
+    throttling.check(2, "а", now=1)
+    throttling.check(1, "б", now=2)
+    throttling.check(3, "а", now=3)
+    assert list(throttling._users) == [1, 3]
+
+
+def test_middleware_warns_once_and_skips_handlers(db):
+    async def scenario():
+        window_bot = make_bot(db)
+        window_bot.throttling.rate_limit = 2
+        try:
+            await send(window_bot, 1, "/start")
+            await send(window_bot, 1, "/help")
+            throttled = await send(window_bot, 1, "/help again")
+            blocked = await send(window_bot, 1, "/my_appointments")
+            return throttled, blocked, dict(window_bot.throttling.counters)
+        finally:
+            await window_bot.stop()
+    
+    throttled, blocked, counters = asyncio.run(scenario())
+    assert throttled == [TEMPLATES.render("throttled", wait=30)]
+    assert blocked == []
+    assert counters == {"allowed": 2, "throttled": 1, "duplicates": 0, "blocked": 1}
@@ -0,0 +1,121 @@
+"""
+Защита от флуда: ограничение частоты сообщений и подавление дублей
+
+Middleware срабатывает до хендлеров, поэтому сообщения сверх лимита
+отбрасываются без единого обращения к базе данных и базе знаний.
+"""
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+from templates import TEMPLATES, TemplateRegistry
+
+
+class _UserLimits:
+    """Состояние лимитов одного пользователя"""
+    
+    __slots__ = ("timestamps", "last_text_hash", "last_text_at", "blocked_until", "strikes")
+    
+    def __init__(self):
+        self.timestamps: Deque[float] = deque()
+        self.last_text_hash: Optional[int] = None
+        self.last_text_at = 0.0
+        self.blocked_until = 0.0
+        self.strikes = 0
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничение сообщений от одного пользователя
+    
+    - не более `rate_limit` сообщений за скользящее окно `window` секунд;
+    - одинаковые сообщения подряд в течение `duplicate_window` секунд отбрасываются;
+    - при превышении лимита пользователь блокируется на `penalty` секунд,
+      при повторных нарушениях срок удваивается до `max_penalty`.
+    """
+    
+    def __init__(self, rate_limit: int = 5, window: float = 10.0, duplicate_window: float = 5.0,
+                 penalty: float = 30.0, max_penalty: float = 600.0, max_users: int = 100_000,
+                 templates: TemplateRegistry = TEMPLATES):
+        self.rate_limit = rate_limit
+        self.window = window
+        self.duplicate_window = duplicate_window
+        self.penalty = penalty
+        self.max_penalty = max_penalty
+        self.max_users = max_users
+        # Текст предупреждения - из реестра бренда
+        self.templates = templates
+        self._users: "OrderedDict[int, _UserLimits]" = OrderedDict()
+        self.counters: Dict[str, int] = {"allowed": 0, "throttled": 0, "duplicates": 0, "blocked": 0}
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, Message) or event.from_user is None:
+            return await handler(event, data)
+        
+        verdict = self.check(event.from_user.id, event.text)
+        self.counters[verdict] += 1
+        if verdict == "allowed":
+            return await handler(event, data)
+        
+        if verdict == "throttled":
+            # Предупреждаем один раз, в момент блокировки
+            wait = int(self._users[event.from_user.id].blocked_until - time.monotonic()) + 1
+            locale = event.from_user.language_code
+            await event.answer(self.templates.render("throttled", locale, wait=wait))
+        return None
+    
+    def check(self, user_id: int, text: Optional[str], now: Optional[float] = None) -> str:
+        """
+        Проверить сообщение пользователя
+        
+        Returns:
+            str: "allowed", "throttled" (превышен лимит), "blocked" (действует блокировка)
+                 или "duplicates" (повтор предыдущего сообщения)
+        """
+        now = time.monotonic() if now is None else now
+        limits = self._get_limits(user_id)
+        
+        if now < limits.blocked_until:
+            return "blocked"
+        if limits.strikes and now - limits.blocked_until > self.max_penalty:
+            # Давно не нарушал - прощаем прошлые нарушения
+            limits.strikes = 0
+        
+        if text is not None:
+            text_hash = hash(text)
+            if text_hash == limits.last_text_hash and now - limits.last_text_at < self.duplicate_window:
+                limits.last_text_at = now
+                return "duplicates"
+            limits.last_text_hash = text_hash
+            limits.last_text_at = now
+        
+        timestamps = limits.timestamps
+        while timestamps and now - timestamps[0] >= self.window:
+            timestamps.popleft()
+        
+        if len(timestamps) >= self.rate_limit:
+            limits.strikes += 1
+            limits.blocked_until = now + min(self.penalty * 2 ** (limits.strikes - 1), self.max_penalty)
+            timestamps.clear()
+            return "throttled"
+        
+        timestamps.append(now)
+        return "allowed"
+    
+    def _get_limits(self, user_id: int) -> _UserLimits:
+        limits = self._users.get(user_id)
+        if limits is None:
+            limits = _UserLimits()
+            self._users[user_id] = limits
+            if len(self._users) > self.max_users:
+                # Забываем самых давно писавших пользователей
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return limits